@@ -1,12 +1,19 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from ezidapp.models.identifier import SearchIdentifier
 from impl.open_search_doc import OpenSearchDoc
 import json
 import datetime
 import impl.open_search_schema as oss
-from django.db.models import Q
+from django.db.models import Q, Max, Min
 import dateutil.parser
+import django
+import itertools
+import multiprocessing
+import opensearchpy.helpers
+import os
+import queue
+import time
 
 
 # this is only for the time being since I'm using a local server without correct SSL/https
@@ -20,6 +27,13 @@ urllib3.disable_warnings(InsecureRequestWarning)
 SPLIT_SIZE = 10
 DB_PAGE_SIZE = 100
 
+# defaults for --reindex
+REINDEX_WORKERS = 4
+REINDEX_PAGE_SIZE = 1000
+REINDEX_BULK_SIZE = 1000
+REINDEX_CHECKPOINT = 'opensearch-reindex.checkpoint.json'
+REINDEX_PROGRESS_INTERVAL = 10  # seconds
+
 # run: python manage.py opensearch-update
 # optional parameters: --starting_id 1234 --updated_since 2023-10-10T00:00:00Z
 # --starting_id is the primary key ID to start populating from (good for resuming after a crash while populating all)
@@ -35,6 +49,22 @@ DB_PAGE_SIZE = 100
 # Identifier update time instead, but that might be a different time that does not take into account the link checker
 # which is updates in the SearchIdentifier table and doesn't update the Identifier table.
 
+# Full reindex: python manage.py opensearch-update --reindex [--workers 8] [--bulk_size 2000]
+# The primary key range of SearchIdentifier is split into partitions (--partitions, default 4 per worker) that are
+# indexed in parallel by a pool of worker processes. Each partition is read in primary key order, a page at a time,
+# and sent to OpenSearch in _bulk requests of --bulk_size documents. After each _bulk request, the position in the
+# partition is saved to the checkpoint file (--checkpoint), and running the same command again resumes from there.
+# Delete the checkpoint file (or use --restart) to start over. --updated_since can be combined with --reindex.
+
+# Rebuild without downtime: python manage.py opensearch-update --rebuild [--workers 8]
+# Loads a new, versioned index with refreshes and replicas turned off, as with --reindex, then restores the search
+# settings, force-merges it, and points the OPENSEARCH_INDEX alias at it atomically. Searches use the old index until
+# the swap. While loading, the indexer and link checker write to both indexes (see OpenSearchDoc.REBUILD_ALIAS), and
+# documents they wrote are not overwritten by the load, so no changes are lost. Deletes, and updates of documents not
+# yet loaded, leave tombstones in the new index, which are replaced with the current state of the database before the
+# swap, and again once the writers have stopped writing tombstones after it. An interrupted rebuild resumes from the
+# checkpoint file. The previous index is left in place, to be deleted with opensearch-delete.
+
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
@@ -46,11 +76,22 @@ class Command(BaseCommand):
         # for ident in all_identifiers: ...
         # ^^^ The above code would lock up.  I think it has to do with the count taking about 10 minutes to get. ^^^
 
+        if options['rebuild']:
+            self._rebuild(options)
+            return
+
         # create the index if it doesn't exist from the schema
         if oss.index_exists() is False:
             print('index does not exist, so creating it')
             oss.create_index()
 
+        if options['reindex']:
+            checkpoint = self._read_checkpoint(options)
+            if checkpoint is None:
+                checkpoint = self._new_checkpoint(options)
+            self._reindex(options, checkpoint)
+            return
+
         string_parts = []
         counter = 0
         if options['starting_id']:
@@ -102,6 +143,162 @@ class Command(BaseCommand):
                             ' (YYYY-MM-DDTHH:MM:SS) example: 2023-10-10T00:00:00Z.'
                             ' The date parser may support other common formats also.')
 
+        parser.add_argument('--reindex', action='store_true',
+                            help='Reindex with parallel workers, resuming from the checkpoint file if it exists')
+        parser.add_argument('--workers', type=int, default=REINDEX_WORKERS,
+                            help=f'Number of worker processes for --reindex (default {REINDEX_WORKERS})')
+        parser.add_argument('--partitions', type=int, default=0,
+                            help='Number of primary key ranges for --reindex (default 4 per worker)')
+        parser.add_argument('--page_size', type=int, default=REINDEX_PAGE_SIZE,
+                            help=f'Rows read from the database per query for --reindex (default {REINDEX_PAGE_SIZE})')
+        parser.add_argument('--bulk_size', type=int, default=REINDEX_BULK_SIZE,
+                            help=f'Documents per _bulk request for --reindex (default {REINDEX_BULK_SIZE})')
+        parser.add_argument('--checkpoint', type=str, default=REINDEX_CHECKPOINT,
+                            help=f'Checkpoint file for --reindex (default {REINDEX_CHECKPOINT})')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint file and reindex from the start')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Load a new index as with --reindex, then swap it in for the live index')
+
+    @staticmethod
+    def _read_checkpoint(options):
+        if options['restart'] or not os.path.exists(options['checkpoint']):
+            return None
+        with open(options['checkpoint']) as f:
+            checkpoint = json.load(f)
+        print(f"Resuming from checkpoint {options['checkpoint']} "
+              f"(index: {checkpoint.get('index') or settings.OPENSEARCH_INDEX}, "
+              f"updated_since: '{checkpoint['updated_since']}')")
+        return checkpoint
+
+    @staticmethod
+    def _new_checkpoint(options, index=None):
+        checkpoint = {
+            'index': index,
+            'updated_since': options['updated_since'],
+            'partitions': _partitions(options['partitions'] or 4 * options['workers'], options['starting_id']),
+        }
+        _write_checkpoint(options['checkpoint'], checkpoint)
+        return checkpoint
+
+    def _rebuild(self, options):
+        if options['updated_since']:
+            raise CommandError('--updated_since cannot be used with --rebuild, which must load all identifiers')
+        checkpoint = self._read_checkpoint(options)
+        if checkpoint is None or not checkpoint.get('index'):
+            index = oss.new_index_name()
+            oss.start_rebuild(index)
+            print(f'Created index {index}. Waiting for writers to start writing to it.')
+            # writers check for a rebuild every OPENSEARCH_REBUILD_CHECK_INTERVAL seconds, and the load must not
+            # start before they all write to the new index
+            time.sleep(2 * settings.OPENSEARCH_REBUILD_CHECK_INTERVAL)
+            checkpoint = self._new_checkpoint(options, index)
+        index = checkpoint['index']
+
+        # with op_type 'create', the load does not overwrite documents written by the indexer, which are newer
+        self._reindex(options, checkpoint, op_type='create')
+        self._resolve_tombstones(index, options['bulk_size'])
+
+        print(f'Restoring index settings and force-merging {index}')
+        old_indexes = oss.finish_rebuild(index)
+        os.remove(options['checkpoint'])
+        print(f'{settings.OPENSEARCH_INDEX} now points at {index} (previously: {", ".join(old_indexes) or "none"})')
+
+        # writers may write tombstones until they notice that the rebuild alias is gone
+        time.sleep(2 * settings.OPENSEARCH_REBUILD_CHECK_INTERVAL)
+        self._resolve_tombstones(index, options['bulk_size'])
+
+    @staticmethod
+    def _resolve_tombstones(index, bulk_size):
+        """Replace the tombstones in index with the current state of the database
+
+        A tombstone is replaced only if it has not been overwritten since it was read, as writers may still be writing
+        to the index. Tombstones of identifiers that no longer exist are deleted.
+        """
+        OpenSearchDoc.CLIENT.indices.refresh(index=index)
+        hits = opensearchpy.helpers.scan(
+            OpenSearchDoc.CLIENT,
+            index=index,
+            query={'query': {'term': {'rebuild_tombstone': True}}},
+            seq_no_primary_term=True,
+        )
+        tombstone_count = 0
+        while True:
+            batch = list(itertools.islice(hits, bulk_size))
+            if not batch:
+                break
+            search_identifiers = {
+                si.identifier: si
+                for si in SearchIdentifier.objects.filter(identifier__in=[hit['_id'] for hit in batch])
+                .select_related('owner', 'ownergroup', 'datacenter', 'profile')
+            }
+            body = []
+            for hit in batch:
+                action = {'_index': index, '_id': hit['_id'], 'if_seq_no': hit['_seq_no'],
+                          'if_primary_term': hit['_primary_term']}
+                si = search_identifiers.get(hit['_id'])
+                os_doc = None
+                if si is not None:
+                    try:
+                        os_doc = OpenSearchDoc(identifier=si, search_identifier=si).dict_for_identifier()
+                    except Exception as e:
+                        print(f'Error updating OpenSearch: {si.identifier}: Error building OpenSearch document: {e}')
+                if os_doc is None:
+                    body.append({'delete': action})
+                else:
+                    os_doc['open_search_updated'] = datetime.datetime.now().isoformat()
+                    body += [{'index': action}, os_doc]
+            response = OpenSearchDoc.CLIENT.bulk(body=body)
+            # a conflict means that a writer has replaced the tombstone, with a newer document
+            errors = [
+                item_result for item in response['items'] for item_result in item.values()
+                if 'error' in item_result and item_result.get('status') != 409
+            ]
+            for item_result in errors[:10]:
+                print(f"Error updating OpenSearch: {item_result.get('_id')}: {item_result['error']}")
+            tombstone_count += len(batch)
+        print(f'Resolved {tombstone_count} tombstones in {index}')
+
+    def _reindex(self, options, checkpoint, op_type='index'):
+        partitions = checkpoint['partitions']
+        todo = [i for i, p in enumerate(partitions) if p['last_id'] < p['hi']]
+        progress = _Progress(partitions)
+        if not todo:
+            print('Nothing to reindex, all partitions are done.')
+            return
+
+        # Worker processes are spawned, not forked, so that they don't share the database and OpenSearch connections
+        # of this process.
+        ctx = multiprocessing.get_context('spawn')
+        progress_queue = ctx.Queue()
+        with ctx.Pool(options['workers'], initializer=_init_worker, initargs=(progress_queue,)) as pool:
+            result = pool.map_async(
+                _reindex_partition,
+                [(i, partitions[i]['last_id'], partitions[i]['hi'], checkpoint['updated_since'],
+                  options['page_size'], options['bulk_size'], checkpoint.get('index'), op_type) for i in todo],
+                chunksize=1,
+            )
+            last_report = time.time()
+            while True:
+                try:
+                    i, last_id, doc_count, error_count = progress_queue.get(timeout=1)
+                except queue.Empty:
+                    if result.ready():
+                        break
+                    continue
+                partitions[i]['last_id'] = last_id
+                progress.update(doc_count, error_count)
+                _write_checkpoint(options['checkpoint'], checkpoint)
+                if time.time() - last_report >= REINDEX_PROGRESS_INTERVAL:
+                    print(progress.report())
+                    last_report = time.time()
+            result.get()  # raises if a worker failed; the checkpoint keeps the completed work
+        for i in todo:
+            partitions[i]['last_id'] = partitions[i]['hi']
+        _write_checkpoint(options['checkpoint'], checkpoint)
+        print(progress.report())
+        print('Reindex complete.')
+
     # see https://opensearch.org/docs/latest/api-reference/document-apis/bulk/
     @staticmethod
     def _bulk_update_pair(identifier: SearchIdentifier) -> str:
@@ -126,5 +323,96 @@ class Command(BaseCommand):
             return True
 
 
+def _partitions(count, starting_id):
+    """Split the primary key range of SearchIdentifier into count ranges (lo, hi]
+
+    last_id is the last primary key indexed in the range.
+    """
+    agg = SearchIdentifier.objects.filter(id__gt=starting_id).aggregate(lo=Min('id'), hi=Max('id'))
+    if agg['lo'] is None:
+        return []
+    lo = agg['lo'] - 1
+    step = max(1, -(-(agg['hi'] - lo) // count))
+    return [
+        {'lo': start, 'hi': min(start + step, agg['hi']), 'last_id': start}
+        for start in range(lo, agg['hi'], step)
+    ]
+
+
+def _write_checkpoint(path, checkpoint):
+    # Replace the file atomically, so that an interrupted write does not lose the checkpoint.
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+class _Progress:
+    """Reindex progress, estimated from the fraction of the primary key ranges that has been indexed"""
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.start_time = time.time()
+        self.start_fraction = self.fraction()
+        self.doc_count = 0
+        self.error_count = 0
+
+    def fraction(self):
+        total = sum(p['hi'] - p['lo'] for p in self.partitions)
+        done = sum(p['last_id'] - p['lo'] for p in self.partitions)
+        return done / total if total else 1.0
+
+    def update(self, doc_count, error_count):
+        self.doc_count += doc_count
+        self.error_count += error_count
+
+    def report(self):
+        elapsed = time.time() - self.start_time
+        fraction = self.fraction()
+        rate = fraction - self.start_fraction
+        eta = elapsed * (1.0 - fraction) / rate if rate > 0 else None
+        return (
+            f'{fraction:.1%} done, {self.doc_count} docs ({self.error_count} errors) '
+            f'in {datetime.timedelta(seconds=int(elapsed))}, {self.doc_count / max(elapsed, 1):.0f} docs/sec, '
+            f'ETA {datetime.timedelta(seconds=int(eta)) if eta is not None else "unknown"}'
+        )
+
+
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    django.setup()
+    _progress_queue = progress_queue
 
 
+def _reindex_partition(args):
+    """Index the primary key range (last_id, hi] of SearchIdentifier, reporting progress after each _bulk request"""
+    i, last_id, hi, updated_since, page_size, bulk_size, index, op_type = args
+    additional_filter = Q()
+    if updated_since:
+        additional_filter = Q(updateTime__gte=dateutil.parser.parse(updated_since).timestamp())
+    docs = []
+    while last_id < hi:
+        page = list(
+            SearchIdentifier.objects.filter(id__gt=last_id, id__lte=hi)
+            .filter(additional_filter)
+            .select_related('owner', 'ownergroup', 'datacenter', 'profile')
+            .order_by('id')[:page_size]
+        )
+        # the end of the range is reached when a page comes back short
+        page_last_id = page[-1].id if len(page) == page_size else hi
+        docs.extend(OpenSearchDoc(identifier=si, search_identifier=si) for si in page)
+        while len(docs) >= bulk_size or (docs and page_last_id == hi):
+            batch, docs = docs[:bulk_size], docs[bulk_size:]
+            errors = {k: v for k, v in OpenSearchDoc.bulk_index(index_docs=batch, index=index, op_type=op_type).items() if v is not None}
+            for identifier, error in list(errors.items())[:10]:
+                print(f'Error updating OpenSearch: {identifier}: {error}')
+            # docs still buffered are not covered by the checkpoint
+            checkpoint_id = docs[0].identifier.id - 1 if docs else page_last_id
+            _progress_queue.put((i, checkpoint_id, len(batch), len(errors)))
+        if not page or page_last_id == hi:
+            _progress_queue.put((i, hi, 0, 0))
+            break
+        last_id = page_last_id
@@ -154,8 +154,9 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
                         log.info("Running job for identifier: " + refId.identifier + " in " + key + " queue")
 
                         # delete identifier if the status is successfully synced or
-                        # not applicable for this handle system
-                        if (task_model.status==queue.SUCCESS or task_model.status==queue.IGNORED):
+                        # not applicable for this handle system, or superseded by a later task
+                        if (task_model.status==queue.SUCCESS or task_model.status==queue.IGNORED
+                                or task_model.status==queue.SUPERSEDED):
                             log.info(
                                 "Delete identifier: " + refId.identifier + " in " + key + " queue")
                             identifierStatus[key] = True
@@ -11,6 +11,12 @@ Identifier operation entries are retrieved by querying the database;
 operations that successfully completed or are a no-op are deleted based on
 pre-set interval.
 
+The cleanup is set based. RefIdentifiers are read in pages of ids, and each page is
+processed in batches: the completed tasks of the batch are deleted from all the queues,
+then the RefIdentifiers that are no longer referenced by any queue are found with an
+anti-join across the queues, and deleted. Each batch is a few bounded
+DELETE ... WHERE ... IN (...) statements in a single transaction.
+
 """
 
 import logging
@@ -21,7 +27,7 @@ from dateutil.parser import parse
 import django.conf
 import django.db
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 
 import ezidapp.management.commands.proc_base
 import ezidapp.models.identifier
@@ -52,6 +58,8 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
         super().add_arguments(parser)
         parser.add_argument(
             '--pagesize', help='Rows in each batch select.', type=int)
+        parser.add_argument(
+            '--deletesize', help='RefIdentifiers in each batch delete.', type=int)
 
         parser.add_argument(
             '--updated_range_from', type=str,
@@ -114,61 +122,40 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             time_range = Q(updateTime__gte=min_age_ts) & Q(updateTime__lte=max_age_ts)
             time_range_str = f"updated between: {self.seconds_to_date(min_age_ts)} and {self.seconds_to_date(max_age_ts)}"
 
+        DELETE_BATCH_SIZE = self.opt.deletesize
+        if DELETE_BATCH_SIZE is None:
+            DELETE_BATCH_SIZE = 1000
+
         last_id = 0
+        range_start_ts = self.now()
+        range_counts = [0, 0]
         # keep running until terminated
         while not self.terminated():
             # retrieve identifiers with update timestamp within a date range
             filter = time_range & Q(id__gt=last_id)
-            refIdsQS = self.refIdentifier.objects.filter(filter).order_by("pk")[: BATCH_SIZE]
+            refIdList = list(
+                self.refIdentifier.objects.filter(filter)
+                .order_by("pk")
+                .values_list("pk", flat=True)[: BATCH_SIZE]
+            )
 
             log.info(f"Checking ref Ids: {time_range_str}")
-            log.info(f"Checking ref Ids returned: {len(refIdsQS)} records")
-
-            # iterate over query set to check each identifier status
-            for refId in refIdsQS:
-                last_id = refId.pk
-
-                # set status for each handle system
-                identifierStatus = {
-                    'crossref' : False,
-                    'datacite' : False,
-                    'search' : False
-                }
-
-                # check if the identifier is processed for each background job 
-                for key, value in self.queueType.items():
-                    queue = value
-
-                    qs = queue.objects.filter(
-                        Q(refIdentifier_id=refId.pk)
-                    )
-
-                    # if the identifier does not exist in the table
-                    # mark as 'OK' to delete from the refIdentifier
-                    if not qs:
-                        identifierStatus[key] = True
-                        continue
-
-                    for task_model in qs:
-                        log.info('-' * 10)
-                        log.info("Running job for identifier: " + refId.identifier + " in " + key + " queue")
-
-                        # delete identifier if the status is successfully synced or
-                        # not applicable for this handle system
-                        if (task_model.status==queue.SUCCESS or task_model.status==queue.IGNORED):
-                            log.info(
-                                "Delete identifier: " + refId.identifier + " in " + key + " queue")
-                            identifierStatus[key] = True
-                            self.deleteRecord(queue, task_model.pk, record_type=key, identifier=refId.identifier)
-
-                # if the identifier is successfully processed for all the handle system
-                # delete it from the refIdentifier table
-                if all(i for i in identifierStatus.values()):
-                    log.info(
-                        "Delete identifier: " + refId.identifier + " from refIdentifier table.")
-                    self.deleteRecord(self.refIdentifier, refId.pk, record_type='refId', identifier=refId.identifier)
-
-            if len(refIdsQS) < BATCH_SIZE:
+            log.info(f"Checking ref Ids returned: {len(refIdList)} records")
+
+            start_ts = self.now()
+            counts = [0, 0]
+            for i in range(0, len(refIdList), DELETE_BATCH_SIZE):
+                batch_counts = self.deleteCompleted(refIdList[i : i + DELETE_BATCH_SIZE])
+                counts = [a + b for a, b in zip(counts, batch_counts)]
+            if refIdList:
+                last_id = refIdList[-1]
+                self.logThroughput("Deleted", counts, self.now() - start_ts)
+            range_counts = [a + b for a, b in zip(range_counts, counts)]
+
+            if len(refIdList) < BATCH_SIZE:
+                self.logThroughput(
+                    f"Finished {time_range_str}, deleted", range_counts, self.now() - range_start_ts
+                )
                 if updated_from is not None or updated_to is not None:
                     log.info(f"Finished - Checking ref Ids: {time_range_str}")
                     exit()
@@ -176,6 +163,8 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
                     log.info(f"Sleep {ASYNC_CLEANUP_SLEEP} seconds before processing next time range.")
                     self.sleep(ASYNC_CLEANUP_SLEEP)
                     last_id = 0
+                    range_start_ts = self.now()
+                    range_counts = [0, 0]
                     min_age_ts = max_age_ts
                     max_age_ts = int(time.time()) - django.conf.settings.DAEMONS_EXPUNGE_MAX_AGE_SEC
                     time_range = Q(updateTime__gte=min_age_ts) & Q(updateTime__lte=max_age_ts)
@@ -183,34 +172,51 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             else:
                 self.sleep(django.conf.settings.DAEMONS_BATCH_SLEEP)
 
-    def deleteRecord(self, queue, primary_key, record_type=None, identifier=None):
+    def deleteCompleted(self, refIdList):
         """
-            Deletes the identifier record that has been successfully completed
-            based on the record's primary key provided
+            Deletes the completed tasks of a batch of RefIdentifiers from all the
+            queues, and the RefIdentifiers that are then no longer referenced by any
+            queue
 
         Args:
-            queue : async handle queue
-            primary_key (str): primary key of the record to be deleted.
-            record_type (str): . Defaults to None.
-            identifier (str): . Defaults to None.
+            refIdList (list): primary keys of the RefIdentifiers.
+
+        Returns:
+            (int, int): number of queue rows and of RefIdentifiers deleted.
         """
+        task_count = 0
+        ref_id_count = 0
         try:
-            # check if the record to be deleted is a refIdentifier record
-            if (record_type is not None and record_type == 'refId'):
-                log.info(f"Delete from {queue.__name__} refId: " + str(primary_key))
-                with transaction.atomic():
-                    obj = queue.objects.select_for_update().get(id=primary_key)
-                    obj.delete()
-            else:
-                log.info(f"Delete async queue {queue.__name__} entry: " + str(primary_key))
-                with transaction.atomic():
-                    obj = queue.objects.select_for_update().get(seq=primary_key)
-                    obj.delete()
+            with transaction.atomic():
+                for queue in self.queueType.values():
+                    n, _ = queue.objects.filter(
+                        refIdentifier_id__in=refIdList,
+                        status__in=[queue.SUCCESS, queue.IGNORED, queue.SUPERSEDED],
+                    ).delete()
+                    task_count += n
+                done_qs = self.refIdentifier.objects.filter(pk__in=refIdList)
+                for queue in self.queueType.values():
+                    done_qs = done_qs.filter(
+                        ~Exists(queue.objects.filter(refIdentifier_id=OuterRef('pk')))
+                    )
+                doneIdList = list(done_qs.select_for_update().values_list('pk', flat=True))
+                if doneIdList:
+                    ref_id_count = self.refIdentifier.objects.filter(pk__in=doneIdList).delete()[0]
         except Exception as e:
-            log.error("Exception occured while processing identifier '" + identifier + "' for '" +
-                        record_type + "' table")
+            log.error(
+                f"Exception occured while deleting completed tasks for refIds "
+                f"{refIdList[0]} to {refIdList[-1]}"
+            )
             log.error(e)
-
+        return task_count, ref_id_count
+
+    def logThroughput(self, prefix, counts, elapsed_sec):
+        task_count, ref_id_count = counts
+        rate = (task_count + ref_id_count) / elapsed_sec if elapsed_sec > 0 else 0
+        log.info(
+            f"{prefix} {task_count} queue rows and {ref_id_count} refIds "
+            f"in {elapsed_sec:.1f}s ({rate:.0f} rows/sec)"
+        )
 
     def date_to_seconds(self, date_time_str: str) -> int:
         """
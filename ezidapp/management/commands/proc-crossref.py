@@ -49,42 +49,54 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
     name = __name__
     setting = 'DAEMONS_CROSSREF_ENABLED'
     queue = ezidapp.models.async_queue.CrossrefQueue
+    workers_setting = 'DAEMONS_CROSSREF_WORKERS'
+    # A deposit that has been submitted must be recorded before the batch continues, as
+    # repeating it would submit a duplicate deposit to Crossref.
+    immediate_status_set = frozenset({ezidapp.models.async_queue.CrossrefQueue.UNCHECKED})
     refIdentifier = ezidapp.models.identifier.RefIdentifier
 
-    def run(self):
-        """Run async processing loop forever.
-
-        This method is not called for disabled async processes.
-        """
+    def run_worker(self):
+        """Run the processing loop of a single worker"""
         while not self.terminated():
-            qs = self.queue.objects.filter(
-                Q(status=self.queue.UNSUBMITTED)
-                | Q(status=self.queue.UNCHECKED)
-                | Q(status=self.queue.SUBMITTED)
-            ).order_by("seq")[: django.conf.settings.DAEMONS_MAX_BATCH_SIZE]
-
-            if not qs:
-                self.sleep(django.conf.settings.DAEMONS_IDLE_SLEEP)
+            task_list = self.claim_tasks(
+                self.queue.objects.filter(
+                    Q(status=self.queue.UNSUBMITTED)
+                    | Q(status=self.queue.UNCHECKED)
+                    | Q(status=self.queue.SUBMITTED)
+                )
+                .select_related('refIdentifier')
+                .order_by("seq"),
+                django.conf.settings.DAEMONS_MAX_BATCH_SIZE,
+            )
+
+            if not task_list:
+                self.wait_for_tasks()
                 continue
 
-            for task_model in qs:
-                log.info('-' * 100)
-                log.info(f'Processing task: {str(task_model)}')
-                try:
-                    self.do_task(task_model)
-                except ezidapp.management.commands.proc_base.AsyncProcessingIgnored:
-                    log.debug(f'Ignored: {task_model.refIdentifier.identifier}')
-                    task_model.status = self.queue.IGNORED
-                except Exception as e:
-                    log.error('#' * 100)
-                    log.error(f'Exception when handling task "{task_model}"')
-                    task_model.error = str(e)
-                    # if self.is_permanent_error(e):
-                    if True:
-                        task_model.status = self.queue.FAILURE
-                        task_model.errorIsPermanent = True
-
-                task_model.save()
+            done_list = []
+            try:
+                for task_model in task_list:
+                    if not self.has_lease(task_model):
+                        break
+                    log.info('-' * 100)
+                    log.info(f'Processing task: {str(task_model)}')
+                    try:
+                        self.do_task(task_model)
+                    except ezidapp.management.commands.proc_base.AsyncProcessingIgnored:
+                        log.debug(f'Ignored: {task_model.refIdentifier.identifier}')
+                        task_model.status = self.queue.IGNORED
+                    except Exception as e:
+                        log.error('#' * 100)
+                        log.error(f'Exception when handling task "{task_model}"')
+                        task_model.error = str(e)
+                        # if self.is_permanent_error(e):
+                        if True:
+                            task_model.status = self.queue.FAILURE
+                            task_model.errorIsPermanent = True
+
+                    self.finish_task(task_model, done_list)
+            finally:
+                self.save_task_list(done_list)
 
             self.sleep(django.conf.settings.DAEMONS_BATCH_SLEEP)
 
@@ -7,6 +7,10 @@ This background process takes tasks from the DataciteQueue
 and performs the specified actions to set infomration in
 Datacite to correspond with the identifier and its
 metadata in EZID.
+
+Each worker performs DAEMONS_DATACITE_CONCURRENCY tasks concurrently, over the
+keep-alive connections shared by impl.datacite. The tasks of an identifier are performed
+one at a time, in order.
 """
 
 import logging
@@ -24,6 +28,8 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
     name = __name__
     setting = 'DAEMONS_DATACITE_ENABLED'
     queue = ezidapp.models.async_queue.DataciteQueue
+    workers_setting = 'DAEMONS_DATACITE_WORKERS'
+    concurrency_setting = 'DAEMONS_DATACITE_CONCURRENCY'
 
     def create(self, task_model: ezidapp.models.async_queue.DataciteQueue):
         if self._is_eligible(task_model):
@@ -102,7 +108,6 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
 
         if metadata_upload and target_url_upload:
             task_model.status = self.queue.SUCCESS
-        task_model.save()
 
         # check for non-public and adjust to suit
         if metadata.get("_is", "public") != "public" or metadata.get("_x", "yes") != "yes":
@@ -3,31 +3,64 @@
 
 """Batch download
 
-Downloads are created by a single daemon thread. The download
-creation process is designed to be restartable at any point: if the
-server is restarted, the current download resumes where it left off.
+Downloads are created by DAEMONS_DOWNLOAD_WORKERS worker threads, each
+processing one download request at a time. A worker claims a request by
+taking a lease on its DownloadQueue row with a conditional update, and
+renews the lease from a heartbeat thread until the request is done, so
+several daemon instances can safely share the queue. If a worker dies,
+its lease expires after DAEMONS_DOWNLOAD_LEASE seconds and the request
+becomes available to other workers.
 
-When the server is reloaded, a new daemon thread gets created. Race
-conditions exist between the old and new threads while the old
-thread still exists, but actual conflicts should be very unlikely.
+Requests are scheduled smallest first, by the estimated number of
+identifiers to harvest, so that small downloads are not held back by
+large ones. Requests that have waited longer than
+DAEMONS_DOWNLOAD_MAX_WAIT seconds, and interrupted requests, go first,
+in order of arrival.
+
+The download creation process is designed to be restartable at any
+point: if the server is restarted, the current download resumes where
+it left off.
+
+If DAEMONS_DOWNLOAD_STREAMING is set, gzip downloads are compressed in
+process as they are harvested, and uploaded directly to S3 with a
+multipart upload, skipping the COMPRESS and DELETE stages. Each part is
+a complete gzip member, so the uploaded object is a valid multi-member
+gzip file. The harvest position is saved only when a part has been
+uploaded, and a restarted download resumes from the last uploaded part.
+ZIP downloads are always written to a local file and compressed with
+ZIP_COMMAND.
+
+If DAEMONS_DOWNLOAD_REUSE_RESULTS is set, a request is first checked
+against the completed downloads recorded in DownloadResult. If an
+earlier download had the same parameters, and no identifier in scope
+has been created, updated or deleted since, its S3 object is copied to
+the new download's filename, and the request goes straight to the
+NOTIFY stage. See _fingerprint() for the changes that are not detected.
 """
 
 import csv
+import hashlib
+import json
 import os
 import os.path
 import pathlib
 import re
+import socket
 import subprocess
+import threading
 import time
 import typing
+import zlib
 
 import django.conf
 import django.core.mail
 import django.core.management
 import django.db
+import django.db.models
 
 import ezidapp.management.commands.proc_base
 import ezidapp.models.async_queue
+import ezidapp.models.download_result
 import ezidapp.models.group
 import ezidapp.models.identifier
 import ezidapp.models.model_util
@@ -48,34 +81,143 @@ SUFFIX_FORMAT_DICT = {
     ezidapp.models.async_queue.DownloadQueue.XML: "xml",
 }
 
+# Identifier status labels, as used in download constraints, to status codes.
+STATUS_LABEL_DICT = {
+    label: code
+    for code, label in ezidapp.models.identifier.SearchIdentifier._meta.get_field(
+        "status"
+    ).choices
+}
+
+# CSV columns that are written from SearchIdentifier fields rather than from the
+# identifier's metadata, and the fields they are written from.
+CSV_COLUMN_FIELD_DICT = {
+    "_id": "identifier",
+    "_mappedCreator": "resourceCreator",
+    "_mappedTitle": "resourceTitle",
+    "_mappedPublisher": "resourcePublisher",
+    "_mappedDate": "resourcePublicationDate",
+    "_mappedType": "resourceType",
+    "_target": "target",
+}
+
+# The SearchIdentifier fields needed to prepare an identifier's full metadata (see
+# IdentifierBase.toLegacy()). The remaining fields hold search and legacy data.
+LEGACY_FIELD_LIST = [
+    f.name
+    for f in ezidapp.models.identifier.IdentifierBase._meta.concrete_fields
+    if f.name != "cm"
+]
+
+
+class _LeaseLost(Exception):
+    """Raised when the worker no longer holds the lease on the request it is processing"""
+
+
+class _GzipUploadStream:
+    """A write-only text stream that gzip-compresses its contents and uploads them
+    to S3 as the parts of a multipart upload
+
+    Written data is buffered in compressed form until uploadPart() is called.
+    tell() returns the number of uncompressed bytes written, including those written
+    before the stream was opened.
+    """
+
+    def __init__(self, bucket_name, s3_object_key, upload_id, etag_list, position):
+        self.bucket_name = bucket_name
+        self.s3_object_key = s3_object_key
+        self.upload_id = upload_id
+        self.etag_list = list(etag_list)
+        self._position = position
+        self._buffer = []
+        self._bufferSize = 0
+        self._compressor = zlib.compressobj(wbits=31)
+
+    def write(self, s: str):
+        b = s.encode("utf-8")
+        self._position += len(b)
+        c = self._compressor.compress(b)
+        if c:
+            self._buffer.append(c)
+            self._bufferSize += len(c)
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def tell(self) -> int:
+        return self._position
+
+    def uploadPart(self, final: bool = False) -> bool:
+        """Upload the buffered data as the next part, ending the current gzip member
+
+        Unless 'final' is set, nothing is uploaded until DAEMONS_DOWNLOAD_PART_SIZE
+        compressed bytes have been buffered. Returns True if a part was uploaded.
+        """
+        if not final and self._bufferSize < django.conf.settings.DAEMONS_DOWNLOAD_PART_SIZE:
+            return False
+        self._buffer.append(self._compressor.flush())
+        etag = impl.s3.upload_part(
+            self.bucket_name,
+            self.s3_object_key,
+            self.upload_id,
+            len(self.etag_list) + 1,
+            b"".join(self._buffer),
+        )
+        self.etag_list.append(etag)
+        self._buffer = []
+        self._bufferSize = 0
+        self._compressor = zlib.compressobj(wbits=31)
+        return True
+
 
 class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
     help = __doc__
     name = __name__
     setting = 'DAEMONS_DOWNLOAD_ENABLED'
     queue = ezidapp.models.async_queue.DownloadQueue
+    # The 'lost' event of the request being processed by each worker thread
+    _leaseState = threading.local()
+
+    def __init__(self):
+        super().__init__()
+        self._resultLock = threading.Lock()
+        self._resultHits = 0
+        self._resultMisses = 0
+        self._resultBytesSaved = 0
 
     def run(self):
         """Run async processing loop forever.
 
         This command implements its own run loop.
         """
+        worker_count = django.conf.settings.DAEMONS_DOWNLOAD_WORKERS
+        if worker_count == 1:
+            self._work()
+            return
+        threads = [
+            threading.Thread(target=self._work, name=f"download-{i}")
+            for i in range(worker_count)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            while t.is_alive():
+                t.join(1)
+
+    def _work(self):
+        """Run the processing loop of a single worker"""
         doSleep = True
         while not self.terminated():
             if doSleep:
                 self.sleep(django.conf.settings.DAEMONS_DOWNLOAD_PROCESSING_IDLE_SLEEP)
             try:
-                # Try and retrieve a single task from the DownloadQueue
-                # Tasks are ordered by sequence of creation.
-                # There are several stages of work for a task, so the same
-                # task may be retrieved multiple times to complete all the stages
-                rs = ezidapp.models.async_queue.DownloadQueue.objects.all().order_by("seq")[:1]
-                if len(rs) == 0:
+                r = self._claim()
+                if r is None:
                     # OK to sleep since no work to do
                     doSleep = True
                     continue
-                # Process the next stage of the single task
-                self._proc_stage(rs[0])
+                self._proc_request(r)
                 self._remove_expired_files()
                 # Don't sleep while work is in progress
                 doSleep = False
@@ -83,10 +225,134 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
                 self.log.error('Exception')
                 impl.log.otherError("download.run", e)
                 doSleep = True
+        django.db.connection.close()
+
+    def _claim(self) -> typing.Optional[ezidapp.models.async_queue.DownloadQueue]:
+        """Take a lease on the next download request to process
+
+        Returns None if no requests are available.
+        """
+        now = self.now_int()
+        candidates = list(
+            ezidapp.models.async_queue.DownloadQueue.objects.filter(
+                leaseExpires__lt=now
+            ).order_by("seq")[: django.conf.settings.DAEMONS_MAX_BATCH_SIZE]
+        )
+        for r in candidates:
+            if r.estimatedCount is None:
+                r.estimatedCount = self._estimateCount(r)
+                ezidapp.models.async_queue.DownloadQueue.objects.filter(seq=r.seq).update(
+                    estimatedCount=r.estimatedCount
+                )
+
+        def priority(r):
+            if (
+                r.stage != ezidapp.models.async_queue.DownloadQueue.CREATE
+                or now - r.enqueueTime > django.conf.settings.DAEMONS_DOWNLOAD_MAX_WAIT
+            ):
+                return 0, 0, r.seq
+            return 1, r.estimatedCount, r.seq
+
+        leaseOwner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        for r in sorted(candidates, key=priority):
+            leaseExpires = now + django.conf.settings.DAEMONS_DOWNLOAD_LEASE
+            if ezidapp.models.async_queue.DownloadQueue.objects.filter(
+                seq=r.seq, leaseExpires__lt=now
+            ).update(leaseOwner=leaseOwner, leaseExpires=leaseExpires):
+                # Another worker may have processed stages of the request since it was
+                # read.
+                r.refresh_from_db()
+                return r
+        return None
+
+    def _estimateCount(self, r: ezidapp.models.async_queue.DownloadQueue) -> int:
+        return ezidapp.models.identifier.SearchIdentifier.objects.filter(
+            self._constraintFilter(self._decode(r.constraints)),
+            owner__pid__in=r.toHarvest.split(","),
+        ).count()
+
+    def _proc_request(self, r: ezidapp.models.async_queue.DownloadQueue):
+        """Process the remaining stages of a download request"""
+        done = threading.Event()
+        lost = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(r, done, lost), daemon=True
+        )
+        heartbeat.start()
+        self._leaseState.lost = lost
+        try:
+            while not self.terminated() and not lost.is_set():
+                stage = r.stage
+                self._proc_stage(r)
+                if stage == ezidapp.models.async_queue.DownloadQueue.NOTIFY:
+                    return
+        except _LeaseLost:
+            self.log.warning("Stopped processing download request: %s", r.filename)
+        finally:
+            self._leaseState.lost = None
+            done.set()
+            heartbeat.join()
+            ezidapp.models.async_queue.DownloadQueue.objects.filter(
+                seq=r.seq, leaseOwner=r.leaseOwner
+            ).update(leaseOwner="", leaseExpires=0)
+
+    def _heartbeat(
+        self,
+        r: ezidapp.models.async_queue.DownloadQueue,
+        done: threading.Event,
+        lost: threading.Event,
+    ):
+        """Renew the lease on a download request until processing is done
+
+        If the lease has been lost, 'lost' is set, which stops processing before the
+        next write to the request or its file (see _checkLease()).
+        """
+        leaseOwner = r.leaseOwner
+        try:
+            while not done.wait(django.conf.settings.DAEMONS_DOWNLOAD_LEASE / 3):
+                leaseExpires = self.now_int() + django.conf.settings.DAEMONS_DOWNLOAD_LEASE
+                if ezidapp.models.async_queue.DownloadQueue.objects.filter(
+                    seq=r.seq, leaseOwner=leaseOwner
+                ).update(leaseExpires=leaseExpires):
+                    r.leaseExpires = leaseExpires
+                else:
+                    self.log.warning("Lost lease on download request: %s", r.filename)
+                    lost.set()
+                    return
+        finally:
+            django.db.connection.close()
+
+    def _checkLease(self):
+        """Raise _LeaseLost if the heartbeat has found that the lease on the request
+        being processed has been lost
+        """
+        lost = getattr(self._leaseState, "lost", None)
+        if lost is not None and lost.is_set():
+            raise _LeaseLost()
+
+    def _save(self, r: ezidapp.models.async_queue.DownloadQueue):
+        """Save the processing state of a download request
+
+        The request is only saved while the worker holds its lease, and the lease
+        columns, which are maintained by _claim() and _heartbeat(), are left alone.
+        Raises _LeaseLost if the lease has been lost.
+        """
+        self._checkLease()
+        # noinspection PyProtectedMember
+        if not ezidapp.models.async_queue.DownloadQueue.objects.filter(
+            seq=r.seq, leaseOwner=r.leaseOwner
+        ).update(
+            **{
+                f.attname: getattr(r, f.attname)
+                for f in r._meta.concrete_fields
+                if not f.primary_key and f.name not in ("leaseOwner", "leaseExpires")
+            }
+        ):
+            self.log.warning("Lost lease on download request: %s", r.filename)
+            raise _LeaseLost()
 
     def _proc_stage(self, r:ezidapp.models.async_queue.DownloadQueue):
-        # Only process one download request at a time
-        # Once completed, current is deleted
+        # Once completed, the request is deleted
         if r.stage == ezidapp.models.async_queue.DownloadQueue.CREATE:
             self._createFile(r)
         elif r.stage == ezidapp.models.async_queue.DownloadQueue.HARVEST:
@@ -104,7 +370,7 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
 
     def _remove_expired_files(self):
         """Generated files are available for download for a specific time period, after
-        which they are deleted here.
+        which they are deleted here, together with their DownloadResult records.
 
         To reduce the chance of recursively wiping out an entire filesystem in case of
         bad settings or broken code, we are conservative here and only delete regular
@@ -121,7 +387,12 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
                     and p.stat().st_mtime
                     < now_ts - django.conf.settings.DAEMONS_DOWNLOAD_FILE_LIFETIME
                 ):
-                    p.unlink()
+                    # Another worker may be removing the same file
+                    p.unlink(missing_ok=True)
+        # Results are reused only while their S3 objects are kept, for the same time
+        ezidapp.models.download_result.DownloadResult.objects.filter(
+            createTime__lte=int(now_ts) - django.conf.settings.DAEMONS_DOWNLOAD_FILE_LIFETIME
+        ).delete()
 
     def _wrapException(self, context, exception):
         m = str(exception)
@@ -146,26 +417,44 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             s = "request"
         return os.path.join(d, f"{r.filename}.{s}")
 
+    def _s3ObjectKey(self, r: ezidapp.models.async_queue.DownloadQueue) -> str:
+        return f"{django.conf.settings.S3_BUCKET_DOWNLOAD_PATH}/{r.filename}.{self._fileSuffix(r)}"
+
+    def _isStreamed(self, r: ezidapp.models.async_queue.DownloadQueue) -> bool:
+        return r.uploadId != ""
+
     def _csvEncode(self, s: str) -> bytes:
         return impl.util.oneLine(s).encode("utf-8")
 
     def _flushFile(self, f: typing.TextIO):
         f.flush()
-        os.fsync(f.fileno())
+        if not isinstance(f, _GzipUploadStream):
+            os.fsync(f.fileno())
+
+    def _writeHeader(self, r: ezidapp.models.async_queue.DownloadQueue, f: typing.TextIO):
+        if r.format == ezidapp.models.async_queue.DownloadQueue.CSV:
+            w = csv.writer(f)
+            row_list = [self._csvEncode(c) for c in self._decode(r.columns)]
+            w.writerow([b.decode('utf-8', errors='replace') for b in row_list])
+            self._flushFile(f)
+        elif r.format == ezidapp.models.async_queue.DownloadQueue.XML:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n<records>')
+            self._flushFile(f)
 
     def _createFile(self, r: ezidapp.models.async_queue.DownloadQueue):
+        if django.conf.settings.DAEMONS_DOWNLOAD_REUSE_RESULTS and self._reuseResult(r):
+            return
+        if (
+            django.conf.settings.DAEMONS_DOWNLOAD_STREAMING
+            and r.compression == ezidapp.models.async_queue.DownloadQueue.GZIP
+        ):
+            self._createUpload(r)
+            return
         f = None
         self.log.debug("createFile: %s", self._path(r, 1))
         try:
             f = open(self._path(r, 1), "w", newline='', encoding="utf-8")
-            if r.format == ezidapp.models.async_queue.DownloadQueue.CSV:
-                w = csv.writer(f)
-                row_list = [self._csvEncode(c) for c in self._decode(r.columns)]
-                w.writerow([b.decode('utf-8', errors='replace') for b in row_list])
-                self._flushFile(f)
-            elif r.format == ezidapp.models.async_queue.DownloadQueue.XML:
-                f.write('<?xml version="1.0" encoding="utf-8"?>\n<records>')
-                self._flushFile(f)
+            self._writeHeader(r, f)
             # We don't know exactly what the CSV writer wrote, so we must
             # probe the file to find its size.
             n = f.tell()
@@ -176,49 +465,172 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             # This is run if there's no exception thrown
             r.stage = ezidapp.models.async_queue.DownloadQueue.HARVEST
             r.fileSize = n
-            r.save()
+            self._save(r)
         finally:
             if f:
                 f.close()
 
-    def _satisfiesConstraints(self, id_model, constraints):
+    def _fingerprint(self, r: ezidapp.models.async_queue.DownloadQueue) -> str:
+        """Return the fingerprint of a download request
+
+        The fingerprint covers the normalized request parameters, and the number and
+        latest update time of all identifiers of the users to harvest. Creating,
+        updating or deleting any of those identifiers changes the fingerprint, unless
+        the update is made in the same second as the latest earlier one. Changes to
+        related state that is output without updating the identifiers, e.g., renamed
+        users, groups or profiles, and link checker results, do not change it.
+        """
+        toHarvest = sorted(set(r.toHarvest.split(",")))
+        state = ezidapp.models.identifier.SearchIdentifier.objects.filter(
+            owner__pid__in=toHarvest
+        ).aggregate(
+            count=django.db.models.Count("id"),
+            maxUpdateTime=django.db.models.Max("updateTime"),
+        )
+        d = {
+            "format": r.format,
+            "compression": r.compression,
+            "columns": self._decode(r.columns),
+            "constraints": {
+                k: sorted(v) if isinstance(v, list) else v
+                for k, v in self._decode(r.constraints).items()
+            },
+            "options": self._decode(r.options),
+            "toHarvest": toHarvest,
+            "count": state["count"],
+            "maxUpdateTime": state["maxUpdateTime"],
+        }
+        return hashlib.sha256(json.dumps(d, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _reuseResult(self, r: ezidapp.models.async_queue.DownloadQueue) -> bool:
+        """Copy the result of an identical earlier download, if one is available
+
+        Returns True if the result was copied, in which case the request has moved on
+        to the NOTIFY stage. Otherwise, the request's fingerprint is set, to be saved
+        with the request.
+        """
+        r.fingerprint = self._fingerprint(r)
+        bucket_name = django.conf.settings.S3_BUCKET
+        result = ezidapp.models.download_result.DownloadResult.objects.filter(
+            fingerprint=r.fingerprint,
+            createTime__gt=self.now_int() - django.conf.settings.DAEMONS_DOWNLOAD_FILE_LIFETIME,
+        ).first()
+        if result is not None:
+            try:
+                source_object_key = (
+                    f"{django.conf.settings.S3_BUCKET_DOWNLOAD_PATH}/{result.filename}"
+                )
+                if impl.s3.object_exists(bucket_name, source_object_key):
+                    impl.s3.copy_object(bucket_name, source_object_key, self._s3ObjectKey(r))
+                else:
+                    result = None
+            except Exception as e:
+                self.log.warning("Unable to reuse download result: %s: %s", result.filename, e)
+                result = None
+        with self._resultLock:
+            if result is None:
+                self._resultMisses += 1
+            else:
+                self._resultHits += 1
+                self._resultBytesSaved += result.size
+            self.log.info(
+                "Download result reuse: hits=%s misses=%s hitRate=%.2f bytesSaved=%s",
+                self._resultHits,
+                self._resultMisses,
+                self._resultHits / (self._resultHits + self._resultMisses),
+                self._resultBytesSaved,
+            )
+        if result is None:
+            return False
+        self.log.info("Reused download result: %s -> %s", result.filename, r.filename)
+        r.stage = ezidapp.models.async_queue.DownloadQueue.NOTIFY
+        self._save(r)
+        return True
+
+    def _saveResult(self, r: ezidapp.models.async_queue.DownloadQueue):
+        """Record the S3 object of a completed download for reuse"""
+        if r.fingerprint == "":
+            return
+        try:
+            size = impl.s3.get_object_size(
+                django.conf.settings.S3_BUCKET, self._s3ObjectKey(r)
+            )
+            if size is None:
+                return
+            ezidapp.models.download_result.DownloadResult.objects.update_or_create(
+                fingerprint=r.fingerprint,
+                defaults={
+                    "filename": f"{r.filename}.{self._fileSuffix(r)}",
+                    "size": size,
+                    "createTime": self.now_int(),
+                },
+            )
+        except Exception as e:
+            # Reuse is an optimization only, so the download proceeds.
+            self.log.warning("Unable to save download result: %s: %s", r.filename, e)
+
+    def _createUpload(self, r: ezidapp.models.async_queue.DownloadQueue):
+        self.log.debug("createUpload: %s", self._s3ObjectKey(r))
+        try:
+            upload_id = impl.s3.create_multipart_upload(
+                django.conf.settings.S3_BUCKET, self._s3ObjectKey(r)
+            )
+        except Exception as e:
+            self.log.error('Exception')
+            raise self._wrapException("error creating upload", e)
+        r.uploadId = upload_id
+        r.uploadParts = impl.download.encode([])
+        r.stage = ezidapp.models.async_queue.DownloadQueue.HARVEST
+        r.fileSize = 0
+        self._save(r)
+
+    def _constraintFilter(self, constraints: dict) -> django.db.models.Q:
+        """Translate the search constraints of a download request to a filter on
+        SearchIdentifier
+        """
+        q = django.db.models.Q()
+        doi = django.db.models.Q(identifier__startswith="doi:")
         for k, v in list(constraints.items()):
             if k == "createdAfter":
-                if id_model.createTime < v:
-                    return False
+                q &= django.db.models.Q(createTime__gte=v)
             elif k == "createdBefore":
-                if id_model.createTime >= v:
-                    return False
+                q &= django.db.models.Q(createTime__lt=v)
             elif k == "crossref":
-                if id_model.isCrossref ^ v:
-                    return False
+                c = doi & ~django.db.models.Q(crossrefStatus="")
+                q &= c if v else ~c
             elif k == "datacite":
-                if id_model.isDatacite ^ v:
-                    return False
+                c = doi & django.db.models.Q(crossrefStatus="")
+                q &= c if v else ~c
             elif k == "exported":
-                if id_model.exported ^ v:
-                    return False
+                q &= django.db.models.Q(exported=v)
             elif k == "permanence":
-                if id_model.isTest ^ (v == "test"):
-                    return False
+                q &= django.db.models.Q(isTest=(v == "test"))
             elif k == "profile":
-                if id_model.profile.label not in v:
-                    return False
+                q &= django.db.models.Q(profile__label__in=v)
             elif k == "status":
-                if id_model.get_status_display() not in v:
-                    return False
+                q &= django.db.models.Q(status__in=[STATUS_LABEL_DICT[l] for l in v])
             elif k == "type":
-                if id_model.type not in v:
-                    return False
+                c = django.db.models.Q()
+                for t in v:
+                    c |= django.db.models.Q(identifier__startswith=f"{t}:")
+                q &= c
             elif k == "updatedAfter":
-                if id_model.updateTime < v:
-                    return False
+                q &= django.db.models.Q(updateTime__gte=v)
             elif k == "updatedBefore":
-                if id_model.updateTime >= v:
-                    return False
+                q &= django.db.models.Q(updateTime__lt=v)
             else:
                 assert False, "unhandled case"
-        return True
+        return q
+
+    def _harvestFields(self, r: ezidapp.models.async_queue.DownloadQueue, columns) -> list:
+        """Return the SearchIdentifier fields needed to write records of the download,
+        or None if the full metadata is needed
+        """
+        if r.format == ezidapp.models.async_queue.DownloadQueue.CSV and all(
+            c in CSV_COLUMN_FIELD_DICT for c in columns
+        ):
+            return sorted({"identifier", *[CSV_COLUMN_FIELD_DICT[c] for c in columns]})
+        return None
 
     def _prepareMetadata(
         self,
@@ -287,45 +699,109 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
         columns = self._decode(r.columns)
         constraints = self._decode(r.constraints)
         options = self._decode(r.options)
+        owner_id = (
+            ezidapp.models.user.User.objects.filter(
+                pid=r.toHarvest.split(",")[r.currentIndex]
+            )
+            .values_list("id", flat=True)
+            .first()
+        )
+        if owner_id is None:
+            self.log.warning("User to harvest does not exist")
+            return
+        # The constraints are applied in the query, so that only the identifiers to be
+        # exported are read, using the (owner_id, ...) indexes.
+        qs = ezidapp.models.identifier.SearchIdentifier.objects.filter(
+            self._constraintFilter(constraints), owner_id=owner_id
+        )
+        fields = self._harvestFields(r, columns)
+        if fields is None:
+            qs = qs.select_related("owner", "ownergroup", "datacenter", "profile").only(
+                *LEGACY_FIELD_LIST
+            )
+        else:
+            qs = qs.only(*fields)
         _total = 0
         while not self.terminated():
-            qs = (
-                ezidapp.models.identifier.SearchIdentifier.objects.filter(identifier__gt=r.lastId)
-                .filter(owner__pid=r.toHarvest.split(",")[r.currentIndex])
-                .select_related("owner", "ownergroup", "datacenter", "profile")
-                .order_by("identifier")
-            )
-            # self.log.debug("Query issued: %s", str(qs.query))
-            ids = list(qs[:1000])
+            # Stop before writing, as another worker may have taken over the request
+            self._checkLease()
+            ids = list(qs.filter(identifier__gt=r.lastId).order_by("identifier")[:1000])
             self.log.debug("Total query matches: %s", len(ids))
             if len(ids) == 0:
                 break
             try:
                 for id in ids:
-                    if self._satisfiesConstraints(id, constraints):
+                    if fields is None:
                         m = self._prepareMetadata(id, options["convertTimestamps"])
-                        if r.format == ezidapp.models.async_queue.DownloadQueue.ANVL:
-                            self._writeAnvl(f, id, m)
-                        elif r.format == ezidapp.models.async_queue.DownloadQueue.CSV:
-                            self._writeCsv(f, columns, id, m)
-                        elif r.format == ezidapp.models.async_queue.DownloadQueue.XML:
-                            self._writeXml(f, id, m)
-                        else:
-                            assert False, "unhandled case"
-                        _total += 1
+                    else:
+                        m = {}
+                    if r.format == ezidapp.models.async_queue.DownloadQueue.ANVL:
+                        self._writeAnvl(f, id, m)
+                    elif r.format == ezidapp.models.async_queue.DownloadQueue.CSV:
+                        self._writeCsv(f, columns, id, m)
+                    elif r.format == ezidapp.models.async_queue.DownloadQueue.XML:
+                        self._writeXml(f, id, m)
+                    else:
+                        assert False, "unhandled case"
+                    _total += 1
                 self._flushFile(f)
             except Exception as e:
                 self.log.error('Exception')
                 raise self._wrapException("error writing file", e)
             r.lastId = ids[-1].identifier
-            r.fileSize = f.tell()
-            r.save()
+            r.harvestedCount += len(ids)
+            self._savePosition(r, f)
+            self.log.info(
+                "Harvest progress: %s: %s/%s", r.filename, r.harvestedCount, r.estimatedCount
+            )
         if self.terminated():
             self.log.warning("Harvest terminated.")
         else:
             self.log.info("Total records exported: %s", _total)
 
+    def _savePosition(self, r: ezidapp.models.async_queue.DownloadQueue, f: typing.TextIO):
+        """Save the harvest position of a download request
+
+        When streaming, the position is saved only when a part has been uploaded, as
+        data buffered since the last part is lost if processing stops.
+        """
+        if isinstance(f, _GzipUploadStream):
+            if not f.uploadPart():
+                return
+            r.uploadParts = impl.download.encode(f.etag_list)
+        r.fileSize = f.tell()
+        self._save(r)
+
+    def _harvestAll(self, r: ezidapp.models.async_queue.DownloadQueue, f: typing.TextIO):
+        """Harvest the remaining users of a download request and write the file footer
+
+        Returns False if processing was terminated.
+        """
+        start = r.currentIndex
+        for i in range(r.currentIndex, len(r.toHarvest.split(","))):
+            self._checkLease()
+            if i > start:
+                r.currentIndex = i
+                r.lastId = ""
+                if not isinstance(f, _GzipUploadStream):
+                    self._save(r)
+            self._harvest1(r, f)
+        if self.terminated():
+            # Resume from the last saved position when restarted
+            return False
+        if r.format == ezidapp.models.async_queue.DownloadQueue.XML:
+            try:
+                f.write("</records>")
+                self._flushFile(f)
+            except Exception as e:
+                self.log.error('Exception')
+                raise self._wrapException("error writing file footer", e)
+        return True
+
     def _harvest(self, r: ezidapp.models.async_queue.DownloadQueue):
+        if self._isStreamed(r):
+            self._harvestStream(r)
+            return
         f = None
         try:
             try:
@@ -336,26 +812,41 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             except Exception as e:
                 self.log.error('Exception')
                 raise self._wrapException("error re-opening/seeking/truncating file", e)
-            start = r.currentIndex
-            for i in range(r.currentIndex, len(r.toHarvest.split(","))):
-                if i > start:
-                    r.currentIndex = i
-                    r.lastId = ""
-                    r.save()
-                self._harvest1(r, f)
-            if r.format == ezidapp.models.async_queue.DownloadQueue.XML:
-                try:
-                    f.write("</records>")
-                    self._flushFile(f)
-                except Exception as e:
-                    self.log.error('Exception')
-                    raise self._wrapException("error writing file footer", e)
+            if not self._harvestAll(r, f):
+                return
             r.stage = ezidapp.models.async_queue.DownloadQueue.COMPRESS
-            r.save()
+            self._save(r)
         finally:
             if f:
                 f.close()
 
+    def _harvestStream(self, r: ezidapp.models.async_queue.DownloadQueue):
+        f = _GzipUploadStream(
+            django.conf.settings.S3_BUCKET,
+            self._s3ObjectKey(r),
+            r.uploadId,
+            self._decode(r.uploadParts),
+            r.fileSize,
+        )
+        if len(f.etag_list) == 0:
+            # Nothing has been uploaded, so the position is still at the start.
+            try:
+                self._writeHeader(r, f)
+            except Exception as e:
+                self.log.error('Exception')
+                raise self._wrapException("error writing file header", e)
+        if not self._harvestAll(r, f):
+            return
+        try:
+            f.uploadPart(final=True)
+        except Exception as e:
+            self.log.error('Exception')
+            raise self._wrapException("error uploading part", e)
+        r.uploadParts = impl.download.encode(f.etag_list)
+        r.fileSize = f.tell()
+        r.stage = ezidapp.models.async_queue.DownloadQueue.MOVE
+        self._save(r)
+
     def _compressFile(self, r: ezidapp.models.async_queue.DownloadQueue):
         infile = None
         outfile = None
@@ -403,7 +894,7 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             raise self._wrapException("error compressing file", e)
         else:
             r.stage = ezidapp.models.async_queue.DownloadQueue.DELETE
-            r.save()
+            self._save(r)
         finally:
             if infile:
                 infile.close()
@@ -419,15 +910,17 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             raise self._wrapException("error deleting uncompressed file", e)
         else:
             r.stage = ezidapp.models.async_queue.DownloadQueue.MOVE
-            r.save()
+            self._save(r)
 
     def _moveCompressedFile(self, r: ezidapp.models.async_queue.DownloadQueue):
+        if self._isStreamed(r):
+            self._completeUpload(r)
+            return
         try:
             if os.path.exists(self._path(r, 2)):
                 local_file_path = self._path(r, 2)
-                filename = os.path.basename(local_file_path)
                 bucket_name = django.conf.settings.S3_BUCKET
-                s3_object_key = f"{django.conf.settings.S3_BUCKET_DOWNLOAD_PATH}/{filename}"
+                s3_object_key = self._s3ObjectKey(r)
                 impl.s3.upload_file(local_file_path, bucket_name, s3_object_key)
             else:
                 assert os.path.exists(self._path(r, 3)), "file has disappeared"
@@ -435,8 +928,29 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             self.log.error('Exception')
             raise self._wrapException("error moving compressed file", e)
         else:
+            self._saveResult(r)
+            r.stage = ezidapp.models.async_queue.DownloadQueue.NOTIFY
+            self._save(r)
+
+    def _completeUpload(self, r: ezidapp.models.async_queue.DownloadQueue):
+        bucket_name = django.conf.settings.S3_BUCKET
+        s3_object_key = self._s3ObjectKey(r)
+        try:
+            try:
+                impl.s3.complete_multipart_upload(
+                    bucket_name, s3_object_key, r.uploadId, self._decode(r.uploadParts)
+                )
+            except Exception:
+                # The upload may have been completed before the server was restarted.
+                if not impl.s3.object_exists(bucket_name, s3_object_key):
+                    raise
+        except Exception as e:
+            self.log.error('Exception')
+            raise self._wrapException("error completing upload", e)
+        else:
+            self._saveResult(r)
             r.stage = ezidapp.models.async_queue.DownloadQueue.NOTIFY
-            r.save()
+            self._save(r)
 
     def _notifyRequestor(self, r: ezidapp.models.async_queue.DownloadQueue):
         f = None
@@ -15,6 +15,17 @@ As the changes made to the StoreIdentifier are wrapped in a transaction that cov
 request, partial changes in StoreIdentifier are not visible to this process, and all
 changes to a single identifier are handled as a single unit after the request is
 completed.
+
+If DAEMONS_SEARCH_INDEXER_BATCH_SIZE is larger than 1, tasks are processed in chunks
+of up to that many tasks. The SearchIdentifier rows for a chunk are read with a single
+query and written with bulk_update() / bulk_create(), and the chunk is sent to
+OpenSearch as a single _bulk request. A chunk that is not full is held back until its
+oldest task has waited DAEMONS_SEARCH_INDEXER_MAX_LATENCY seconds, so that a steady
+trickle of tasks is still sent in chunks.
+
+The queue may be processed by DAEMONS_SEARCH_INDEXER_WORKERS worker threads, and by
+several instances of this process. Workers claim disjoint chunks of tasks, and never
+process tasks for the same identifier concurrently (see AsyncProcessingCommand).
 """
 
 import logging
@@ -22,6 +33,7 @@ import logging
 import ezidapp.management.commands.proc_base
 import ezidapp.models.async_queue
 import ezidapp.models.identifier
+import impl.search_doc
 from impl.open_search_doc import OpenSearchDoc
 from django.db import transaction
 from django.db import DatabaseError
@@ -37,27 +49,29 @@ from .proc_base import AsyncProcessingIgnored, AsyncProcessingRemoteError, Async
 
 log = logging.getLogger(__name__)
 
+# The SearchIdentifier fields written when indexing an identifier
+SEARCH_ID_FIELD_LIST = [
+    f.name
+    for f in ezidapp.models.identifier.SearchIdentifier._meta.concrete_fields
+    if not f.primary_key and f.name != 'identifier'
+]
+
 
 class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
     help = __doc__
     name = __name__
     setting = 'DAEMONS_SEARCH_INDEXER_ENABLED'
     queue = ezidapp.models.async_queue.SearchIndexerQueue
+    workers_setting = 'DAEMONS_SEARCH_INDEXER_WORKERS'
 
     # note, the method is an overridden version to allow for occasional retries of supposedly "permanent" errors
     # such as network errors or a service being temporarily down or unresponsive.
 
     # It will retry such errors every 5 minutes for 24 hours, then give up and leave things in the FAILURE state.
 
-    def run(self):
-        """Run async processing loop forever.
-
-        The async processes that don't use a queue based on AsyncQueueBase must override
-        this to supply their own loop.
-
-        This method is not called for disabled async processes.
-        """
-        assert self.queue is not None, "Must specify queue or override run()"
+    def run_worker(self):
+        """Run the processing loop of a single worker"""
+        batch_size = django.conf.settings.DAEMONS_SEARCH_INDEXER_BATCH_SIZE
 
         while not self.terminated():
             # Define the time thresholds
@@ -75,40 +89,78 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
                 Q(status=self.queue.UNSUBMITTED) | or_condition
             ).order_by(
                 "-seq"
-            )[: django.conf.settings.DAEMONS_MAX_BATCH_SIZE]
-            if not qs:
-                self.sleep(django.conf.settings.DAEMONS_IDLE_SLEEP)
+            )
+
+            if batch_size > 1:
+                qs = qs.filter(leaseExpires__lt=self.now_int())
+                oldest = qs.order_by('enqueueTime').values_list('enqueueTime', flat=True).first()
+                if oldest is None:
+                    self.wait_for_tasks()
+                    continue
+                wait_sec = (
+                    oldest
+                    + django.conf.settings.DAEMONS_SEARCH_INDEXER_MAX_LATENCY
+                    - self.now_int()
+                )
+                if wait_sec > 0 and qs[:batch_size].count() < batch_size:
+                    # Wait for more tasks to fill the chunk
+                    self.sleep(min(wait_sec, django.conf.settings.DAEMONS_IDLE_SLEEP))
+                    continue
+                task_list = self.claim_tasks(
+                    qs.select_related(
+                        'refIdentifier__owner',
+                        'refIdentifier__ownergroup',
+                        'refIdentifier__datacenter',
+                        'refIdentifier__profile',
+                    ),
+                    batch_size,
+                )
+                if task_list:
+                    self._do_batch(task_list)
+                self.sleep(django.conf.settings.DAEMONS_BATCH_SLEEP)
                 continue
 
-            for task_model in qs:
-                try:
-                    self.do_task(task_model)
-                    task_model.status = self.queue.SUCCESS
-                except AsyncProcessingIgnored:
-                    task_model.status = self.queue.IGNORED
-                except Exception as e:
-                    if isinstance(e, AsyncProcessingRemoteError):
-                        # This is a bit messy. Do not log a trace when the
-                        # error is due to the remote service rejecting the request.
-                        # Such an error is still permanent for the task though.
-                        self.log.error(e)
-                    else:
-                        self.log.error('#' * 100)
-                        self.log.error(f'Exception when handling task "{task_model}"')
+            task_list = self.claim_tasks(
+                qs.select_related('refIdentifier'), django.conf.settings.DAEMONS_MAX_BATCH_SIZE
+            )
+            if not task_list:
+                self.wait_for_tasks()
+                continue
 
-                    task_model.error = str(e)
-                    # if self.is_permanent_error(e):
-                    task_model.status = self.queue.FAILURE
-                    task_model.errorIsPermanent = True
-                    task_model.submitTime = self.now_int()  # this lets us know "try" time so can retry in 5 minutes
-                    # raise  -- TODO: may want to notify or other things here if we need to know about these errors
-                else:
-                    task_model.submitTime = self.now_int()
+            done_list = []
+            try:
+                for task_model in task_list:
+                    if not self.has_lease(task_model):
+                        break
+                    try:
+                        self.do_task(task_model)
+                        task_model.status = self.queue.SUCCESS
+                    except AsyncProcessingIgnored:
+                        task_model.status = self.queue.IGNORED
+                    except Exception as e:
+                        if isinstance(e, AsyncProcessingRemoteError):
+                            # This is a bit messy. Do not log a trace when the
+                            # error is due to the remote service rejecting the request.
+                            # Such an error is still permanent for the task though.
+                            self.log.error(e)
+                        else:
+                            self.log.error('#' * 100)
+                            self.log.error(f'Exception when handling task "{task_model}"')
+
+                        task_model.error = str(e)
+                        # if self.is_permanent_error(e):
+                        task_model.status = self.queue.FAILURE
+                        task_model.errorIsPermanent = True
+                        task_model.submitTime = self.now_int()  # this lets us know "try" time so can retry in 5 minutes
+                        # raise  -- TODO: may want to notify or other things here if we need to know about these errors
+                    else:
+                        task_model.submitTime = self.now_int()
 
-                task_model.save()
+                    self.finish_task(task_model, done_list)
+            finally:
+                self.save_task_list(done_list)
 
             self.sleep(django.conf.settings.DAEMONS_BATCH_SLEEP)
-        self.log.info("Exiting run loop.")
 
     def create(self, task_model):
         if not self._is_anonymous(task_model):
@@ -144,6 +196,115 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
                         OpenSearchDoc.index_from_search_identifier(search_identifier=target_id)
                 raise e
 
+    def _do_batch(self, task_list):
+        """Process a chunk of tasks with a single _bulk request to OpenSearch
+
+        Each task holds the complete state of its identifier, so only the latest task
+        for each identifier is applied, and earlier tasks for the same identifier in the
+        chunk get the same outcome. Errors are recorded on the tasks of the identifiers
+        they apply to, and failed tasks are retried as in the single task loop.
+        """
+        latest_task_dict = {}
+        for task_model in sorted(task_list, key=lambda t: t.seq):
+            latest_task_dict[task_model.refIdentifier.identifier] = task_model
+        search_id_dict = {
+            si.identifier: si
+            for si in ezidapp.models.identifier.SearchIdentifier.objects.filter(
+                identifier__in=list(latest_task_dict)
+            )
+        }
+
+        index_list = []
+        remove_list = []
+        error_dict = {}
+        for identifier, task_model in latest_task_dict.items():
+            if self._is_anonymous(task_model):
+                log.debug(f'Skipped {identifier}: Anonymous owner')
+            elif task_model.operation == self.queue.DELETE:
+                if identifier in search_id_dict:
+                    remove_list.append(identifier)
+            elif task_model.operation in (self.queue.CREATE, self.queue.UPDATE):
+                # As in the single task path, an identifier that cannot be processed only
+                # fails its own tasks.
+                try:
+                    search_id_model = self._copy_ref_id(
+                        task_model.refIdentifier,
+                        search_id_dict.get(identifier)
+                        or ezidapp.models.identifier.SearchIdentifier(identifier=identifier),
+                    )
+                    builder = impl.search_doc.SearchDocBuilder(task_model.refIdentifier)
+                    search_id_model.computeComputedValues(builder)
+                except Exception as e:
+                    log.exception(f'Error preparing {identifier} for indexing')
+                    error_dict[identifier] = str(e)
+                    continue
+                index_list.append((task_model.refIdentifier, search_id_model, builder))
+            else:
+                error_dict[identifier] = f'Invalid operation: {task_model.operation}'
+
+        try:
+            error_dict.update(
+                OpenSearchDoc.bulk_index(
+                    index_docs=[
+                        OpenSearchDoc(
+                            identifier=ref_id_model,
+                            search_identifier=search_id_model,
+                            builder=builder,
+                        )
+                        for ref_id_model, search_id_model, builder in index_list
+                    ],
+                    remove_identifiers=remove_list,
+                )
+            )
+        except Exception as e:
+            log.error(f'Error sending _bulk request to OpenSearch: {e}')
+            for identifier in [si.identifier for _, si, _ in index_list] + remove_list:
+                error_dict[identifier] = str(e)
+
+        # Only identifiers that were updated in OpenSearch are updated in the database
+        save_list = [si for _, si, _ in index_list if error_dict.get(si.identifier) is None]
+        remove_list = [i for i in remove_list if error_dict.get(i) is None]
+        try:
+            with transaction.atomic():
+                ezidapp.models.identifier.SearchIdentifier.objects.bulk_update(
+                    [si for si in save_list if si.pk is not None], SEARCH_ID_FIELD_LIST
+                )
+                ezidapp.models.identifier.SearchIdentifier.objects.bulk_create(
+                    [si for si in save_list if si.pk is None]
+                )
+                ezidapp.models.identifier.SearchIdentifier.objects.filter(
+                    identifier__in=remove_list
+                ).delete()
+        except DatabaseError as e:
+            log.error(f'Error saving batch, rolling transaction back: {e}')
+            # As in the single task path, new identifiers are removed from OpenSearch
+            # again, and removed identifiers are reindexed.
+            try:
+                OpenSearchDoc.bulk_index(
+                    remove_identifiers=[si.identifier for si in save_list if si.pk is None]
+                )
+                for identifier in remove_list:
+                    OpenSearchDoc.index_from_search_identifier(
+                        search_identifier=search_id_dict[identifier]
+                    )
+            except Exception as e2:
+                log.error(f'Error restoring OpenSearch after rollback: {e2}')
+            for identifier in [si.identifier for si in save_list] + remove_list:
+                error_dict[identifier] = str(e)
+
+        now_int = self.now_int()
+        for task_model in task_list:
+            error = error_dict.get(task_model.refIdentifier.identifier)
+            if error is None:
+                task_model.status = self.queue.SUCCESS
+            else:
+                self.log.error(f'Error when handling task "{task_model}": {error}')
+                task_model.error = error
+                task_model.status = self.queue.FAILURE
+                task_model.errorIsPermanent = True
+            task_model.submitTime = now_int
+        self.save_task_list(task_list)
+
     def _is_anonymous(self, task_model):
         return task_model.refIdentifier.owner is None
 
@@ -153,11 +314,14 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
     ):
         log.debug(f'ref_id_model="{ref_id_model}"')
         search_id_model = self._ref_id_to_search_id(ref_id_model)
-        search_id_model.computeComputedValues()
+        builder = impl.search_doc.SearchDocBuilder(ref_id_model)
+        search_id_model.computeComputedValues(builder)
         try:
             with transaction.atomic():
                 search_id_model.save()  # if error saving skips to exception
-                open_s = OpenSearchDoc(identifier=ref_id_model)
+                open_s = OpenSearchDoc(
+                    identifier=ref_id_model, search_identifier=search_id_model, builder=builder
+                )
                 is_good = open_s.index_document()
                 if not is_good:
                     raise DatabaseError('Error indexing in OpenSearch')  # should trigger rollback
@@ -183,9 +347,16 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
             search_id_model = ezidapp.models.identifier.SearchIdentifier(
                 identifier=ref_id_model.identifier
             )
+        return self._copy_ref_id(ref_id_model, search_id_model)
+
+    def _copy_ref_id(self, ref_id_model, search_id_model):
         for field_obj in ref_id_model._meta.fields:
             field_name = field_obj.attname
             if field_name not in ('id', 'identifier'):
                 v = getattr(ref_id_model, field_name)
                 setattr(search_id_model, field_name, v)
+                # Related objects that have already been read are reused, so that
+                # computing the search values does not read them again.
+                if field_obj.is_relation and field_obj.is_cached(ref_id_model):
+                    setattr(search_id_model, field_obj.name, getattr(ref_id_model, field_obj.name))
         return search_id_model
@@ -9,6 +9,20 @@ because identifier changes can be complex (creation times can change, ownership
 change, even users and groups can change) and tracking the effects of those changes on
 statistics would require knowledge of an identifier's pre-change state, which is not
 recorded.
+
+Statistics are fully recomputed once per DAEMONS_STATISTICS_COMPUTE_CYCLE (or once a day,
+see DAEMONS_STATISTICS_COMPUTE_SAME_TIME_OF_DAY). In between, they are updated
+incrementally every DAEMONS_STATISTICS_INCREMENTAL_CYCLE seconds. Every identifier
+creation, update and deletion passes through the search indexer queue, whose tasks record
+the identifier's owner and creation time after the change. An incremental update recounts
+the statistics of the (owner, creation month) classes of the tasks completed since the
+last update, so the pre-change state is not needed, except when an identifier changes
+owner or creation time, or when a user changes group or realm. Those changes are only
+reflected in the statistics by the next full recompute.
+
+Queue tasks become visible as their transactions commit, which is not necessarily in seq
+order. So that a task with a lower seq is not skipped, updates do not move past tasks
+enqueued within the last DAEMONS_STATISTICS_QUEUE_LAG seconds.
 """
 
 import datetime
@@ -23,12 +37,23 @@ import django.db.models
 import django.db.transaction
 
 import ezidapp.management.commands.proc_base
+import ezidapp.models.async_queue
 import ezidapp.models.identifier
 import ezidapp.models.statistics
 import ezidapp.models.user
 
 BATCH_SIZE = 10000
 
+# Search indexer task statuses from which the task may still change the SearchIdentifier
+# table. Incremental updates stop at the first task in one of these statuses, or enqueued
+# within the last DAEMONS_STATISTICS_QUEUE_LAG seconds.
+_PENDING_STATUS_LIST = [
+    ezidapp.models.async_queue.SearchIndexerQueue.UNSUBMITTED,
+    ezidapp.models.async_queue.SearchIndexerQueue.UNCHECKED,
+    ezidapp.models.async_queue.SearchIndexerQueue.SUBMITTED,
+    ezidapp.models.async_queue.SearchIndexerQueue.TRANSIENT_FAILURE,
+]
+
 log = logging.getLogger(__name__)
 
 
@@ -43,37 +68,40 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
     def run(self):
         # log.debug(f'In {__name__} run loop...')
 
-        if not self.opt.debug:
-            if django.conf.settings.DAEMONS_STATISTICS_COMPUTE_SAME_TIME_OF_DAY:
-                self.sleep(self._sameTimeOfDayDelta())
-            else:
-                # We arbitrarily sleep 10 minutes to avoid putting a burden on the
-                # server near startup or reload.
-                self.sleep(600)
+        if self.opt.debug:
+            next_full_ts = self.now()
+        elif django.conf.settings.DAEMONS_STATISTICS_COMPUTE_SAME_TIME_OF_DAY:
+            next_full_ts = self.now() + self._sameTimeOfDayDelta()
+        else:
+            # We arbitrarily wait 10 minutes to avoid putting a burden on the
+            # server near startup or reload.
+            next_full_ts = self.now() + 600
+
+        incremental_cycle = django.conf.settings.DAEMONS_STATISTICS_INCREMENTAL_CYCLE
 
         while not self.terminated():
-            start_ts = self.now()
-            self.recomputeStatistics()
-            if django.conf.settings.DAEMONS_STATISTICS_COMPUTE_SAME_TIME_OF_DAY:
-                self.sleep(self._sameTimeOfDayDelta())
-            else:
-                self.sleep(
-                    max(
-                        django.conf.settings.DAEMONS_STATISTICS_COMPUTE_CYCLE
-                        - (self.now() - start_ts),
-                        0,
-                    )
-                )
+            if self.now() >= next_full_ts:
+                start_ts = self.now()
+                self.recomputeStatistics()
+                if django.conf.settings.DAEMONS_STATISTICS_COMPUTE_SAME_TIME_OF_DAY:
+                    next_full_ts = self.now() + self._sameTimeOfDayDelta()
+                else:
+                    next_full_ts = start_ts + django.conf.settings.DAEMONS_STATISTICS_COMPUTE_CYCLE
+            elif incremental_cycle > 0:
+                self.updateStatistics()
+            delay = max(next_full_ts - self.now(), 0)
+            if incremental_cycle > 0:
+                delay = min(delay, incremental_cycle)
+            self.sleep(delay)
 
     def recomputeStatistics(self):
         """Recompute and stores identifier statistics
 
-        The old statistics are completely replaced.
+        The old statistics are completely replaced. Only the rows whose values have
+        changed are written.
         """
-        user_dict = {
-            u.id: (u.pid, u.group.pid, u.realm.name)
-            for u in ezidapp.models.user.User.objects.all().select_related('group', 'realm')
-        }
+        queue_seq = self._completedQueueSeq()
+        user_dict = self._userDict()
         counter_dict = {}
         last_id_str = ''
 
@@ -108,22 +136,163 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
 
                 last_id_str = id_model.identifier
 
+        if self.terminated():
+            return
+
         log.debug(f'Updating statistics: {pprint.pformat(counter_dict)}')
 
         with django.db.transaction.atomic():
-            ezidapp.models.statistics.Statistics.objects.all().delete()
-            for k, v in counter_dict.items():
-                c = ezidapp.models.statistics.Statistics(
-                    month=k[0],
-                    owner=user_dict[k[1]][0],
-                    ownergroup=user_dict[k[1]][1],
-                    realm=user_dict[k[1]][2],
-                    type=k[2],
-                    hasMetadata=k[3],
-                    count=v,
+            self._storeStatistics(
+                counter_dict, user_dict, ezidapp.models.statistics.Statistics.objects.all()
+            )
+            self._setQueueSeq(queue_seq)
+
+    def updateStatistics(self):
+        """Update the identifier statistics for the identifiers created, updated or
+        deleted since the last update
+
+        Does nothing until the statistics have been fully computed once.
+        """
+        queue_model = ezidapp.models.async_queue.SearchIndexerQueue
+        queue_seq = self._state().queueSeq
+        if queue_seq is None:
+            return
+        user_dict = self._userDict()
+        class_set = set()
+        is_pending = False
+        lag_ts = self.now_int() - django.conf.settings.DAEMONS_STATISTICS_QUEUE_LAG
+
+        while not is_pending and not self.terminated():
+            qs = (
+                queue_model.objects.filter(seq__gt=queue_seq)
+                .select_related('refIdentifier')
+                .only(
+                    'seq',
+                    'status',
+                    'enqueueTime',
+                    'refIdentifier__identifier',
+                    'refIdentifier__isTest',
+                    'refIdentifier__owner_id',
+                    'refIdentifier__createTime',
                 )
-                c.full_clean(validate_unique=False)
-                c.save(force_insert=True)
+                .order_by('seq')
+            )[:BATCH_SIZE]
+
+            if not qs:
+                break
+
+            for task_model in qs:
+                if task_model.status in _PENDING_STATUS_LIST or task_model.enqueueTime > lag_ts:
+                    is_pending = True
+                    break
+                ref_id = task_model.refIdentifier
+                if not ref_id.isTest and ref_id.owner_id in user_dict:
+                    class_set.add((ref_id.owner_id, self._timestampToMonth(ref_id.createTime)))
+                queue_seq = task_model.seq
+
+        if self.terminated() or queue_seq == self._state().queueSeq:
+            return
+
+        counter_dict = {}
+        for owner_id, month in class_set:
+            begin_ts, end_ts = self._monthRange(month)
+            for id_str, create_ts, has_metadata in (
+                ezidapp.models.identifier.SearchIdentifier.objects.filter(
+                    owner_id=owner_id,
+                    createTime__gte=begin_ts,
+                    createTime__lt=end_ts,
+                    isTest=False,
+                ).values_list('identifier', 'createTime', 'hasMetadata')
+            ):
+                if self._timestampToMonth(create_ts) != month:
+                    continue
+                k = (month, owner_id, self._identifierType(id_str), has_metadata)
+                counter_dict[k] = counter_dict.get(k, 0) + 1
+
+        log.debug(
+            f'Updating statistics for {len(class_set)} owner months, '
+            f'through queue seq {queue_seq}: {pprint.pformat(counter_dict)}'
+        )
+
+        class_q = django.db.models.Q(pk__in=[])
+        for owner_id, month in class_set:
+            class_q |= django.db.models.Q(owner=user_dict[owner_id][0], month=month)
+        with django.db.transaction.atomic():
+            self._storeStatistics(
+                counter_dict,
+                user_dict,
+                ezidapp.models.statistics.Statistics.objects.filter(class_q),
+            )
+            self._setQueueSeq(queue_seq)
+
+    def _storeStatistics(self, counter_dict, user_dict, existing_qs):
+        """Make the Statistics rows selected by existing_qs match counter_dict
+
+        Rows for classes that are no longer in counter_dict are deleted, and only
+        rows whose values have changed are updated. Must be called in a transaction.
+        """
+        model = ezidapp.models.statistics.Statistics
+        new_dict = {}
+        for k, v in counter_dict.items():
+            owner, ownergroup, realm = user_dict[k[1]]
+            new_dict[(k[0], owner, k[2], k[3])] = (ownergroup, realm, v)
+        delete_list = []
+        update_list = []
+        for c in existing_qs.select_for_update():
+            v = new_dict.pop((c.month, c.owner, c.type, c.hasMetadata), None)
+            if v is None:
+                delete_list.append(c.pk)
+            elif v != (c.ownergroup, c.realm, c.count):
+                c.ownergroup, c.realm, c.count = v
+                update_list.append(c)
+        create_list = []
+        for k, v in new_dict.items():
+            c = model(
+                month=k[0],
+                owner=k[1],
+                ownergroup=v[0],
+                realm=v[1],
+                type=k[2],
+                hasMetadata=k[3],
+                count=v[2],
+            )
+            c.full_clean(validate_unique=False)
+            create_list.append(c)
+        model.objects.filter(pk__in=delete_list).delete()
+        model.objects.bulk_update(update_list, ['ownergroup', 'realm', 'count'], batch_size=1000)
+        model.objects.bulk_create(create_list, batch_size=1000)
+        log.debug(
+            f'Statistics rows: {len(create_list)} created, {len(update_list)} updated, '
+            f'{len(delete_list)} deleted'
+        )
+
+    def _userDict(self):
+        return {
+            u.id: (u.pid, u.group.pid, u.realm.name)
+            for u in ezidapp.models.user.User.objects.all().select_related('group', 'realm')
+        }
+
+    def _completedQueueSeq(self):
+        """Return the search indexer queue seq up to which all tasks have completed,
+        so that their changes are reflected in the SearchIdentifier table"""
+        queue_model = ezidapp.models.async_queue.SearchIndexerQueue
+        lag_ts = self.now_int() - django.conf.settings.DAEMONS_STATISTICS_QUEUE_LAG
+        pending_seq = queue_model.objects.filter(
+            django.db.models.Q(status__in=_PENDING_STATUS_LIST)
+            | django.db.models.Q(enqueueTime__gt=lag_ts)
+        ).aggregate(django.db.models.Min('seq'))['seq__min']
+        if pending_seq is not None:
+            return pending_seq - 1
+        return queue_model.objects.aggregate(django.db.models.Max('seq'))['seq__max'] or 0
+
+    def _state(self):
+        model = ezidapp.models.statistics.StatisticsState
+        return model.objects.get_or_create(pk=1)[0]
+
+    def _setQueueSeq(self, queue_seq):
+        ezidapp.models.statistics.StatisticsState.objects.update_or_create(
+            pk=1, defaults={'queueSeq': queue_seq}
+        )
 
     def _sameTimeOfDayDelta(self):
         now = datetime.datetime.now()
@@ -137,5 +306,13 @@ class Command(ezidapp.management.commands.proc_base.AsyncProcessingCommand):
     def _timestampToMonth(self, t):
         return time.strftime('%Y-%m', time.localtime(t))
 
+    def _monthRange(self, month):
+        """Return the range of timestamps [begin, end) of a month in the syntax
+        YYYY-MM, in local time"""
+        y, m = (int(v) for v in month.split('-'))
+        begin_ts = time.mktime((y, m, 1, 0, 0, 0, 0, 0, -1))
+        end_ts = time.mktime((y + m // 12, m % 12 + 1, 1, 0, 0, 0, 0, 0, -1))
+        return int(begin_ts), int(end_ts)
+
     def _identifierType(self, id_str):
         return id_str.split(':')[0].upper()
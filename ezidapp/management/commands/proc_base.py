@@ -1,12 +1,16 @@
 #  Copyright©2021, Regents of the University of California
 #  http://creativecommons.org/licenses/BSD
 import argparse
+import collections
+import concurrent.futures
 import http.client
 import logging
 import multiprocessing
 import os
 import signal
+import socket
 import sys
+import threading
 import time
 import types
 import typing
@@ -18,17 +22,36 @@ import urllib.response
 import django.conf
 import django.core.management
 import django.db
+import django.db.models
 import django.db.transaction
 
 import ezidapp.models.async_queue
+import impl.queue_notify
 
 class AsyncProcessingCommand(django.core.management.BaseCommand):
     help = __doc__
     setting = None
     queue: typing.Optional[ezidapp.models.async_queue.AsyncQueueBase] = None
+    # The setting holding the number of worker threads that process the queue in each
+    # instance of the command, or None for a single worker.
+    workers_setting = None
+    # The setting holding the number of tasks each worker performs concurrently in the
+    # default run loop, or None to perform the tasks one at a time.
+    concurrency_setting = None
+    # Task statuses that are saved as soon as a task has been processed, for outcomes
+    # that must not be lost if the worker dies before the end of the batch. Tasks with
+    # other statuses are saved together, with a single query, at the end of the batch,
+    # and are processed again if the worker dies before then.
+    immediate_status_set = frozenset()
+    # Task statuses in which a task is superseded by a later task for the same identifier.
+    # As the later task carries the latest state of the identifier, only it is
+    # performed. See supersede_tasks().
+    supersede_status_set = frozenset({ezidapp.models.async_queue.AsyncQueueBase.UNSUBMITTED})
     name = None
     _terminated = False
     _last_connection_reset = 0
+    # The queue notification listener of each worker thread
+    _listener_local = threading.local()
     _http_client_timeout = 30  # seconds, overridden by DAEMONS_HTTP_CLIENT_TIMEOUT
 
     class _AbortException(Exception):
@@ -99,46 +122,320 @@ class AsyncProcessingCommand(django.core.management.BaseCommand):
         The async processes that don't use a queue based on AsyncQueueBase must override
         this to supply their own loop.
 
+        The queue is processed by the number of worker threads set by workers_setting,
+        each running run_worker(). Workers claim disjoint sets of tasks with
+        claim_tasks(), so any number of workers, in any number of instances of the
+        command, can process the same queue.
+
         This method is not called for disabled async processes.
         """
         assert self.queue is not None, "Must specify queue or override run()"
 
-        while not self.terminated():
-            qs = self.queue.objects.filter(status=self.queue.UNSUBMITTED,).order_by(
-                "-seq"
-            )[: django.conf.settings.DAEMONS_MAX_BATCH_SIZE]
-            if not qs:
-                self.sleep(django.conf.settings.DAEMONS_IDLE_SLEEP)
-                continue
+        worker_count = 1
+        if self.workers_setting is not None:
+            worker_count = getattr(django.conf.settings, self.workers_setting)
+        if worker_count == 1:
+            self.run_worker()
+        else:
+            threads = [
+                threading.Thread(target=self._run_worker_thread, name=f'{self.name}-{i}')
+                for i in range(worker_count)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                while t.is_alive():
+                    t.join(1)
+        self.close_listener()
+        self.log.info("Exiting run loop.")
+
+    def _run_worker_thread(self):
+        try:
+            self.run_worker()
+        finally:
+            self.close_listener()
+            django.db.connection.close()
 
-            for task_model in qs:
+    def run_worker(self):
+        """Run the processing loop of a single worker
+
+        If concurrency_setting is set, the tasks of each batch are performed by that
+        number of threads, with the tasks of each identifier performed in order by a
+        single thread.
+        """
+        concurrency = 1
+        if self.concurrency_setting is not None:
+            concurrency = getattr(django.conf.settings, self.concurrency_setting)
+        executor = None
+        if concurrency > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                concurrency, thread_name_prefix=threading.current_thread().name
+            )
+        try:
+            while not self.terminated():
+                task_list = self.claim_tasks(
+                    self.queue.objects.filter(status=self.queue.UNSUBMITTED,)
+                    .select_related(
+                        'refIdentifier__owner',
+                        'refIdentifier__ownergroup',
+                        'refIdentifier__datacenter',
+                        'refIdentifier__profile',
+                    )
+                    .order_by("-seq"),
+                    django.conf.settings.DAEMONS_MAX_BATCH_SIZE,
+                )
+                if not task_list:
+                    self.wait_for_tasks()
+                    continue
+
+                done_list = []
                 try:
-                    self.do_task(task_model)
-                    task_model.status = self.queue.SUCCESS
-                except AsyncProcessingIgnored:
-                    task_model.status = self.queue.IGNORED
-                except Exception as e:
-                    if isinstance(e, AsyncProcessingRemoteError):
-                        # This is a bit messy. Do not log a trace when the
-                        # error is due to the remote service rejecting the request.
-                        # Such an error is still permanent for the task though.
-                        self.log.error(e)
+                    if executor is None:
+                        self.process_task_list(task_list, done_list)
                     else:
-                        self.log.error('#' * 100)
-                        self.log.error(f'Exception when handling task "{task_model}"')
-
-                    task_model.error = str(e)
-                    # if self.is_permanent_error(e):
-                    task_model.status = self.queue.FAILURE
-                    task_model.errorIsPermanent = True
-                    # raise
+                        identifier_dict = collections.defaultdict(list)
+                        for task_model in sorted(task_list, key=lambda t: t.seq):
+                            identifier_dict[task_model.refIdentifier.identifier].append(
+                                task_model
+                            )
+                        future_list = [
+                            executor.submit(self._process_task_list_thread, t, done_list)
+                            for t in identifier_dict.values()
+                        ]
+                        for future in future_list:
+                            future.result()
+                finally:
+                    self.save_task_list(done_list)
+
+                self.sleep(django.conf.settings.DAEMONS_BATCH_SLEEP)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _process_task_list_thread(self, task_list, done_list):
+        try:
+            self.process_task_list(task_list, done_list)
+        finally:
+            django.db.connection.close()
+
+    def process_task_list(self, task_list, done_list):
+        """Perform the claimed tasks in task_list, in order, and add them to done_list
+        to be saved at the end of the batch
+        """
+        for task_model in task_list:
+            if not self.has_lease(task_model):
+                break
+            try:
+                self.do_task(task_model)
+                task_model.status = self.queue.SUCCESS
+            except AsyncProcessingIgnored:
+                task_model.status = self.queue.IGNORED
+            except Exception as e:
+                if isinstance(e, AsyncProcessingRemoteError):
+                    # This is a bit messy. Do not log a trace when the
+                    # error is due to the remote service rejecting the request.
+                    # Such an error is still permanent for the task though.
+                    self.log.error(e)
                 else:
-                    task_model.submitTime = self.now_int()
+                    self.log.error('#' * 100)
+                    self.log.error(f'Exception when handling task "{task_model}"')
 
-                task_model.save()
+                task_model.error = str(e)
+                # if self.is_permanent_error(e):
+                task_model.status = self.queue.FAILURE
+                task_model.errorIsPermanent = True
+                # raise
+            else:
+                task_model.submitTime = self.now_int()
 
-            self.sleep(django.conf.settings.DAEMONS_BATCH_SLEEP)
-        self.log.info("Exiting run loop.")
+            self.finish_task(task_model, done_list)
+
+    def wait_for_tasks(self):
+        """Sleep until tasks are added to the queue
+
+        When queue notifications are enabled, the worker is woken up by impl.enqueue,
+        and only polls the queue every DAEMONS_QUEUE_NOTIFY_IDLE_SLEEP seconds, for
+        tasks added on other hosts. Otherwise, this is a DAEMONS_IDLE_SLEEP sleep.
+        """
+        if not impl.queue_notify.is_enabled():
+            self.sleep(django.conf.settings.DAEMONS_IDLE_SLEEP)
+            return
+        listener = getattr(self._listener_local, 'listener', None)
+        if listener is None:
+            listener = impl.queue_notify.Listener(self.queue)
+            self._listener_local.listener = listener
+        self.sleep(django.conf.settings.DAEMONS_QUEUE_NOTIFY_IDLE_SLEEP, listener=listener)
+
+    def close_listener(self):
+        """Stop receiving queue notifications in the current worker"""
+        listener = getattr(self._listener_local, 'listener', None)
+        if listener is not None:
+            listener.close()
+            self._listener_local.listener = None
+
+    def lease_owner(self):
+        """Return the name under which the current worker takes leases on tasks"""
+        return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+    def claim_tasks(self, qs, limit):
+        """Take leases on up to 'limit' of the tasks selected by qs, and return the
+        tasks in the order of qs
+
+        A lease is taken with a conditional update that only succeeds on tasks without an
+        unexpired lease, so concurrent workers, in this or other processes, claim
+        disjoint sets of tasks. Tasks for identifiers on which another worker holds a
+        lease are released again, so that the tasks for an identifier are never
+        processed concurrently.
+
+        Tasks superseded by later tasks for the same identifier are not returned. See
+        supersede_tasks().
+
+        Leases are released by save_task(). The leases of a worker that dies expire
+        after DAEMONS_QUEUE_LEASE seconds, and its tasks are then claimed by other
+        workers.
+        """
+        now = self.now_int()
+        seq_list = list(qs.filter(leaseExpires__lt=now).values_list('seq', flat=True)[:limit])
+        if not seq_list:
+            return []
+        lease_owner = self.lease_owner()
+        self.queue.objects.filter(seq__in=seq_list, leaseExpires__lt=now).update(
+            leaseOwner=lease_owner,
+            leaseExpires=now + django.conf.settings.DAEMONS_QUEUE_LEASE,
+        )
+        task_list = list(qs.filter(seq__in=seq_list, leaseOwner=lease_owner))
+        busy_set = set(
+            self.queue.objects.filter(
+                refIdentifier__identifier__in={t.refIdentifier.identifier for t in task_list},
+                leaseExpires__gte=now,
+            )
+            .exclude(leaseOwner=lease_owner)
+            .values_list('refIdentifier__identifier', flat=True)
+        )
+        if busy_set:
+            self.queue.objects.filter(
+                seq__in=[t.seq for t in task_list if t.refIdentifier.identifier in busy_set],
+                leaseOwner=lease_owner,
+            ).update(leaseOwner='', leaseExpires=0)
+            task_list = [t for t in task_list if t.refIdentifier.identifier not in busy_set]
+        return self.supersede_tasks(task_list)
+
+    def supersede_tasks(self, task_list):
+        """Set the status of tasks that are superseded by a later pending task for the
+        same identifier to SUPERSEDED, and return the claimed tasks that remain
+
+        The tasks of an identifier all reference the identifier's latest state, so
+        performing only the latest pending task brings the remote service up to date.
+        This also holds across operations: a later delete supersedes earlier creates and
+        updates, and a create of an identifier that was deleted and then recreated
+        supersedes the delete. The create and update operations are handled the same way
+        by all processes, so an update may supersede the create of the same identifier.
+
+        Only tasks with a status in supersede_status_set are superseded, and only the
+        tasks of the identifiers in task_list, which are not leased by other workers.
+        """
+        now = self.now_int()
+        identifier_set = {
+            t.refIdentifier.identifier for t in task_list if t.status in self.supersede_status_set
+        }
+        if not identifier_set:
+            return task_list
+        pending_qs = self.queue.objects.filter(
+            django.db.models.Q(leaseExpires__lt=now)
+            | django.db.models.Q(leaseOwner=self.lease_owner()),
+            refIdentifier__identifier__in=identifier_set,
+            status__in=self.supersede_status_set,
+        )
+        latest_dict = dict(
+            pending_qs.order_by()
+            .values_list('refIdentifier__identifier')
+            .annotate(django.db.models.Max('seq'))
+        )
+        if not latest_dict:
+            return task_list
+        earlier_q = django.db.models.Q()
+        for identifier, seq in latest_dict.items():
+            earlier_q |= django.db.models.Q(refIdentifier__identifier=identifier, seq__lt=seq)
+        superseded_count = pending_qs.filter(earlier_q).update(
+            status=self.queue.SUPERSEDED,
+            submitTime=now,
+            leaseOwner='',
+            leaseExpires=0,
+        )
+        if superseded_count:
+            self.log.debug(f'Superseded {superseded_count} tasks')
+        return [
+            t
+            for t in task_list
+            if t.status not in self.supersede_status_set
+            or t.seq >= latest_dict.get(t.refIdentifier.identifier, t.seq)
+        ]
+
+    def has_lease(self, task_model):
+        """Return True if the lease on a claimed task has not expired
+
+        Processing of a claimed batch of tasks must stop at the first task for which
+        this returns False, as the task may have been claimed by another worker.
+        """
+        return self.now_int() < task_model.leaseExpires
+
+    def save_task(self, task_model):
+        """Save a processed task, and release the lease on it
+
+        The task is not saved if the lease has expired and the task has been claimed by
+        another worker.
+        """
+        lease_owner = task_model.leaseOwner
+        task_model.leaseOwner = ''
+        task_model.leaseExpires = 0
+        # noinspection PyProtectedMember
+        if not self.queue.objects.filter(seq=task_model.seq, leaseOwner=lease_owner).update(
+            **{
+                f.attname: getattr(task_model, f.attname)
+                for f in task_model._meta.concrete_fields
+                if not f.primary_key
+            }
+        ):
+            self.log.warning(f'Lost lease on task "{task_model}"')
+
+    def finish_task(self, task_model, done_list):
+        """Save a processed task if its status is in immediate_status_set, or else add
+        it to done_list, to be saved with save_task_list() at the end of the batch
+        """
+        if task_model.status in self.immediate_status_set:
+            self.save_task(task_model)
+        else:
+            done_list.append(task_model)
+
+    def save_task_list(self, task_list):
+        """Save a batch of processed tasks with a single query, and release the leases
+        on them
+
+        As in save_task(), tasks whose leases have expired and which have been claimed
+        by another worker are not saved.
+        """
+        if not task_list:
+            return
+        for task_model in task_list:
+            task_model.leaseOwner = ''
+            task_model.leaseExpires = 0
+        # Filtering on the lease owner releases the leases, and skips tasks whose
+        # leases have expired and been claimed by another worker.
+        saved_count = self.queue.objects.filter(leaseOwner=self.lease_owner()).bulk_update(
+            task_list,
+            [
+                'status',
+                'message',
+                'batchId',
+                'error',
+                'errorIsPermanent',
+                'submitTime',
+                'leaseOwner',
+                'leaseExpires',
+            ],
+        )
+        if saved_count < len(task_list):
+            self.log.warning(f'Lost lease on {len(task_list) - saved_count} tasks')
 
     def create(self, task_model):
         """Must be overridden by processes that use the default run loop"""
@@ -209,7 +506,7 @@ class AsyncProcessingCommand(django.core.management.BaseCommand):
         '''Seconds since epoch as integer'''
         return int(self.now())
 
-    def sleep(self, duration_sec, check_terminated_sec=1.0):
+    def sleep(self, duration_sec, check_terminated_sec=1.0, listener=None):
         """Go to sleep, close DB connection at regular intervals.
 
         Only reset the db connections after at least this time since last reset.
@@ -224,6 +521,8 @@ class AsyncProcessingCommand(django.core.management.BaseCommand):
               has been set.
             check_terminated_sec (float): The amount of time to sleep between each check
               of the terminate flag.
+            listener (impl.queue_notify.Listener): If set, the sleep also ends when a
+              queue notification is received.
         """
 
         start_ts = time.monotonic()
@@ -239,7 +538,10 @@ class AsyncProcessingCommand(django.core.management.BaseCommand):
             self._last_connection_reset = self.now_int()
 
         while time.monotonic() - start_ts < duration_sec and not self.terminated():
-            time.sleep(check_terminated_sec)
+            if listener is None:
+                time.sleep(check_terminated_sec)
+            elif listener.wait(check_terminated_sec):
+                break
 
     def raise_command_error(self, msg_str):
         raise django.core.management.CommandError(
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.14 on 2026-10-18 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0007_alter_searchidentifier_searchableresourcetype'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdentifierLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('username', models.CharField(db_index=True, max_length=255)),
+                ('operationId', models.CharField(max_length=32)),
+                ('worker', models.CharField(max_length=255)),
+                ('isWaiting', models.BooleanField(default=False)),
+                ('leaseExpires', models.IntegerField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IdentifierLockState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('isPaused', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.14 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0008_identifierlock_identifierlockstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='estimatedCount',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='harvestedCount',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='leaseExpires',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='leaseOwner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.14 on 2026-10-18 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0009_downloadqueue_estimatedcount_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='uploadId',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='uploadParts',
+            field=models.TextField(blank=True),
+        ),
+    ]
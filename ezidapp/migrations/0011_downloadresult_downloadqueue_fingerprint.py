@@ -0,0 +1,28 @@
+# Generated by Django 5.2.14 on 2026-10-18 05:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0010_downloadqueue_uploadid_downloadqueue_uploadparts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64, unique=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('createTime', models.IntegerField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='downloadqueue',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
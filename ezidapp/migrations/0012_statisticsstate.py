@@ -0,0 +1,20 @@
+# Generated by Django 5.2.14 on 2026-10-18 05:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0011_downloadresult_downloadqueue_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatisticsState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queueSeq', models.IntegerField(blank=True, null=True)),
+            ],
+        ),
+    ]
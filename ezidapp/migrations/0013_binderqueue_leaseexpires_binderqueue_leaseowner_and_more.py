@@ -0,0 +1,53 @@
+# Generated by Django 5.2.14 on 2026-10-18 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0012_statisticsstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='binderqueue',
+            name='leaseExpires',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='binderqueue',
+            name='leaseOwner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='crossrefqueue',
+            name='leaseExpires',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='crossrefqueue',
+            name='leaseOwner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='datacitequeue',
+            name='leaseExpires',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='datacitequeue',
+            name='leaseOwner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='searchindexerqueue',
+            name='leaseExpires',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='searchindexerqueue',
+            name='leaseOwner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.14 on 2026-10-18 05:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0013_binderqueue_leaseexpires_binderqueue_leaseowner_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='binderqueue',
+            name='status',
+            field=models.CharField(choices=[('U', 'Awaiting submission'), ('C', 'Submitted, unchecked'), ('S', 'Submitted'), ('W', 'Registered with warning'), ('F', 'Registration failed'), ('T', 'Registration attempt unsuccessful'), ('I', 'Ignored (operation not applicable)'), ('O', 'Completed successfully'), ('R', 'Superseded by a later operation')], db_index=True, default='U', max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='crossrefqueue',
+            name='status',
+            field=models.CharField(choices=[('U', 'Awaiting submission'), ('C', 'Submitted, unchecked'), ('S', 'Submitted'), ('W', 'Registered with warning'), ('F', 'Registration failed'), ('T', 'Registration attempt unsuccessful'), ('I', 'Ignored (operation not applicable)'), ('O', 'Completed successfully'), ('R', 'Superseded by a later operation')], db_index=True, default='U', max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='datacitequeue',
+            name='status',
+            field=models.CharField(choices=[('U', 'Awaiting submission'), ('C', 'Submitted, unchecked'), ('S', 'Submitted'), ('W', 'Registered with warning'), ('F', 'Registration failed'), ('T', 'Registration attempt unsuccessful'), ('I', 'Ignored (operation not applicable)'), ('O', 'Completed successfully'), ('R', 'Superseded by a later operation')], db_index=True, default='U', max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='searchindexerqueue',
+            name='status',
+            field=models.CharField(choices=[('U', 'Awaiting submission'), ('C', 'Submitted, unchecked'), ('S', 'Submitted'), ('W', 'Registered with warning'), ('F', 'Registration failed'), ('T', 'Registration attempt unsuccessful'), ('I', 'Ignored (operation not applicable)'), ('O', 'Completed successfully'), ('R', 'Superseded by a later operation')], db_index=True, default='U', max_length=1),
+        ),
+    ]
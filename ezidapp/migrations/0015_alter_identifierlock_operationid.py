@@ -0,0 +1,18 @@
+# Generated by Django 5.2.14 on 2026-10-18 06:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ezidapp', '0014_alter_binderqueue_status_alter_crossrefqueue_status_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='identifierlock',
+            name='operationId',
+            field=models.CharField(db_index=True, max_length=32),
+        ),
+    ]
@@ -1,4 +1,5 @@
 #  Copyright©2021, Regents of the University of California
 #  http://creativecommons.org/licenses/BSD
 
-from .minter import Minter
\ No newline at end of file
+from .minter import Minter
+from .download_result import DownloadResult
@@ -61,6 +61,8 @@ class AsyncQueueBase(django.db.models.Model):
     TRANSIENT_FAILURE = "T"
     IGNORED = "I"
     SUCCESS = "O"
+    # Not performed, as a later task for the same identifier was pending.
+    SUPERSEDED = "R"
     STATUS_CODE_TO_LABEL_DICT = {
         UNSUBMITTED: 'Awaiting submission',
         UNCHECKED: 'Submitted, unchecked',
@@ -70,6 +72,7 @@ class AsyncQueueBase(django.db.models.Model):
         TRANSIENT_FAILURE: 'Registration attempt unsuccessful',
         IGNORED: 'Ignored (operation not applicable)',
         SUCCESS: 'Completed successfully',
+        SUPERSEDED: 'Superseded by a later operation',
     }
     STATUS_LABEL_TO_CODE_DICT = {v: k for k, v in STATUS_CODE_TO_LABEL_DICT.items()}
 
@@ -130,6 +133,12 @@ class AsyncQueueBase(django.db.models.Model):
     # disable processing on the identifier and must be removed manually.
     errorIsPermanent = django.db.models.BooleanField(default=False)
 
+    # The worker processing the task, and the time (as a Unix timestamp) at
+    # which its lease on the task expires. Tasks with expired leases are
+    # available to all workers.
+    leaseOwner = django.db.models.CharField(max_length=255, blank=True)
+    leaseExpires = django.db.models.IntegerField(default=0, db_index=True)
+
 
 # Subclasses that create tables from the abstract base model.
 
@@ -154,9 +163,9 @@ class SearchIndexerQueue(AsyncQueueBase):
 
 
 class DownloadQueue(django.db.models.Model):
-    # Holds batch download requests. Since the download processor is
-    # single-threaded, if there are multiple entries, only the first
-    # entry is "in progress."
+    # Holds batch download requests. A request is processed by the
+    # download worker holding an unexpired lease on it, so several
+    # requests may be in progress at once.
 
     # Order of insertion into this table; also, the order in which
     # requests are processed.
@@ -244,3 +253,29 @@ class DownloadQueue(django.db.models.Model):
     # The size of the file in bytes after the last flush. HARVEST stage
     # only.
     fileSize = django.db.models.BigIntegerField(blank=True, null=True)
+
+    # The download worker processing the request, and the time (as a Unix
+    # timestamp) at which its lease on the request expires. Requests with
+    # expired leases are available to all workers.
+    leaseOwner = django.db.models.CharField(max_length=255, blank=True)
+    leaseExpires = django.db.models.IntegerField(default=0, db_index=True)
+
+    # The estimated number of identifiers to harvest, used for scheduling.
+    # Computed when the request is first considered for processing.
+    estimatedCount = django.db.models.BigIntegerField(blank=True, null=True)
+
+    # The number of identifiers harvested so far; with estimatedCount, the
+    # progress of the request. HARVEST stage only.
+    harvestedCount = django.db.models.BigIntegerField(default=0)
+
+    # For downloads streamed to S3 (see DAEMONS_DOWNLOAD_STREAMING), the
+    # ID of the S3 multipart upload, and a list of the ETags of the parts
+    # uploaded so far, e.g., 'LS"9b2cf535f27731c974343645a3985328"'.
+    # Encoded per download.encode. Empty for downloads written to local
+    # files.
+    uploadId = django.db.models.TextField(blank=True)
+    uploadParts = django.db.models.TextField(blank=True)
+
+    # The fingerprint of the request parameters and of the identifiers in
+    # scope, computed when processing starts. See DownloadResult.
+    fingerprint = django.db.models.CharField(max_length=64, blank=True)
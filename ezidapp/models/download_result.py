@@ -0,0 +1,41 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Database model for reusable batch download results
+"""
+
+import django.db.models
+
+
+class DownloadResult(django.db.models.Model):
+    """A completed batch download, available for reuse by identical requests
+
+    A download is identified by a fingerprint of its normalized request parameters and
+    of the state of the identifiers in scope when it was harvested (see proc-download).
+    A later request with the same fingerprint would produce the same download, so the
+    existing S3 object is copied instead.
+    """
+
+    def __str__(self):
+        return (
+            f'{self.__class__.__name__}('
+            f'fingerprint={self.fingerprint}, '
+            f'filename={self.filename}, '
+            f'size={self.size}, '
+            f'createTime={self.createTime}'
+            f')'
+        )
+
+    # SHA-256 hex digest of the request parameters and identifier state.
+    fingerprint = django.db.models.CharField(max_length=64, unique=True)
+
+    # The filename of the S3 object, relative to S3_BUCKET_DOWNLOAD_PATH, e.g.,
+    # "ofqTb4ndbkom15Tn.csv.gz".
+    filename = django.db.models.CharField(max_length=255)
+
+    # The size of the S3 object in bytes.
+    size = django.db.models.BigIntegerField()
+
+    # The time the S3 object was created, as a Unix timestamp. Objects are deleted
+    # after DAEMONS_DOWNLOAD_FILE_LIFETIME seconds.
+    createTime = django.db.models.IntegerField(db_index=True)
@@ -27,6 +27,7 @@ import ezidapp.models.validation
 import impl.crossref
 import impl.datacite
 import impl.mapping
+import impl.search_doc
 import impl.util
 import impl.util2
 
@@ -940,63 +941,17 @@ class SearchIdentifier(IdentifierBase):
     def computeHasIssues(self):
         self.hasIssues = not self.hasMetadata or self.linkIsBroken or self.isCrossrefBad
 
-    def computeComputedValues(self):
+    def computeComputedValues(self, builder=None):
+        """Compute the search columns from the identifier's metadata
 
-        self.searchableTarget = self.target[::-1][
-            : self._meta.get_field("searchableTarget").max_length
-        ]
-        self.resourceCreator = ""
-        self.resourceTitle = ""
-        self.resourcePublisher = ""
-        self.resourcePublicationDate = ""
-        self.resourceType = ""
-        km = self.kernelMetadata
-        if km.creator is not None:
-            self.resourceCreator = km.creator
-        if km.title is not None:
-            self.resourceTitle = km.title
-        if km.publisher is not None:
-            self.resourcePublisher = km.publisher
-        if km.date is not None:
-            self.resourcePublicationDate = km.date
-        d = km.validatedDate
-        if d is not None:
-            self.searchablePublicationYear = int(d[:4])
-        else:
-            self.searchablePublicationYear = None
-        if km.type is not None:
-            self.resourceType = km.type
-        t = km.validatedType
-        if t is not None:
-            self.searchableResourceType = ezidapp.models.validation.resourceTypes[t.split("/")[0]]
-        else:
-            self.searchableResourceType = ""
-        kw = [self.identifier, self.owner.username, self.ownergroup.groupname]
-        if self.isDatacite:
-            kw.append(self.datacenter.symbol)
-        if self.target != self.defaultTarget:
-            kw.append(self.target)
-        for k, v in list(self.metadata.items()):
-            if k in ["datacite", "crossref"]:
-                try:
-                    kw.append(impl.util.extractXmlContent(v))
-                except Exception:
-                    kw.append(v)
-            else:
-                kw.append(v)
-        self.keywords = " ; ".join(kw)
-        self.resourceCreatorPrefix = self.resourceCreator[: self.indexedPrefixLength]
-        self.resourceTitlePrefix = self.resourceTitle[: self.indexedPrefixLength]
-        self.resourcePublisherPrefix = self.resourcePublisher[: self.indexedPrefixLength]
-        self.hasMetadata = (
-            self.resourceTitle != ""
-            and self.resourcePublicationDate != ""
-            and (self.resourceCreator != "" or self.resourcePublisher != "")
-        )
-        self.publicSearchVisible = self.isPublic and self.exported and not self.isTest
-        self.oaiVisible = (
-            self.publicSearchVisible and self.hasMetadata and self.target != self.defaultTarget
-        )
+        'builder' may be an impl.search_doc.SearchDocBuilder for this identifier, which
+        is shared with the OpenSearch document, so that the metadata is only mapped
+        once.
+        """
+        if builder is None:
+            builder = impl.search_doc.SearchDocBuilder(self)
+        for k, v in builder.search_identifier_values().items():
+            setattr(self, k, v)
         self.computeHasIssues()
 
     # def fromLegacy(self, d):
@@ -0,0 +1,68 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Database models for the shared identifier lock manager
+
+These tables are only used when IDENTIFIER_LOCK_BACKEND is 'database'. See
+impl.identifier_lock.
+"""
+
+import django.db.models
+
+import impl.util
+
+
+class IdentifierLock(django.db.models.Model):
+    """An identifier lock held, or waited for, by an operation
+
+    An operation that holds locks has one row per locked identifier, all sharing the
+    operation's operationId, or a single row with an empty identifier if it locks no
+    identifiers. An operation that is waiting for locks has a single row with isWaiting
+    set and an empty identifier.
+
+    Every row carries a lease. Rows with expired leases belong to workers that died
+    without releasing their locks, and are ignored and eventually removed.
+    """
+
+    def __str__(self):
+        return (
+            f'{self.__class__.__name__}('
+            f'identifier={self.identifier}, '
+            f'username={self.username}, '
+            f'worker={self.worker}, '
+            f'isWaiting={self.isWaiting}, '
+            f'leaseExpires={self.leaseExpires}'
+            f')'
+        )
+
+    # The identifier (or other lock key, e.g., a shoulder lock) that is locked.
+    identifier = django.db.models.CharField(
+        max_length=impl.util.maxIdentifierLength, blank=True, db_index=True
+    )
+
+    # The local username (or other throttle key) of the user performing the operation.
+    username = django.db.models.CharField(max_length=255, db_index=True)
+
+    # The operation holding, or waiting for, the lock. Rows for the locks of a single
+    # operation share this value.
+    operationId = django.db.models.CharField(max_length=32, db_index=True)
+
+    # The worker (host and process) performing the operation.
+    worker = django.db.models.CharField(max_length=255)
+
+    # True if the operation is waiting for its locks.
+    isWaiting = django.db.models.BooleanField(default=False)
+
+    # The time (as a Unix timestamp) at which the lease on this row expires.
+    leaseExpires = django.db.models.IntegerField(db_index=True)
+
+
+class IdentifierLockState(django.db.models.Model):
+    """Global state of the shared identifier lock manager
+
+    This table holds a single row. Locking the row serializes the pause and throttle
+    checks across workers.
+    """
+
+    # If true, no new identifier locks are granted.
+    isPaused = django.db.models.BooleanField(default=False)
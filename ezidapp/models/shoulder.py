@@ -10,6 +10,7 @@ deleting as necessary. Shoulders and datacenters are also loaded into in-memory
 
 
 import logging
+import time
 
 import django.apps
 import django.conf
@@ -17,6 +18,7 @@ import django.core.exceptions
 import django.db
 import django.db.models
 import django.db.models.functions
+import django.db.models.signals
 import django.db.transaction
 
 # import ezidapp.models.datacenter
@@ -179,30 +181,54 @@ def getAllShoulders():
 
 
 def getLongestShoulderMatch(identifier):
+    # Returns the shoulder having the longest prefix of 'identifier', or None. The
+    # shoulders are shared by all callers and must not be modified. Matching ignores
+    # case, e.g., a DOI with a lowercase suffix matches its shoulder.
     lm = None
-
-    for s in (
-        Shoulder.objects.annotate(
-            identifier=django.db.models.Value(identifier, output_field=django.db.models.CharField())
-        )
-        .select_related("datacenter")
-        .filter(identifier__startswith=django.db.models.F('prefix'))
-    ):
-        # for s in Shoulder.objects.select_related("datacenter").filter(
-        #     identifier__startswith='prefix',
-        # ):
-        if lm is None or len(s.prefix) > len(lm.prefix):
-            lm = s
-
+    node = _getShoulderTrie()
+    for c in identifier.casefold():
+        node = node.get(c)
+        if node is None:
+            break
+        lm = node.get(None, lm)
     return lm
 
-    # lm = None
-    # # noinspection PyUnresolvedReferences
-    # for s in list(_shoulders.values()):
-    #     if identifier.startswith(s.prefix):
-    #         if lm is None or len(s.prefix) > len(lm.prefix):
-    #             lm = s
-    # return lm
+
+# In-memory prefix trie of all shoulders, used for longest-prefix matching. Each node
+# is a dict mapping the next prefix character to a child node. The shoulder whose
+# prefix ends at a node is stored under the None key. Prefixes are casefolded, as
+# matching ignores case. The trie is reloaded after SHOULDER_CACHE_TTL seconds, so that
+# shoulder changes made by other processes (e.g., the shoulder-activate command) take
+# effect, and immediately when a shoulder or datacenter is saved or deleted by this
+# process.
+_shoulderTrie = None
+
+
+def _getShoulderTrie():
+    global _shoulderTrie
+    t = _shoulderTrie
+    if t is None or time.monotonic() - t[0] > django.conf.settings.SHOULDER_CACHE_TTL:
+        trie = {}
+        for s in Shoulder.objects.select_related(
+            "datacenter", "shoulder_type", "registration_agency"
+        ):
+            node = trie
+            for c in s.prefix.casefold():
+                node = node.setdefault(c, {})
+            node[None] = s
+        t = (time.monotonic(), trie)
+        _shoulderTrie = t
+    return t[1]
+
+
+def clearShoulderCache(**_kwargs):
+    global _shoulderTrie
+    _shoulderTrie = None
+
+
+for _sender in (Shoulder, 'ezidapp.Datacenter'):
+    django.db.models.signals.post_save.connect(clearShoulderCache, sender=_sender)
+    django.db.models.signals.post_delete.connect(clearShoulderCache, sender=_sender)
 
 
 def getShoulder(prefix):
@@ -61,3 +61,15 @@ class Statistics(django.db.models.Model):
     count = django.db.models.IntegerField(
         validators=[django.core.validators.MinValueValidator(0)]
     )
+
+
+class StatisticsState(django.db.models.Model):
+    """State of the incremental statistics maintenance
+
+    This table holds a single row.
+    """
+
+    # The SearchIndexerQueue seq up to which identifier changes are reflected in the
+    # statistics, or null if the statistics have not been computed yet. Set by each
+    # full recompute, and advanced by each incremental update.
+    queueSeq = django.db.models.IntegerField(null=True, blank=True)
@@ -132,8 +132,9 @@ class User(django.db.models.Model):
             )
         except Exception as e:
             logger.error('failed')
+            is_valid = False
 
-        if not django.contrib.auth.hashers.check_password(password, self.password):
+        if not is_valid:
             logger.debug('Auth denied. Password check failed')
             logger.debug(
                 'User\'s hashed pw: {}'.format(
@@ -139,3 +139,37 @@ def parseConcatenate(s):
             else:
                 d[k] = v
     return d
+
+
+def parseRecords(s):
+    """Parse a string holding a sequence of ANVL records and return a list of
+    (header, dictionary) tuples
+
+    Each record starts with a header line beginning with "::", followed by the record's
+    elements, as in:
+
+      :: ark:/99999/fk4abc
+      erc.who: Proust, Marcel
+
+    This is the framing used in ANVL batch downloads. The header is the percent-decoded
+    remainder of the "::" line and may be empty. Blank lines and comments before the
+    first header are ignored. Raises AnvlParseException (defined in this module).
+    """
+    recordList = []
+    header = None
+    lineList = None
+    # We avoid splitlines here to avoid splitting on other weirdo
+    # Unicode characters that count as line breaks.
+    for l in re.split("\r\n?|\n", s):
+        if l.startswith("::"):
+            if lineList is not None:
+                recordList.append((header, parse("\n".join(lineList))))
+            header = _decode(l[2:]).strip()
+            lineList = []
+        elif lineList is not None:
+            lineList.append(l)
+        elif len(l.strip()) > 0 and l[0] != "#":
+            raise AnvlParseException("no record header")
+    if lineList is not None:
+        recordList.append((header, parse("\n".join(lineList))))
+    return recordList
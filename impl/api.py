@@ -16,6 +16,12 @@ Mint an identifier:
   request body: optional metadata
   response body: status line
 
+Mint a batch of identifiers:
+  POST /shoulder/{shoulder}?count={N}   [authentication required]
+  request body: optional sequence of N metadata records, each starting with a "::"
+    header line
+  response body: status line, followed by one status line per identifier, streamed
+
 Create an identifier:
   PUT /id/{identifier}   [authentication required]
     ?update_if_exists={yes|no}
@@ -33,6 +39,20 @@ Update an identifier:
   request body: optional metadata
   response body: status line
 
+Create a batch of identifiers:
+  PUT /id/   [authentication required]
+    ?update_if_exists={yes|no}
+  request body: sequence of metadata records, each starting with a
+    ":: {identifier}" header line
+  response body: status line, followed by one status line per record, streamed
+
+Update a batch of identifiers:
+  POST /id/   [authentication required]
+    ?update_external_services={yes|no}
+  request body: sequence of metadata records, each starting with a
+    ":: {identifier}" header line
+  response body: status line, followed by one status line per record, streamed
+
 Delete an identifier:
   DELETE /id/{identifier}   [authentication required]
     ?update_external_services={yes|no}
@@ -92,6 +112,7 @@ import typing
 
 import django.conf
 import django.http
+import django.utils.http
 
 import ezidapp.models.identifier
 import ezidapp.models.model_util
@@ -141,6 +162,52 @@ def _readInput(request):
         return msg_str
 
 
+def _readRecords(request):
+    """Like _readInput(), for a request body holding a sequence of ANVL records
+
+    Returns a list of (header, metadata) tuples, or a string on error.
+    """
+    if not is_text_plain_utf8(request):
+        return (
+            'error: bad request - If specified, Content-Type must be text/plain '
+            'and encoding must be UTF-8'
+        )
+    try:
+        return [
+            (
+                impl.util.sanitizeXmlSafeCharset(header),
+                {
+                    impl.util.sanitizeXmlSafeCharset(k): impl.util.sanitizeXmlSafeCharset(v)
+                    for k, v in list(d.items())
+                },
+            )
+            for header, d in impl.anvl.parseRecords(request.body.decode("utf-8"))
+        ]
+    except UnicodeDecodeError:
+        return "error: bad request - character decoding error"
+    except impl.anvl.AnvlParseException as e:
+        return f"error: bad request - ANVL parse error ({str(e)})"
+    except Exception:
+        msg_str = "error: bad request - malformed or incomplete request body"
+        logging.error(msg_str)
+        return msg_str
+
+
+def _readBatchCount(options):
+    """Return the batch size from the 'count' URL query parameter, or a string on
+    error"""
+    try:
+        count = int(options["count"])
+    except ValueError:
+        return "error: bad request - invalid value for URL query parameter 'count'"
+    if not 1 <= count <= django.conf.settings.API_BATCH_MAX_COUNT:
+        return (
+            f"error: bad request - 'count' must be between 1 and "
+            f"{django.conf.settings.API_BATCH_MAX_COUNT}"
+        )
+    return count
+
+
 def is_text_plain_utf8(request):
     content_type = request.META.get('CONTENT_TYPE', '')
     mimetype = None
@@ -239,6 +306,23 @@ def _response(status, createRequest=False, addAuthenticateHeader=False, anvlBody
     return r
 
 
+def _streamingResponse(status, statusGenerator):
+    """Return a response with a status line followed by the status lines yielded by
+    'statusGenerator', which are streamed back to the client as they become
+    available"""
+
+    def _lineGenerator():
+        yield impl.anvl.formatPair(*[v.strip() for v in status.split(":", 1)])
+        for s in statusGenerator:
+            yield impl.anvl.formatPair(*[v.strip() for v in s.split(":", 1)])
+
+    return django.http.StreamingHttpResponse(
+        _lineGenerator(),
+        status=_statusMapping(status, False),
+        content_type="text/plain; charset=utf-8",
+    )
+
+
 def _unauthorized():
     return _response("error: unauthorized", addAuthenticateHeader=True)
 
@@ -252,7 +336,11 @@ def _methodNotAllowed():
 
 
 def mintIdentifier(request):
-    """Mint an identifier; interface to ezid.mintIdentifier"""
+    """Mint an identifier; interface to ezid.mintIdentifier
+
+    If the 'count' URL query parameter is present, mint a batch of identifiers;
+    interface to ezid.mintIdentifiers
+    """
     if request.method != "POST":
         return _methodNotAllowed()
     user = impl.userauth.authenticateRequest(request)
@@ -260,24 +348,55 @@ def mintIdentifier(request):
         return _response(user)
     elif not user:
         return _unauthorized()
+    options = _validateOptions(request, {"count": None})
+    if type(options) is str:
+        return _response(options)
+    if "count" in options:
+        return _mintIdentifiers(request, user, options)
     metadata = _readInput(request)
     if type(metadata) is str:
         return _response(metadata)
-    options = _validateOptions(request, {})
-    if type(options) is str:
-        return _response(options)
     assert request.path_info.startswith("/shoulder/")
     shoulder = request.path_info[10:]
     return _response(impl.ezid.mintIdentifier(shoulder, user, metadata), createRequest=True)
 
 
+def _mintIdentifiers(request, user, options):
+    count = _readBatchCount(options)
+    if type(count) is str:
+        return _response(count)
+    records = _readRecords(request)
+    if type(records) is str:
+        return _response(records)
+    if len(records) == 0:
+        metadataList = [{} for _ in range(count)]
+    elif len(records) == count:
+        metadataList = [metadata for _, metadata in records]
+    else:
+        return _response(
+            f"error: bad request - 'count' is {count} but the request body holds "
+            f"{len(records)} records"
+        )
+    assert request.path_info.startswith("/shoulder/")
+    shoulder = request.path_info[10:]
+    # Minting happens here, so that a batch that cannot be minted gets an error status.
+    statusGenerator = impl.ezid.mintIdentifiers(shoulder, user, metadataList)
+    if type(statusGenerator) is str:
+        return _response(statusGenerator)
+    return _streamingResponse(f"success: minting {count} identifiers", statusGenerator)
+
+
 def identifierDispatcher(request):
     """Dispatch an identifier request depending on the HTTP method"""
     if request.method == "GET":
         return _getMetadata(request)
     elif request.method == "POST":
+        if request.path_info == "/id/":
+            return _updateIdentifiers(request)
         return _setMetadata(request)
     elif request.method == "PUT":
+        if request.path_info == "/id/":
+            return _createIdentifiers(request)
         return _createIdentifier(request)
     elif request.method == "DELETE":
         return _deleteIdentifier(request)
@@ -366,6 +485,70 @@ def _createIdentifier(request):
     )
 
 
+def _readBatchRecords(request):
+    """Read the records of a batch create or update request
+
+    Returns a list of (identifier, metadata) tuples, or a string on error.
+    """
+    records = _readRecords(request)
+    if type(records) is str:
+        return records
+    if len(records) == 0:
+        return "error: bad request - no records in request body"
+    if len(records) > django.conf.settings.API_BATCH_MAX_COUNT:
+        return (
+            f"error: bad request - request body holds more than "
+            f"{django.conf.settings.API_BATCH_MAX_COUNT} records"
+        )
+    return records
+
+
+def _createIdentifiers(request):
+    user = impl.userauth.authenticateRequest(request)
+    if type(user) is str:
+        return _response(user)
+    elif not user:
+        return _unauthorized()
+    options = _validateOptions(request, {"update_if_exists": [("yes", True), ("no", False)]})
+    if type(options) is str:
+        return _response(options)
+    records = _readBatchRecords(request)
+    if type(records) is str:
+        return _response(records)
+    return _streamingResponse(
+        f"success: creating {len(records)} identifiers",
+        impl.ezid.createIdentifiers(
+            records, user, updateIfExists=options.get("update_if_exists", False)
+        ),
+    )
+
+
+def _updateIdentifiers(request):
+    user = impl.userauth.authenticateRequest(request)
+    if type(user) is str:
+        return _response(user)
+    elif user is None:
+        return _unauthorized()
+    # Easter egg.
+    options = _validateOptions(
+        request,
+        {"update_external_services": [("yes", True), ("no", False)]} if user.isSuperuser else {},
+    )
+    if type(options) is str:
+        return _response(options)
+    records = _readBatchRecords(request)
+    if type(records) is str:
+        return _response(records)
+    return _streamingResponse(
+        f"success: updating {len(records)} identifiers",
+        impl.ezid.updateIdentifiers(
+            records,
+            user,
+            updateExternalServices=options.get("update_external_services", True),
+        ),
+    )
+
+
 def _deleteIdentifier(request):
     user = impl.userauth.authenticateRequest(request)
     if type(user) is str:
@@ -484,11 +667,14 @@ def _statusLineGenerator(includeSuccessLine):
         yield "success: server paused\n"
     while True:
         activeUsers, waitingUsers, isPaused = impl.ezid.getStatus()
+        authCacheHits, authCacheMisses = impl.userauth.getCredentialCacheStatus()
         s = (
             f"STATUS {'paused' if isPaused else 'running'} "
             f"activeOperations={sum(activeUsers.values())} "
             f"waitingRequests={sum(waitingUsers.values())} "
             f"dataciteQueueLength={impl.statistics.getDataCiteQueueLength()} "
+            f"authCacheHits={authCacheHits} "
+            f"authCacheMisses={authCacheMisses} "
             "\n"
         )
         yield s
@@ -872,12 +1058,21 @@ def resolveIdentifier(
     try:
         # Populate the identifier structure but with minimal field info, enough to
         # service the redirect
-        res = identifier_info.find_record(fields=["identifier", "updateTime", "target", "status"])
+        try:
+            res = impl.resolver.resolution_cache.find_record(identifier_info)
+        finally:
+            L.debug("Resolver lookups: %s", identifier_info.lookups)
         if res.isReserved:
             # A reserved identifier is not resolvable
             raise ValueError
         t_modified = datetime.datetime.fromtimestamp(res.updateTime, tz=datetime.timezone.utc)
         headers = {"Last-Modified": t_modified.strftime(HTTP_DATE_FORMAT)}
+        # The client's copy is current if the identifier has not been modified since
+        if_modified_since = django.utils.http.parse_http_date_safe(
+            request.headers.get("If-Modified-Since", "")
+        )
+        if if_modified_since is not None and res.updateTime <= if_modified_since:
+            return django.http.HttpResponseNotModified(headers=headers)
         msg["id"] = res.identifier
         msg["extra"] = identifier_info.extra
         # identifier.resolverTarget checks for unavailable status and returns
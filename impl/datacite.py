@@ -6,7 +6,6 @@ operated by the Technische Informationsbibliothek (TIB)
 <http://www.tib.uni-hannover.de/>.
 """
 
-import http.client
 import logging
 import os
 import os.path
@@ -14,13 +13,12 @@ import re
 import threading
 import time
 import typing
-import urllib.error
 import urllib.parse
-import urllib.request
-import urllib.response
 
 import django.conf
 import lxml.etree
+import requests
+import requests.adapters
 import xmltodict
 
 import ezidapp.models.shoulder
@@ -84,16 +82,50 @@ RESOURCE_TYPE_TEMPLATE_2 = """  <resourceType resourceTypeGeneral="{}">{}</resou
 """
 
 
-class _HTTPErrorProcessor(urllib.request.HTTPErrorProcessor):
-    def http_response(self, request, response: http.client.HTTPResponse):
-        # Bizarre that Python considers this an error.
-        # TODO: Check if this is still required
-        if response.status == 201:
-            return response
-        else:
-            return super().http_response(request, response)
+_session = None
+_sessionLock = threading.Lock()
+
+
+def _getSession():
+    """Return the HTTP session shared by all DataCite requests in this process
+
+    The session keeps up to DATACITE_HTTP_POOL_SIZE connections to the DataCite MDS
+    alive, so that requests reuse established TLS connections. It is safe to use from
+    several threads.
+    """
+    global _session
+    with _sessionLock:
+        if _session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=django.conf.settings.DATACITE_HTTP_POOL_SIZE
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _request(method, url, doi, datacenter, data=None, contentType=None):
+    """Perform a request to the DataCite MDS on the shared session, and return the
+    requests.Response, whatever its status
+    """
+    # We manually supply the HTTP Basic authorization header to avoid the doubling of
+    # the number of HTTP transactions caused by the challenge/response model.
+    headers = {"Authorization": _authorization(doi, datacenter)}
+    if contentType is not None:
+        headers["Content-Type"] = contentType
+    return _getSession().request(
+        method,
+        url,
+        data=data,
+        headers=headers,
+        timeout=django.conf.settings.DATACITE_TIMEOUT,
+    )
 
-    https_response = http_response
+
+def _body(response):
+    return response.content.decode("utf-8", errors="replace")
 
 
 def registerIdentifier(doi, targetUrl, datacenter=None):
@@ -115,40 +147,33 @@ def registerIdentifier(doi, targetUrl, datacenter=None):
     # To deal with transient problems with the Handle system underlying
     # the DataCite service, we make multiple attempts.
     for i in range(django.conf.settings.DATACITE_NUM_ATTEMPTS):
-        o = urllib.request.build_opener(_HTTPErrorProcessor)
-
         data = "doi={}\nurl={}".format(
             doi.replace('\\', r'\\'),
             targetUrl.replace("\\", r'\\'),
         ).encode("utf-8")
-
-        r = urllib.request.Request(django.conf.settings.DATACITE_DOI_URL, data=data)
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header("Authorization", _authorization(doi, datacenter))
-        r.add_header("Content-Type", "text/plain; charset=utf-8")
-
-        c = None
         try:
-            c = o.open(r, timeout=django.conf.settings.DATACITE_TIMEOUT)
-            body_str = c.read().decode('utf-8', errors='replace')
+            r = _request(
+                "POST",
+                django.conf.settings.DATACITE_DOI_URL,
+                doi,
+                datacenter,
+                data=data,
+                contentType="text/plain; charset=utf-8",
+            )
+            body_str = _body(r)
+            if r.status_code == 400 and body_str.startswith("[url]"):
+                return body_str
+            r.raise_for_status()
             assert body_str == "OK", f"Unexpected return from DataCite register DOI operation: {body_str}"
-        except urllib.error.HTTPError as e:
+        except requests.exceptions.HTTPError as e:
             log.debug(f'registerIdentifier() failed: {str(e)}')
-            body_str = e.fp.read().decode('utf-8', errors='replace')
-            if e.code == 400 and body_str.startswith("[url]"):
-                return body_str
-            if e.code != 500 or i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
+            if e.response.status_code != 500 or i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 raise e
         except Exception:
             if i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 raise
         else:
             break
-        finally:
-            if c:
-                c.close()
         # increase reattempt delay as a magnitude of DATACITE_NUM_ATTEMPTS
         time.sleep(django.conf.settings.DATACITE_REATTEMPT_DELAY + (60 * (i + 1)))
     return None
@@ -184,29 +209,23 @@ def getTargetUrl(doi, datacenter=None):
     """
     # To hide transient network errors, we make multiple attempts.
     for i in range(django.conf.settings.DATACITE_NUM_ATTEMPTS):
-        o = urllib.request.build_opener(_HTTPErrorProcessor)
-        r = urllib.request.Request(
-            django.conf.settings.DATACITE_DOI_URL + "/" + urllib.parse.quote(doi)
-        )
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header("Authorization", _authorization(doi, datacenter))
-        c = None
         try:
-            c = o.open(r, timeout=django.conf.settings.DATACITE_TIMEOUT)
-            return c.read()
-        except urllib.error.HTTPError as e:
-            if e.code == 404:
+            r = _request(
+                "GET",
+                django.conf.settings.DATACITE_DOI_URL + "/" + urllib.parse.quote(doi),
+                doi,
+                datacenter,
+            )
+            if r.status_code == 404:
                 return None
-            if e.code != 500 or i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
+            r.raise_for_status()
+            return r.content
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code != 500 or i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 raise e
         except Exception:
             if i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 raise
-        finally:
-            if c:
-                c.close()
         # increase reattempt delay as a magnitude of DATACITE_NUM_ATTEMPTS
         time.sleep(django.conf.settings.DATACITE_REATTEMPT_DELAY + (60 * (i + 1)))
 
@@ -450,36 +469,32 @@ def uploadMetadata(doi, current, delta, forceUpload=False, datacenter=None):
         return None
     # To hide transient network errors, we make multiple attempts.
     for i in range(django.conf.settings.DATACITE_NUM_ATTEMPTS):
-        o = urllib.request.build_opener(_HTTPErrorProcessor)
-        r = urllib.request.Request(django.conf.settings.DATACITE_METADATA_URL)
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header("Authorization", _authorization(doi, datacenter))
-        r.add_header("Content-Type", "application/xml; charset=utf-8")
-        r.data = newRecord.encode("utf-8")
-        c = None
         try:
-            c = o.open(r, timeout=django.conf.settings.DATACITE_TIMEOUT)
-            body_str = c.read().decode('utf-8', errors='replace')
+            r = _request(
+                "POST",
+                django.conf.settings.DATACITE_METADATA_URL,
+                doi,
+                datacenter,
+                data=newRecord.encode("utf-8"),
+                contentType="application/xml; charset=utf-8",
+            )
+            body_str = _body(r)
+            if r.status_code in (400, 422):
+                log.error(f'{r.status_code} {r.reason}: {body_str}')
+                return f"element 'datacite': {body_str}"
+            r.raise_for_status()
             assert body_str.startswith("OK"), (
                 f"unexpected return from DataCite store metadata operation: {body_str}"
             )
-        except urllib.error.HTTPError as e:
-            message = e.fp.read().decode('utf-8', errors='replace')
-            log.error(f'{str(e)}: {message}')
-            if e.code in (400, 422):
-                return f"element 'datacite': {message}"
-            if e.code != 500 or i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
+        except requests.exceptions.HTTPError as e:
+            log.error(f'{str(e)}: {_body(e.response)}')
+            if e.response.status_code != 500 or i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 raise e
         except Exception:
             if i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 raise
         else:
             return None
-        finally:
-            if c:
-                c.close()
         # increase reattempt delay as a magnitude of DATACITE_NUM_ATTEMPTS
         time.sleep(django.conf.settings.DATACITE_REATTEMPT_DELAY + (60 * (i + 1)))
 
@@ -505,8 +520,8 @@ def deactivateIdentifier(doi, datacenter=None):
         return
     try:
         _deactivate(doi, datacenter)
-    except urllib.error.HTTPError as e:
-        if e.code == 404:
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code == 404:
             # The identifier must already have metadata in DataCite; in case
             # it doesn't (as may be the case with legacy identifiers),
             # upload some bogus metadata.
@@ -561,32 +576,20 @@ def pingDataciteOnly():
         return "up"
     # To hide transient network errors, we make multiple attempts.
     for i in range(django.conf.settings.DATACITE_NUM_ATTEMPTS):
-        o = urllib.request.build_opener(_HTTPErrorProcessor)
-        r = urllib.request.Request(
-            django.conf.settings.DATACITE_DOI_URL + "/" + django.conf.settings.DATACITE_PING_DOI
-        )
-        # We manually supply the HTTP Basic authorization header to avoid
-        # the doubling of the number of HTTP transactions caused by the
-        # challenge/response model.
-        r.add_header(
-            "Authorization",
-            _authorization(
+        try:
+            r = _request(
+                "GET",
+                django.conf.settings.DATACITE_DOI_URL + "/" + django.conf.settings.DATACITE_PING_DOI,
                 django.conf.settings.DATACITE_PING_DOI,
                 django.conf.settings.DATACITE_PING_DATACENTER,
-            ),
-        )
-        c = None
-        try:
-            c = o.open(r, timeout=django.conf.settings.DATACITE_TIMEOUT)
-            assert c.read() == django.conf.settings.DATACITE_PING_TARGET
+            )
+            r.raise_for_status()
+            assert _body(r) == django.conf.settings.DATACITE_PING_TARGET
         except Exception:
             if i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 return "down"
         else:
             return "up"
-        finally:
-            if c:
-                c.close()
         # increase reattempt delay as a magnitude of DATACITE_NUM_ATTEMPTS
         time.sleep(django.conf.settings.DATACITE_REATTEMPT_DELAY + (60 * (i + 1)))
 
@@ -896,29 +899,23 @@ def upgradeDcmsRecord_v2(record, parseString=True, returnString=True):
 def _deactivate(doi, datacenter):
     # To hide transient network errors, we make multiple attempts.
     for i in range(django.conf.settings.DATACITE_NUM_ATTEMPTS):
-        o = urllib.request.build_opener(_HTTPErrorProcessor)
-        r = urllib.request.Request(
-            django.conf.settings.DATACITE_METADATA_URL + "/" + urllib.parse.quote(doi)
-        )
-        # We manually supply the HTTP Basic authorization header to avoid the doubling
-        # of the number of HTTP transactions caused by the challenge/response model.
-        r.add_header("Authorization", _authorization(doi, datacenter))
-        r.get_method = lambda: "DELETE"
-        c = None
         try:
-            c = o.open(r, timeout=django.conf.settings.DATACITE_TIMEOUT)
-            assert c.read() == "OK", "Unexpected return from DataCite deactivate DOI operation"
-        except urllib.error.HTTPError as e:
-            if e.code != 500 or i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
+            r = _request(
+                "DELETE",
+                django.conf.settings.DATACITE_METADATA_URL + "/" + urllib.parse.quote(doi),
+                doi,
+                datacenter,
+            )
+            r.raise_for_status()
+            assert _body(r) == "OK", "Unexpected return from DataCite deactivate DOI operation"
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code != 500 or i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 raise e
         except Exception:
             if i == django.conf.settings.DATACITE_NUM_ATTEMPTS - 1:
                 raise
         else:
             break
-        finally:
-            if c:
-                c.close()
         # increase reattempt delay as a magnitude of DATACITE_NUM_ATTEMPTS
         time.sleep(django.conf.settings.DATACITE_REATTEMPT_DELAY + (60 * (i + 1)))
 
@@ -6,17 +6,22 @@
 Identifier create, update and delete operations are propagated to external services by
 adding them to a queue for each service. Each service is handled by a separate async
 process. The process is responsible for removing completed operations from its queue.
+When the transaction that adds the operations commits, the processes are woken up (see
+impl.queue_notify).
 """
 
+import collections
 import logging
 import time
 
 import django.apps
 import django.conf
+import django.db.transaction
 
 import ezidapp.models
 import ezidapp.models.async_queue
 import ezidapp.models.identifier
+import impl.queue_notify
 
 log = logging.getLogger(__name__)
 
@@ -48,6 +53,53 @@ def enqueue(
     # of the identifier and is immutable until deleted.
     ref_id_model = create_ref_id_model(si_model)
 
+    queue_model_list = _get_queue_model_list(si_model, updateExternalServices)
+    for queue_model in queue_model_list:
+        _enqueue_identifier(queue_model, ref_id_model, operation_label)
+    _notify_on_commit(queue_model_list)
+
+
+def enqueue_bulk(
+    si_model_list: list,
+    operation_label: str,
+    updateExternalServices: bool,
+) -> None:
+    """Add the same operation for each of a list of identifiers to the async processing
+    queues
+
+    This has the same effect as calling enqueue() for each identifier, but writes the
+    RefIdentifiers and the tasks for each queue with a single multi-row INSERT per
+    table.
+
+    As with enqueue(), this method should be called within the database transaction
+    that includes the identifiers' inserts, updates or deletes in the Identifier table.
+    The Identifiers must have been saved, so that their primary keys are set.
+    """
+    assert operation_label in ("create", "update", "delete")
+    ref_id_model_list = create_ref_id_model_bulk(si_model_list)
+    queue_dict = collections.defaultdict(list)
+    for si_model, ref_id_model in zip(si_model_list, ref_id_model_list):
+        for queue_model in _get_queue_model_list(si_model, updateExternalServices):
+            queue_dict[queue_model].append(
+                _new_queue_model(queue_model, ref_id_model, operation_label)
+            )
+    for queue_model, task_model_list in queue_dict.items():
+        queue_model.objects.bulk_create(task_model_list)
+    _notify_on_commit(list(queue_dict))
+
+
+def _notify_on_commit(queue_model_list):
+    """Wake up the async processes of the queues once the new tasks are visible to
+    them, which is when the current transaction commits
+
+    Outside of a transaction, the processes are woken up immediately.
+    """
+    if impl.queue_notify.is_enabled():
+        django.db.transaction.on_commit(lambda: impl.queue_notify.notify(queue_model_list))
+
+
+def _get_queue_model_list(si_model, updateExternalServices):
+    """Return the list of queue models to which operations on the identifier are added"""
     queue_model_list = [ezidapp.models.async_queue.SearchIndexerQueue]
     # Do not add reserved identifiers to crossref, or datacite queues
     # When the identifier entry is updated to not be reserved, then the various
@@ -62,8 +114,7 @@ def enqueue(
                     ezidapp.models.async_queue.DataciteQueue,
                 )
             )
-    for queue_model in queue_model_list:
-        _enqueue_identifier(queue_model, ref_id_model, operation_label)
+    return queue_model_list
 
 
 def create_ref_id_model(
@@ -85,19 +136,45 @@ def create_ref_id_model(
     'identifier' should be the normalized, qualified identifier, e.g.,
     "doi:10.5060/FOO".
     """
+    log.debug('Creating new RefIdentifier:')
+    ref_id_model = _copy_to_ref_id_model(id_model)
+    # ref_id_model.computeComputedValues()
+    ref_id_model.save()
+    return ref_id_model
+
+
+def create_ref_id_model_bulk(id_model_list: list) -> list:
+    """Like create_ref_id_model(), for a list of Identifiers, using a single INSERT
+
+    The RefIdentifiers take their primary keys from the Identifiers, so rows left over
+    from earlier operations on the same identifiers are updated in place, just as
+    save() does in create_ref_id_model().
+    """
+    ref_id_model_list = []
+    for id_model in id_model_list:
+        assert id_model.pk is not None, f'Identifier has not been saved: {id_model.identifier}'
+        ref_id_model_list.append(_copy_to_ref_id_model(id_model))
+    ref_id_cls = ezidapp.models.identifier.RefIdentifier
+    # noinspection PyProtectedMember
+    ref_id_cls.objects.bulk_create(
+        ref_id_model_list,
+        update_conflicts=True,
+        update_fields=[f.name for f in ref_id_cls._meta.fields if not f.primary_key],
+    )
+    return ref_id_model_list
+
+
+def _copy_to_ref_id_model(id_model):
     ref_id_model = ezidapp.models.identifier.RefIdentifier()
     # for field in si_model._meta.fields:
     #     field_value = getattr(si_model, field.name)
     #     setattr(ref_id_model, field.name, field_value)
-    log.debug('Creating new RefIdentifier:')
     # noinspection PyProtectedMember
     field_tup = ref_id_model._meta.fields
     for field in field_tup:
         field_value = getattr(id_model, field.name, None)
         setattr(ref_id_model, field.name, field_value)
         log.debug(f'  {field.name} = {field_value}')
-    # ref_id_model.computeComputedValues()
-    ref_id_model.save()
     return ref_id_model
 
 
@@ -108,7 +185,11 @@ def _enqueue_identifier(model, ref_id_model, operation_label):
         model: Queue model
         ref_id_model: Existing (saved) refIdentifier model
     """
-    model(
+    _new_queue_model(model, ref_id_model, operation_label).save()
+
+
+def _new_queue_model(model, ref_id_model, operation_label):
+    return model(
         # seq='',
         # enqueueTime=datetime.datetime.now().timestamp(),
         enqueueTime=int(time.time()),
@@ -122,4 +203,4 @@ def _enqueue_identifier(model, ref_id_model, operation_label):
         # error='',
         # errorIsPermanent='',
         refIdentifier=ref_id_model,
-    ).save()
+    )
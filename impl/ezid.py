@@ -1,18 +1,14 @@
 #  Copyright©2021, Regents of the University of California
 #  http://creativecommons.org/licenses/BSD
 
-"""Simple locking mechanism to ensure that, in a multi-threaded environment, no given
-identifier is operated on by two threads simultaneously. Additionally, we enforce a
-per-user throttle on concurrent operations. _activeUsers maps local usernames to the
-number of operations currently being performed by that user. For status reporting
-purposes, _waitingUsers similarly maps local usernames to numbers of waiting requests.
-If _paused is true, no new locks are granted, but the mechanism otherwise operates
-normally.
+"""Identifier operations
+
+Operations on identifiers are serialized, and throttled per user, by the identifier
+locks in impl.identifier_lock.
 """
 
 import logging
 import sys
-import threading
 import uuid
 
 import django.conf
@@ -27,61 +23,36 @@ import ezidapp.models.shoulder
 import ezidapp.models.user
 import ezidapp.models.util
 import impl.enqueue
+import impl.identifier_lock
 import impl.log
 import impl.nog_sql.ezid_minter
 import impl.policy
+import impl.resolver
 import impl.util
 import impl.util2
 
 logger = logging.getLogger(__name__)
 
-_lockedIdentifiers = set()
-_activeUsers = {}
-_waitingUsers = {}
-_lock = threading.Condition()
-_paused = False
 
+def _acquireIdentifierLock(identifier, user):
+    return _acquireIdentifierLocks({identifier}, user)
 
-def _incrementCount(d, k):
-    d[k] = d.get(k, 0) + 1
 
+def _acquireIdentifierLocks(identifierSet, user):
+    """Lock a set of identifiers as a single operation
 
-def _decrementCount(d, k):
-    if d[k] == 1:
-        del d[k]
-    else:
-        d[k] -= 1
+    The identifiers are locked together, when none of them are locked by other
+    operations, and count as one operation against the user's throttle.
+    """
+    return impl.identifier_lock.getLockManager().acquire(identifierSet, user)
 
 
-def _acquireIdentifierLock(identifier, user):
-    _lock.acquire()
-    # noinspection PyTypeChecker
-    while (
-        _paused
-        or identifier in _lockedIdentifiers
-        or _activeUsers.get(user, 0) >= django.conf.settings.MAX_CONCURRENT_OPERATIONS_PER_USER
-    ):
-        # noinspection PyTypeChecker
-        if _activeUsers.get(user, 0) + _waitingUsers.get(user, 0) >= int(
-            django.conf.settings.MAX_THREADS_PER_USER
-        ):
-            _lock.release()
-            return False
-        _incrementCount(_waitingUsers, user)
-        _lock.wait()
-        _decrementCount(_waitingUsers, user)
-    _incrementCount(_activeUsers, user)
-    _lockedIdentifiers.add(identifier)
-    _lock.release()
-    return True
+def _releaseIdentifierLock(identifier, user):
+    _releaseIdentifierLocks({identifier}, user)
 
 
-def _releaseIdentifierLock(identifier, user):
-    _lock.acquire()
-    _lockedIdentifiers.remove(identifier)
-    _decrementCount(_activeUsers, user)
-    _lock.notify_all()
-    _lock.release()
+def _releaseIdentifierLocks(identifierSet, user):
+    impl.identifier_lock.getLockManager().release(identifierSet, user)
 
 
 def getStatus():
@@ -92,13 +63,10 @@ def getStatus():
     dictionary values is the total number of operations currently being
     performed. The second dictionary similarly maps local usernames to
     numbers of waiting requests. The boolean flag indicates if the
-    server is currently paused.
+    server is currently paused. With the 'database' lock backend, the
+    counts cover all workers.
     """
-    _lock.acquire()
-    try:
-        return _activeUsers.copy(), _waitingUsers.copy(), _paused
-    finally:
-        _lock.release()
+    return impl.identifier_lock.getLockManager().getStatus()
 
 
 def pause(newValue):
@@ -107,16 +75,7 @@ def pause(newValue):
     If the server is paused, no new identifier locks are granted and all
     requests are forced to wait.
     """
-    global _paused
-    _lock.acquire()
-    try:
-        oldValue = _paused
-        _paused = newValue
-        if not _paused:
-            _lock.notify_all()
-        return oldValue
-    finally:
-        _lock.release()
+    return impl.identifier_lock.getLockManager().pause(newValue)
 
 
 # noinspection PyDefaultArgument
@@ -190,16 +149,7 @@ def _mintIdentifier(shoulder, user, metadata={}):
         else:
             return f"error: minter failed to create an identifier on shoulder {shoulder_model}"
 
-        # proto super shoulder check
-        prefix_val = django.conf.settings.PROTO_SUPER_SHOULDER.get(shoulder_model.prefix, shoulder_model.prefix)
-
-        if shoulder_model.prefix.startswith('doi:'):
-            identifier = prefix_val + identifier.upper()
-        elif shoulder_model.prefix.startswith('ark:/'):
-            identifier = prefix_val + identifier.lower()
-        else:
-            raise ValueError('Expected ARK or DOI prefix, not "{}"'.format(shoulder_model.prefix))
-
+        identifier = _qualifyMintedIdentifier(shoulder_model, identifier)
         logger.debug('Final shoulder + identifier: {}'.format(identifier))
 
     assert not ezidapp.models.identifier.Identifier.objects.filter(
@@ -215,6 +165,403 @@ def _mintIdentifier(shoulder, user, metadata={}):
     return createIdentifier(identifier, user, metadata)
 
 
+def _qualifyMintedIdentifier(shoulder_model, sping):
+    """Return the qualified identifier for a sping minted on the given shoulder"""
+    # proto super shoulder check
+    prefix_val = django.conf.settings.PROTO_SUPER_SHOULDER.get(
+        shoulder_model.prefix, shoulder_model.prefix
+    )
+    if shoulder_model.prefix.startswith('doi:'):
+        return prefix_val + sping.upper()
+    elif shoulder_model.prefix.startswith('ark:/'):
+        return prefix_val + sping.lower()
+    else:
+        raise ValueError('Expected ARK or DOI prefix, not "{}"'.format(shoulder_model.prefix))
+
+
+def mintIdentifiers(shoulder, user, metadataList):
+    """Mint one identifier per metadata dictionary in 'metadataList' under the given
+    qualified shoulder, e.g., "doi:10.5060/"
+
+    If the batch as a whole cannot be processed, an error string of the form returned by
+    mintIdentifier() is returned. Otherwise, the identifiers have been minted, and a
+    generator is returned that creates them, as by createIdentifiers(), and yields one
+    status string per metadata dictionary, in the same order.
+
+    All identifiers are minted in a single minter transaction. The shoulder is locked
+    only while minting, not while the identifiers are created. Identifiers that fail to
+    be created are not reissued.
+    """
+    tid = uuid.uuid1()
+    impl.log.begin(
+        tid,
+        "mintIdentifiers",
+        shoulder,
+        str(len(metadataList)),
+        user.username,
+        user.pid,
+        user.group.groupname,
+        user.group.pid,
+    )
+
+    shoulder_model = ezidapp.models.shoulder.getShoulder(shoulder)
+
+    if shoulder_model is None:
+        impl.log.badRequest(tid)
+        return "error: bad request - no such shoulder"
+
+    if shoulder_model.isUuid:
+        identifierList = ["uuid:" + str(uuid.uuid1()) for _ in metadataList]
+    else:
+        if shoulder_model.minter == "":
+            impl.log.badRequest(tid)
+            return "error: bad request - shoulder does not support minting"
+
+        if not _acquireIdentifierLock(
+            shoulder + '.shoulder_lock', user.username + '.shoulder_lock'
+        ):
+            return "error: concurrency limit exceeded"
+        try:
+            spingList = list(
+                impl.nog_sql.ezid_minter.mint_ids(shoulder_model, len(metadataList))
+            )
+        finally:
+            _releaseIdentifierLock(
+                shoulder + '.shoulder_lock', user.username + '.shoulder_lock'
+            )
+        # If minting was interrupted, the minter state was not saved.
+        if len(spingList) != len(metadataList):
+            return f"error: minter failed to create identifiers on shoulder {shoulder_model}"
+        identifierList = [_qualifyMintedIdentifier(shoulder_model, s) for s in spingList]
+
+    impl.log.success(tid, str(len(identifierList)))
+
+    return createIdentifiers(list(zip(identifierList, metadataList)), user)
+
+
+def createIdentifiers(identifierMetadataList, user, updateIfExists=False):
+    """Create identifiers from a list of (identifier, metadata) tuples
+
+    This is a generator that yields one status string per tuple, in the same order and
+    of the same form as returned by createIdentifier(). Each identifier is validated
+    independently. The identifiers that pass validation are written in chunks of up to
+    API_BATCH_CHUNK_SIZE, with one transaction and one multi-row INSERT per table
+    (Identifier, RefIdentifier and each queue) per chunk. The identifiers in a chunk are
+    locked together, as a single operation.
+
+    If 'updateIfExists' is true, identifiers that already exist are updated as by
+    updateIdentifiers().
+    """
+    for chunk in _chunkRecords(identifierMetadataList):
+        yield from _processChunk(_createIdentifierChunk, chunk, user, updateIfExists)
+
+
+def updateIdentifiers(identifierMetadataList, user, updateExternalServices=True):
+    """Set metadata elements of the identifiers in a list of (identifier, metadata)
+    tuples
+
+    This is a generator that yields one status string per tuple, in the same order and
+    of the same form as returned by setMetadata(). Each update is validated
+    independently, and the identifiers are written in chunks as described in
+    createIdentifiers(), with one multi-row UPDATE for the Identifier table per chunk.
+    """
+    for chunk in _chunkRecords(identifierMetadataList):
+        yield from _processChunk(_updateIdentifierChunk, chunk, user, updateExternalServices)
+
+
+def _chunkRecords(identifierMetadataList):
+    """Split a list of (identifier, metadata) tuples into chunks of up to
+    API_BATCH_CHUNK_SIZE (normalized identifier, metadata) tuples
+
+    A new chunk is started whenever an identifier repeats, so that the identifiers in a
+    chunk are unique. The normalized identifier is None for invalid identifiers.
+    """
+    chunkSize = django.conf.settings.API_BATCH_CHUNK_SIZE
+    chunk = []
+    identifierSet = set()
+    for identifier, metadata in identifierMetadataList:
+        normalizedIdentifier = impl.util.normalizeIdentifier(identifier)
+        if len(chunk) == chunkSize or normalizedIdentifier in identifierSet:
+            yield chunk
+            chunk = []
+            identifierSet = set()
+        chunk.append((normalizedIdentifier, metadata))
+        if normalizedIdentifier is not None:
+            identifierSet.add(normalizedIdentifier)
+    if chunk:
+        yield chunk
+
+
+def _processChunk(chunkFunc, chunk, user, *args):
+    identifierSet = {i for i, _ in chunk if i is not None}
+    if not _acquireIdentifierLocks(identifierSet, user.username):
+        return ["error: concurrency limit exceeded"] * len(chunk)
+    try:
+        return chunkFunc(chunk, user, *args)
+    finally:
+        _releaseIdentifierLocks(identifierSet, user.username)
+
+
+def _createIdentifierChunk(chunk, user, updateIfExists=False):
+    resultList = []
+    # (index into resultList, transaction ID, Identifier, metadata)
+    pendingList = []
+    for normalizedIdentifier, metadata in chunk:
+        if normalizedIdentifier is None:
+            resultList.append("error: bad request - invalid identifier")
+            continue
+        tid = uuid.uuid1()
+        impl.log.begin(
+            tid,
+            "createIdentifier",
+            f'normalizedIdentifier="{normalizedIdentifier}"',
+            f'user.username="{user.username}"',
+            f'user.pid="{user.pid}"',
+            f'user.group.groupname="{user.group.groupname}"',
+            f'user.group.pid="{user.group.pid}"',
+            f'metadata="{",".join(f"{k}={v}" for k, v in metadata.items())}"',
+        )
+        try:
+            si = _newIdentifier(tid, normalizedIdentifier, user, metadata)
+        except django.core.exceptions.ValidationError as e:
+            impl.log.badRequest(tid)
+            resultList.append("error: bad request - " + impl.util.formatValidationError(e))
+            continue
+        except Exception as e:
+            impl.log.error(tid, e)
+            if hasattr(sys, 'is_running_under_pytest'):
+                raise
+            resultList.append("error: internal server error")
+            continue
+        if type(si) is str:
+            resultList.append(si)
+            continue
+        resultList.append(None)
+        pendingList.append((len(resultList) - 1, tid, si, metadata))
+
+    # Identifiers that already exist are handled up front, so that they don't cause the
+    # bulk INSERT to fail.
+    existingSet = set(
+        ezidapp.models.identifier.Identifier.objects.filter(
+            identifier__in=[si.identifier for _, _, si, _ in pendingList]
+        ).values_list("identifier", flat=True)
+    )
+    insertList = []
+    updateList = []
+    for i, tid, si, metadata in pendingList:
+        if si.identifier not in existingSet:
+            insertList.append((i, tid, si))
+        elif updateIfExists:
+            logger.info(
+                f"create or update with update_if_exists=yes; identifier already exists, "
+                f"update; identifier={si.identifier}"
+            )
+            updateList.append((i, (si.identifier, metadata)))
+        else:
+            impl.log.badRequest(tid)
+            resultList[i] = "error: bad request - identifier already exists, cannot create"
+
+    try:
+        with django.db.transaction.atomic():
+            _bulkInsertIdentifiers([si for _, _, si in insertList])
+            impl.enqueue.enqueue_bulk([si for _, _, si in insertList], "create", True)
+    except Exception as e:
+        # Fall back to one transaction per identifier, so that the records that can be
+        # created are not held back by the ones that can't.
+        logger.warning(f'Bulk create failed, creating identifiers one by one: {e}')
+        for i, tid, si in insertList:
+            si.pk = None
+            si._state.adding = True
+            resultList[i] = _saveNewIdentifier(tid, si)
+    else:
+        impl.resolver.resolution_cache.invalidate(si.identifier for _, _, si in insertList)
+        for i, tid, si in insertList:
+            resultList[i] = _createSuccess(tid, si)
+
+    if updateList:
+        for (i, _), result in zip(
+            updateList, _updateIdentifierChunk([r for _, r in updateList], user, True)
+        ):
+            resultList[i] = result
+
+    return resultList
+
+
+def _updateIdentifierChunk(chunk, user, updateExternalServices=True):
+    resultList = []
+    # (index into resultList, transaction ID, Identifier)
+    pendingList = []
+    siDict = {
+        si.identifier: si
+        for si in ezidapp.models.identifier.Identifier.objects.select_related(
+            "owner", "owner__group", "ownergroup", "datacenter", "profile"
+        ).filter(identifier__in=[i for i, _ in chunk if i is not None])
+    }
+    for nqidentifier, metadata in chunk:
+        if nqidentifier is None:
+            resultList.append("error: bad request - invalid identifier")
+            continue
+        tid = uuid.uuid1()
+        impl.log.begin(
+            tid,
+            "setMetadata",
+            nqidentifier,
+            user.username,
+            user.pid,
+            user.group.groupname,
+            user.group.pid,
+            *[a for p in list(metadata.items()) for a in p],
+        )
+        si = siDict.get(nqidentifier)
+        if si is None:
+            impl.log.badRequest(tid)
+            resultList.append("error: bad request - no such identifier")
+            continue
+        try:
+            r = _updateIdentifier(tid, si, user, metadata, updateExternalServices)
+        except django.core.exceptions.ValidationError as e:
+            impl.log.badRequest(tid)
+            resultList.append("error: bad request - " + impl.util.formatValidationError(e))
+            continue
+        except Exception as e:
+            impl.log.error(tid, e)
+            if hasattr(sys, 'is_running_under_pytest'):
+                raise
+            resultList.append("error: internal server error")
+            continue
+        if type(r) is str:
+            resultList.append(r)
+            continue
+        resultList.append(None)
+        pendingList.append((len(resultList) - 1, tid, si))
+
+    try:
+        with django.db.transaction.atomic():
+            if pendingList:
+                # noinspection PyProtectedMember
+                ezidapp.models.identifier.Identifier.objects.bulk_update(
+                    [si for _, _, si in pendingList],
+                    [
+                        f.name
+                        for f in ezidapp.models.identifier.Identifier._meta.concrete_fields
+                        if not f.primary_key
+                    ],
+                )
+            impl.enqueue.enqueue_bulk(
+                [si for _, _, si in pendingList], "update", updateExternalServices
+            )
+    except Exception as e:
+        # Fall back to one transaction per identifier, as in _createIdentifierChunk().
+        logger.warning(f'Bulk update failed, updating identifiers one by one: {e}')
+        for i, tid, si in pendingList:
+            resultList[i] = _saveUpdatedIdentifier(tid, si, updateExternalServices)
+    else:
+        impl.resolver.resolution_cache.invalidate(si.identifier for _, _, si in pendingList)
+        for i, tid, si in pendingList:
+            impl.log.success(tid)
+            resultList[i] = "success: " + si.identifier
+
+    return resultList
+
+
+def _bulkInsertIdentifiers(siList):
+    """Insert Identifiers with a single multi-row INSERT
+
+    MySQL does not return the primary keys of rows inserted with bulk_create(), so they
+    are read back by identifier, which is unique.
+    """
+    ezidapp.models.identifier.Identifier.objects.bulk_create(siList)
+    if any(si.pk is None for si in siList):
+        pkDict = dict(
+            ezidapp.models.identifier.Identifier.objects.filter(
+                identifier__in=[si.identifier for si in siList]
+            ).values_list("identifier", "pk")
+        )
+        for si in siList:
+            si.pk = pkDict[si.identifier]
+    for si in siList:
+        si._state.adding = False
+
+
+def _saveNewIdentifier(tid, si):
+    try:
+        with django.db.transaction.atomic():
+            si.save()
+            impl.enqueue.enqueue(si, "create", updateExternalServices=True)
+    except django.db.utils.IntegrityError as e:
+        logger.error(str(e))
+        impl.log.badRequest(tid)
+        return "error: bad request - identifier already exists, cannot create"
+    except Exception as e:
+        impl.log.error(tid, e)
+        if hasattr(sys, 'is_running_under_pytest'):
+            raise
+        return "error: internal server error"
+    impl.resolver.resolution_cache.invalidate([si.identifier])
+    return _createSuccess(tid, si)
+
+
+def _saveUpdatedIdentifier(tid, si, updateExternalServices):
+    try:
+        with django.db.transaction.atomic():
+            si.save()
+            impl.enqueue.enqueue(si, "update", updateExternalServices)
+    except Exception as e:
+        impl.log.error(tid, e)
+        if hasattr(sys, 'is_running_under_pytest'):
+            raise
+        return "error: internal server error"
+    impl.resolver.resolution_cache.invalidate([si.identifier])
+    impl.log.success(tid)
+    return "success: " + si.identifier
+
+
+def _createSuccess(tid, si):
+    impl.log.success(tid)
+    if si.isDoi:
+        return f"success: {si.identifier} | {si.arkAlias}"
+    else:
+        return "success: " + si.identifier
+
+
+def _newIdentifier(tid, normalizedIdentifier, user, metadata):
+    """Return a new, validated and unsaved Identifier for createIdentifier()
+
+    On authorization failures, the failure is logged and an error string is returned
+    instead. Raises ValidationError on invalid metadata.
+    """
+    if not impl.policy.authorizeCreate(user, normalizedIdentifier):
+        impl.log.forbidden(tid)
+        return "error: forbidden"
+
+    si = ezidapp.models.identifier.Identifier(
+        identifier=normalizedIdentifier,
+        owner=(None if user == ezidapp.models.user.AnonymousUser else user),
+    )
+    si.updateFromUntrustedLegacy(metadata, allowRestrictedSettings=user.isSuperuser)
+    if si.isDoi:
+        s = ezidapp.models.shoulder.getLongestShoulderMatch(si.identifier)
+        # Should never happen.
+        assert s is not None, "no matching shoulder found"
+        if s.isDatacite:
+            if si.datacenter is None:
+                si.datacenter = s.datacenter
+        elif s.isCrossref:
+            if not si.isCrossref:
+                if si.isReserved:
+                    si.crossrefStatus = ezidapp.models.identifier.Identifier.CR_RESERVED
+                else:
+                    si.crossrefStatus = ezidapp.models.identifier.Identifier.CR_WORKING
+        else:
+            assert False, "unhandled case"
+    si.my_full_clean()
+    if si.owner != user:
+        if not impl.policy.authorizeOwnershipChange(user, user, si.owner):
+            impl.log.badRequest(tid)
+            return "error: bad request - ownership change prohibited"
+    return si
+
+
 def createIdentifier(identifier, user, metadata=None, updateIfExists=False):
     """Create an identifier having the given qualified name, e.g.,
     "doi:10.5060/FOO". 'user' is the requestor and should be an authenticated
@@ -259,39 +606,14 @@ def createIdentifier(identifier, user, metadata=None, updateIfExists=False):
             f'user.group.pid="{user.group.pid}"',
             f'metadata="{",".join(f"{k}={v}" for k, v in metadata.items())}"',
         )
-        if not impl.policy.authorizeCreate(user, normalizedIdentifier):
-            impl.log.forbidden(tid)
-            return "error: forbidden"
-
-        si = ezidapp.models.identifier.Identifier(
-            identifier=normalizedIdentifier,
-            owner=(None if user == ezidapp.models.user.AnonymousUser else user),
-        )
-        si.updateFromUntrustedLegacy(metadata, allowRestrictedSettings=user.isSuperuser)
-        if si.isDoi:
-            s = ezidapp.models.shoulder.getLongestShoulderMatch(si.identifier)
-            # Should never happen.
-            assert s is not None, "no matching shoulder found"
-            if s.isDatacite:
-                if si.datacenter is None:
-                    si.datacenter = s.datacenter
-            elif s.isCrossref:
-                if not si.isCrossref:
-                    if si.isReserved:
-                        si.crossrefStatus = ezidapp.models.identifier.Identifier.CR_RESERVED
-                    else:
-                        si.crossrefStatus = ezidapp.models.identifier.Identifier.CR_WORKING
-            else:
-                assert False, "unhandled case"
-        si.my_full_clean()
-        if si.owner != user:
-            if not impl.policy.authorizeOwnershipChange(user, user, si.owner):
-                impl.log.badRequest(tid)
-                return "error: bad request - ownership change prohibited"
+        si = _newIdentifier(tid, normalizedIdentifier, user, metadata)
+        if type(si) is str:
+            return si
 
         with django.db.transaction.atomic():
             si.save()
             impl.enqueue.enqueue(si, "create", updateExternalServices=True)
+        impl.resolver.resolution_cache.invalidate([si.identifier])
 
     except django.core.exceptions.ValidationError as e:
         impl.log.badRequest(tid)
@@ -426,25 +748,14 @@ def setMetadata(identifier, user, metadata, updateExternalServices=True, interna
         )
 
         si = ezidapp.models.identifier.getIdentifier(nqidentifier)
-        if not impl.policy.authorizeUpdate(user, si):
-            impl.log.forbidden(tid)
-            return "error: forbidden"
-        previousOwner = si.owner
-        si.updateFromUntrustedLegacy(metadata, allowRestrictedSettings=user.isSuperuser)
-        if si.isCrossref and not si.isReserved and updateExternalServices:
-            si.crossrefStatus = ezidapp.models.identifier.Identifier.CR_WORKING
-            si.crossrefMessage = ""
-        if "_updated" not in metadata:
-            si.updateTime = ""
-        si.my_full_clean()
-        if si.owner != previousOwner:
-            if not impl.policy.authorizeOwnershipChange(user, previousOwner, si.owner):
-                impl.log.badRequest(tid)
-                return "error: bad request - ownership change prohibited"
+        r = _updateIdentifier(tid, si, user, metadata, updateExternalServices)
+        if type(r) is str:
+            return r
 
         with django.db.transaction.atomic():
             si.save()
             impl.enqueue.enqueue(si, "update", updateExternalServices)
+        impl.resolver.resolution_cache.invalidate([si.identifier])
 
     except ezidapp.models.identifier.Identifier.DoesNotExist:
         impl.log.badRequest(tid)
@@ -465,6 +776,30 @@ def setMetadata(identifier, user, metadata, updateExternalServices=True, interna
             _releaseIdentifierLock(nqidentifier, user.username)
 
 
+def _updateIdentifier(tid, si, user, metadata, updateExternalServices):
+    """Apply a metadata update for setMetadata() to an Identifier, and validate it
+
+    On authorization failures, the failure is logged and an error string is returned.
+    Raises ValidationError on invalid metadata.
+    """
+    if not impl.policy.authorizeUpdate(user, si):
+        impl.log.forbidden(tid)
+        return "error: forbidden"
+    previousOwner = si.owner
+    si.updateFromUntrustedLegacy(metadata, allowRestrictedSettings=user.isSuperuser)
+    if si.isCrossref and not si.isReserved and updateExternalServices:
+        si.crossrefStatus = ezidapp.models.identifier.Identifier.CR_WORKING
+        si.crossrefMessage = ""
+    if "_updated" not in metadata:
+        si.updateTime = ""
+    si.my_full_clean()
+    if si.owner != previousOwner:
+        if not impl.policy.authorizeOwnershipChange(user, previousOwner, si.owner):
+            impl.log.badRequest(tid)
+            return "error: bad request - ownership change prohibited"
+    return si
+
+
 def deleteIdentifier(identifier, user, updateExternalServices=True):
     """Delete an identifier having the given qualified name, e.g.,
     "doi:10.5060/FOO". 'user' is the requestor and should be an authenticated
@@ -508,6 +843,7 @@ def deleteIdentifier(identifier, user, updateExternalServices=True):
         with django.db.transaction.atomic():
             impl.enqueue.enqueue(si, "delete", updateExternalServices)
             si.delete()
+        impl.resolver.resolution_cache.invalidate([nqidentifier])
 
     except ezidapp.models.identifier.Identifier.DoesNotExist:
         impl.log.badRequest(tid)
@@ -0,0 +1,325 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Identifier locks
+
+Ensures that no given identifier is operated on by two operations simultaneously.
+Additionally, we enforce a per-user throttle on concurrent operations: a user may have
+at most MAX_CONCURRENT_OPERATIONS_PER_USER operations active, and at most
+MAX_THREADS_PER_USER operations active or waiting. When paused, no new locks are
+granted, but the mechanism otherwise operates normally.
+
+Two lock managers are available, selected by the IDENTIFIER_LOCK_BACKEND setting:
+
+'local': Locks are held in memory, and are only enforced between the threads of a
+single process. When EZID is served by several processes or hosts, each process
+enforces the throttle separately, and status and pausing only reflect the process that
+handles the request.
+
+'database': Locks are held in the IdentifierLock table, and are enforced across all
+processes and hosts that share the database. Lock decisions are serialized by locking
+the single IdentifierLockState row while checking the pause and the throttle. Waiting
+operations poll every IDENTIFIER_LOCK_POLL_INTERVAL seconds. Locks are leased for
+IDENTIFIER_LOCK_LEASE seconds, and the leases of the locks held by a worker are renewed
+in the background, so that locks held by a worker that dies are eventually released.
+Locks must not be acquired inside a transaction, as they would not become visible to
+other workers until the transaction commits.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+import django.conf
+import django.db.models
+import django.db.transaction
+
+import ezidapp.models.identifier_lock
+
+log = logging.getLogger(__name__)
+
+_lockManager = None
+
+
+def getLockManager():
+    """Return the lock manager selected by the IDENTIFIER_LOCK_BACKEND setting"""
+    global _lockManager
+    if _lockManager is None:
+        backend = django.conf.settings.IDENTIFIER_LOCK_BACKEND
+        if backend == 'local':
+            _lockManager = LocalLockManager()
+        elif backend == 'database':
+            _lockManager = DatabaseLockManager()
+        else:
+            raise Exception(f'Invalid IDENTIFIER_LOCK_BACKEND: {backend}')
+    return _lockManager
+
+
+def _incrementCount(d, k):
+    d[k] = d.get(k, 0) + 1
+
+
+def _decrementCount(d, k):
+    if d[k] == 1:
+        del d[k]
+    else:
+        d[k] -= 1
+
+
+class LocalLockManager:
+    """Identifier locks held in the memory of the current process
+
+    _activeUsers maps local usernames to the number of operations currently being
+    performed by that user. For status reporting purposes, _waitingUsers similarly maps
+    local usernames to numbers of waiting requests.
+    """
+
+    def __init__(self):
+        self._lockedIdentifiers = set()
+        self._activeUsers = {}
+        self._waitingUsers = {}
+        self._lock = threading.Condition()
+        self._paused = False
+
+    def acquire(self, identifierSet, user):
+        """Lock a set of identifiers as a single operation
+
+        The identifiers are locked together, when none of them are locked by other
+        operations, and count as one operation against the user's throttle. Returns
+        False if the user has too many operations active or waiting.
+        """
+        with self._lock:
+            # noinspection PyTypeChecker
+            while (
+                self._paused
+                or not self._lockedIdentifiers.isdisjoint(identifierSet)
+                or self._activeUsers.get(user, 0)
+                >= django.conf.settings.MAX_CONCURRENT_OPERATIONS_PER_USER
+            ):
+                # noinspection PyTypeChecker
+                if self._activeUsers.get(user, 0) + self._waitingUsers.get(user, 0) >= int(
+                    django.conf.settings.MAX_THREADS_PER_USER
+                ):
+                    return False
+                _incrementCount(self._waitingUsers, user)
+                self._lock.wait()
+                _decrementCount(self._waitingUsers, user)
+            _incrementCount(self._activeUsers, user)
+            self._lockedIdentifiers.update(identifierSet)
+            return True
+
+    def release(self, identifierSet, user):
+        with self._lock:
+            self._lockedIdentifiers.difference_update(identifierSet)
+            _decrementCount(self._activeUsers, user)
+            self._lock.notify_all()
+
+    def getStatus(self):
+        with self._lock:
+            return self._activeUsers.copy(), self._waitingUsers.copy(), self._paused
+
+    def pause(self, newValue):
+        with self._lock:
+            oldValue = self._paused
+            self._paused = newValue
+            if not self._paused:
+                self._lock.notify_all()
+            return oldValue
+
+
+class DatabaseLockManager:
+    """Identifier locks held in the database, shared by all workers
+
+    _operations maps (user, identifier set) to the IDs of the operations of this worker
+    that hold the locks, most recent last. The leases of their locks are renewed by a
+    background thread.
+    """
+
+    def __init__(self):
+        self._worker = f'{socket.gethostname()}:{os.getpid()}'
+        self._hasLockState = False
+        self._operations = {}
+        self._lock = threading.Lock()
+        self._renewalThread = None
+        self._purgeTime = 0
+
+    def acquire(self, identifierSet, user):
+        """Lock a set of identifiers as a single operation
+
+        Same semantics as LocalLockManager.acquire(), but the identifier locks and the
+        throttle are shared by all workers.
+
+        The IdentifierLockState row is locked only while checking the pause and the
+        throttle, and inserting the locks. Whether the identifiers are locked by other
+        operations is checked again after the locks have been inserted, and on a
+        conflict, the locks are removed and the operation waits. Two operations that
+        insert conflicting locks at the same time may both wait, but never both proceed.
+        """
+        model = ezidapp.models.identifier_lock.IdentifierLock
+        identifierSet = frozenset(identifierSet)
+        operationId = uuid.uuid4().hex
+        waitingRow = None
+        try:
+            while True:
+                now = int(time.time())
+                self._purgeExpired(now)
+                isLocked = self._isLocked(identifierSet, operationId)
+                with django.db.transaction.atomic():
+                    isPaused = self._lockState(forUpdate=True).isPaused
+                    activeCount = (
+                        model.objects.filter(
+                            username=user, isWaiting=False, leaseExpires__gte=now
+                        )
+                        .values('operationId')
+                        .distinct()
+                        .count()
+                    )
+                    isGranted = (
+                        not isPaused
+                        and not isLocked
+                        and activeCount < django.conf.settings.MAX_CONCURRENT_OPERATIONS_PER_USER
+                    )
+                    if isGranted:
+                        # An operation on no identifiers holds a single lock on the
+                        # empty identifier, so that it counts against the throttle.
+                        model.objects.bulk_create(
+                            [
+                                self._newRow(identifier, user, operationId, False, now)
+                                for identifier in identifierSet or {''}
+                            ]
+                        )
+                    elif waitingRow is None:
+                        waitingCount = model.objects.filter(
+                            username=user, isWaiting=True, leaseExpires__gte=now
+                        ).count()
+                        if activeCount + waitingCount >= int(
+                            django.conf.settings.MAX_THREADS_PER_USER
+                        ):
+                            return False
+                        waitingRow = self._newRow('', user, operationId, True, now)
+                        waitingRow.save()
+                    else:
+                        model.objects.filter(pk=waitingRow.pk).update(
+                            leaseExpires=now + django.conf.settings.IDENTIFIER_LOCK_LEASE
+                        )
+                if not isGranted:
+                    time.sleep(django.conf.settings.IDENTIFIER_LOCK_POLL_INTERVAL)
+                elif not self._isLocked(identifierSet, operationId):
+                    self._addOperation((user, identifierSet), operationId)
+                    return True
+                else:
+                    model.objects.filter(operationId=operationId, isWaiting=False).delete()
+                    # Operations that backed off from the same conflict retry at
+                    # different times.
+                    time.sleep(
+                        random.uniform(0, django.conf.settings.IDENTIFIER_LOCK_POLL_INTERVAL)
+                    )
+        finally:
+            if waitingRow is not None:
+                model.objects.filter(pk=waitingRow.pk).delete()
+
+    def release(self, identifierSet, user):
+        with self._lock:
+            operationIdList = self._operations.get((user, frozenset(identifierSet)))
+            if not operationIdList:
+                return
+            operationId = operationIdList.pop()
+            if not operationIdList:
+                del self._operations[(user, frozenset(identifierSet))]
+        ezidapp.models.identifier_lock.IdentifierLock.objects.filter(
+            operationId=operationId
+        ).delete()
+
+    def getStatus(self):
+        qs = ezidapp.models.identifier_lock.IdentifierLock.objects.filter(
+            leaseExpires__gte=int(time.time())
+        )
+        activeUsers = dict(
+            qs.filter(isWaiting=False)
+            .values_list('username')
+            .annotate(n=django.db.models.Count('operationId', distinct=True))
+        )
+        waitingUsers = dict(
+            qs.filter(isWaiting=True)
+            .values_list('username')
+            .annotate(n=django.db.models.Count('id'))
+        )
+        return activeUsers, waitingUsers, self._lockState().isPaused
+
+    def pause(self, newValue):
+        with django.db.transaction.atomic():
+            lockState = self._lockState(forUpdate=True)
+            oldValue = lockState.isPaused
+            lockState.isPaused = newValue
+            lockState.save()
+            return oldValue
+
+    def _purgeExpired(self, now):
+        """Delete the rows with expired leases, at most once per IDENTIFIER_LOCK_LEASE
+        seconds in this worker. Until they are deleted, expired rows are ignored."""
+        if now < self._purgeTime:
+            return
+        self._purgeTime = now + django.conf.settings.IDENTIFIER_LOCK_LEASE
+        ezidapp.models.identifier_lock.IdentifierLock.objects.filter(
+            leaseExpires__lt=now
+        ).delete()
+
+    def _isLocked(self, identifierSet, operationId):
+        """Return True if any of the identifiers are locked by another operation"""
+        return (
+            ezidapp.models.identifier_lock.IdentifierLock.objects.filter(
+                identifier__in=identifierSet,
+                isWaiting=False,
+                leaseExpires__gte=int(time.time()),
+            )
+            .exclude(operationId=operationId)
+            .exists()
+        )
+
+    def _addOperation(self, key, operationId):
+        with self._lock:
+            self._operations.setdefault(key, []).append(operationId)
+            if self._renewalThread is None:
+                self._renewalThread = threading.Thread(
+                    target=self._renewalLoop, name='identifier-lock-renewal', daemon=True
+                )
+                self._renewalThread.start()
+
+    def _renewalLoop(self):
+        while True:
+            time.sleep(django.conf.settings.IDENTIFIER_LOCK_LEASE / 3)
+            try:
+                self._renewLeases()
+            except Exception as e:
+                log.warning(f'Unable to renew identifier lock leases: {e}')
+
+    def _renewLeases(self):
+        """Renew the leases of the locks held by this worker"""
+        with self._lock:
+            operationIdList = [o for v in self._operations.values() for o in v]
+        if operationIdList:
+            ezidapp.models.identifier_lock.IdentifierLock.objects.filter(
+                operationId__in=operationIdList, isWaiting=False
+            ).update(leaseExpires=int(time.time()) + django.conf.settings.IDENTIFIER_LOCK_LEASE)
+
+    def _newRow(self, identifier, user, operationId, isWaiting, now):
+        return ezidapp.models.identifier_lock.IdentifierLock(
+            identifier=identifier,
+            username=user,
+            operationId=operationId,
+            worker=self._worker,
+            isWaiting=isWaiting,
+            leaseExpires=now + django.conf.settings.IDENTIFIER_LOCK_LEASE,
+        )
+
+    def _lockState(self, forUpdate=False):
+        model = ezidapp.models.identifier_lock.IdentifierLockState
+        if not self._hasLockState:
+            model.objects.get_or_create(pk=1)
+            self._hasLockState = True
+        qs = model.objects.select_for_update() if forUpdate else model.objects
+        return qs.get(pk=1)
@@ -45,10 +45,14 @@ BerkeleyDB keys (EZID names / N2T names):
   to max_combined_count / max_per_counter.
 """
 
+import bisect
+import collections
 import logging
 import re
+import threading
 import time
 
+import django.conf
 from django.db import transaction
 from django.db.utils import DatabaseError
 import ezidapp.models.minter
@@ -72,6 +76,18 @@ DIGIT_COUNT = 10
 
 log = logging.getLogger(__name__)
 
+# Block reservation. When MINTER_RESERVATION_SIZE is larger than 1, mint_id() advances
+# the minter state by that many steps in a single locked transaction and keeps the
+# spings that were not handed out yet in a per-process pool. The pool is keyed by
+# minter prefix, and holds a list of blocks of spings, ordered by the position of the
+# first sping of the block in the minter sequence. Spings are handed out in the order
+# in which they were minted, even if the transactions that reserved the blocks commit
+# out of order.
+# Spings still in the pool when the process exits are lost. They are never reissued,
+# so the only effect is a gap in the sequence.
+_reservation_lock = threading.Lock()
+_reservation_dict = {}
+
 
 def mint_id(shoulder_model, dry_run=False):
     """Mint a single identifier on an existing ARK or DOI shoulder / namespace
@@ -93,9 +109,17 @@ def mint_id(shoulder_model, dry_run=False):
         The ID is agnostic to the type of the identifier (ARK, DOI). The caller
         completes the ID by appending the returned strings to the minter scheme.
 
+    If MINTER_RESERVATION_SIZE is larger than 1, the ID is taken from the per-process
+    pool of reserved spings for the shoulder, and the pool is refilled from the
+    database when it is empty. Dry-runs bypass the pool, since they do not update the
+    minter state.
+
     See Also:
         :func:`mint_ids`
     """
+    reservation_size = int(django.conf.settings.MINTER_RESERVATION_SIZE)
+    if reservation_size > 1 and not dry_run:
+        return _mint_reserved(shoulder_model.prefix.strip(), reservation_size)
     minted_id = None
     for id_str in mint_ids(shoulder_model, 1, dry_run):
         minted_id = id_str
@@ -151,6 +175,100 @@ def mint_by_prefix(prefix, mint_count=1, dry_run=False):
         log.error(f'Minter Error: {ex}')
 
 
+def _mint_reserved(prefix, reservation_size):
+    """Return the next reserved sping for the minter with the given prefix.
+
+    If there are no reserved spings left, the minter state is advanced by
+    'reservation_size' steps in a single transaction, the first of the new spings is
+    returned and the remaining spings are added to the pool. The pool is only extended
+    after the transaction that minted the spings has been committed, so that spings
+    from a transaction that is rolled back are never handed out. Since concurrent
+    transactions may commit in a different order than they minted in, the remaining
+    spings are added as a block, which is placed in the pool by its position in the
+    minter sequence.
+
+    Returns None if the minter failed. The error has already been logged by
+    _mint_block() in that case.
+    """
+    with _reservation_lock:
+        block_list = _reservation_dict.get(prefix)
+        if block_list:
+            sping_deque = block_list[0][1]
+            sping_str = sping_deque.popleft()
+            if not sping_deque:
+                del block_list[0]
+            return sping_str
+        begin_pos, sping_list = _mint_block(prefix, reservation_size)
+        if sping_list is None:
+            return None
+    log.debug(f'Reserved {reservation_size} spings on minter: {prefix}')
+    transaction.on_commit(lambda: _add_reserved(prefix, begin_pos + 1, sping_list[1:]))
+    return sping_list[0]
+
+
+def _mint_block(prefix, block_size):
+    """Mint a block of spings in a single locked transaction.
+
+    Returns a tuple of the position of the first sping in the minter sequence, which
+    is the number of spings minted before it, and the list of spings. The list is None
+    if the minter failed, in which case the minter state was not saved.
+    """
+    try:
+        with transaction.atomic():
+            with EzidMinter(prefix, is_new=False) as minter:
+                begin_pos = minter.base_count + minter.combined_count
+                return begin_pos, list(minter.mint(block_size))
+    except DatabaseError as db_ex:
+        log.error(f'Minter Database Error: {db_ex}')
+    except Exception as ex:
+        log.error(f'Minter Error: {ex}')
+    return None, None
+
+
+def _add_reserved(prefix, begin_pos, sping_list):
+    if not sping_list:
+        return
+    with _reservation_lock:
+        bisect.insort(
+            _reservation_dict.setdefault(prefix, []),
+            (begin_pos, collections.deque(sping_list)),
+            key=lambda block: block[0],
+        )
+
+
+def discard_reservations(prefix=None):
+    """Discard reserved spings held by this process
+
+    This is required after the minter state has been replaced or rolled back outside
+    of the minter, e.g., when restoring a minter from a backup. The discarded spings
+    are not reissued.
+
+    Args:
+        prefix (str, optional): Discard only the spings reserved for this minter. By
+            default, spings for all minters are discarded.
+
+    Returns (int): The number of discarded spings.
+    """
+    with _reservation_lock:
+        if prefix is None:
+            block_list = [b for v in _reservation_dict.values() for b in v]
+            _reservation_dict.clear()
+        else:
+            block_list = _reservation_dict.pop(prefix, [])
+    return sum(len(sping_deque) for _, sping_deque in block_list)
+
+
+def get_reservation_status():
+    """Return a dict that maps minter prefixes to the number of spings currently
+    reserved by this process."""
+    with _reservation_lock:
+        return {
+            k: sum(len(sping_deque) for _, sping_deque in v)
+            for k, v in _reservation_dict.items()
+            if v
+        }
+
+
 def create_minter_database(shoulder_ns, mask_str='eedk'):
     """Create a new minter in the database
 
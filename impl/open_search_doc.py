@@ -9,8 +9,7 @@ from ezidapp.models.identifier import SearchIdentifier
 import json
 import base64
 import datetime
-import ezidapp.models.validation as validation
-import impl.util
+import impl.search_doc
 from urllib.parse import quote
 import re
 import functools
@@ -19,12 +18,18 @@ from opensearchpy.exceptions import NotFoundError
 from django.conf import settings
 import urllib
 import time
+import logging
+
+log = logging.getLogger(__name__)
 
 # the functools allows memoizing the results of functions, so they're not recalculated every time (ie cached
 # results if called more than once on the same instance)
 
-MAX_SEARCHABLE_TARGET_LENGTH = 255
-INDEXED_PREFIX_LENGTH = 50
+MAX_SEARCHABLE_TARGET_LENGTH = impl.search_doc.MAX_SEARCHABLE_TARGET_LENGTH
+INDEXED_PREFIX_LENGTH = impl.search_doc.INDEXED_PREFIX_LENGTH
+
+# default for the search_identifier argument of OpenSearchDoc, meaning it is read from the database
+_READ_SEARCH_IDENTIFIER = object()
 
 # testing
 # python manage.py shell
@@ -56,10 +61,28 @@ class OpenSearchDoc:
         retry_on_timeout=True
     )
 
-    def __init__(self, identifier: Identifier):
+    # While the index is being rebuilt (see the --rebuild option of the opensearch-update command), this alias points
+    # at the new index, and all writes are made to both the live index and the new index, so that changes made during
+    # the rebuild are not lost.
+    REBUILD_ALIAS = f'{settings.OPENSEARCH_INDEX}-rebuild'
+    _rebuild_indexes = ([], 0.0)  # (indexes, time to check again)
+    # In the new index, a deleted document, or one that is partially updated before it has been loaded, is replaced by
+    # a tombstone. The load does not overwrite tombstones, as it does not overwrite other documents written during the
+    # rebuild, and the rebuild replaces them with the current state of the database (see opensearch-update).
+    REBUILD_TOMBSTONE = {'rebuild_tombstone': True}
+
+    # search_identifier may be passed in by callers that have already read it (or None if it does not exist),
+    # which saves a query per document when indexing in bulk.
+    # builder may be passed in by callers that also compute the SearchIdentifier columns from it
+    # (see impl.search_doc), so that the metadata is only mapped once.
+    def __init__(self, identifier: Identifier, search_identifier=_READ_SEARCH_IDENTIFIER, builder=None):
         self.identifier = identifier
-        self.km = identifier.kernelMetadata
+        self.builder = builder if builder is not None else impl.search_doc.SearchDocBuilder(identifier)
+        self.km = self.builder.km
 
+        if search_identifier is not _READ_SEARCH_IDENTIFIER:
+            self.search_identifier = search_identifier
+            return
         try:
             self.search_identifier=SearchIdentifier.objects.get(identifier=identifier.identifier)
         except SearchIdentifier.DoesNotExist:
@@ -129,7 +152,37 @@ class OpenSearchDoc:
 
         return identifier_dict
 
+    # returns the indexes being rebuilt, checking for the rebuild alias at most every OPENSEARCH_REBUILD_CHECK_INTERVAL
+    # seconds
+    @classmethod
+    def rebuild_indexes(cls):
+        indexes, check_time = cls._rebuild_indexes
+        if time.time() < check_time:
+            return indexes
+        try:
+            indexes = list(cls.CLIENT.indices.get_alias(name=cls.REBUILD_ALIAS))
+        except NotFoundError:
+            indexes = []
+        except Exception as e:
+            log.error(f'Error checking for index rebuild: {e}')
+        cls._rebuild_indexes = (indexes, time.time() + settings.OPENSEARCH_REBUILD_CHECK_INTERVAL)
+        return indexes
+
+    # makes a write to each index being rebuilt. The result only matters for the live index, so errors are logged, and
+    # documents that have not been loaded into the new index yet are replaced by a tombstone.
+    @classmethod
+    def _write_rebuild_indexes(cls, method, **kwargs):
+        for index in cls.rebuild_indexes():
+            try:
+                try:
+                    method(index=index, **kwargs)
+                except NotFoundError:
+                    cls.CLIENT.index(index=index, id=kwargs['id'], body=cls.REBUILD_TOMBSTONE)
+            except Exception as e:
+                log.error(f'Error writing to rebuilt index {index}: {e}')
+
     def remove_from_index(self):
+        self._write_rebuild_indexes(self.CLIENT.index, id=self.identifier.identifier, body=self.REBUILD_TOMBSTONE)
         try:
             response = self.CLIENT.delete(
                 index=settings.OPENSEARCH_INDEX,
@@ -150,6 +203,7 @@ class OpenSearchDoc:
             'link_is_broken': link_is_broken,
             'has_issues': has_issues }
 
+        self._write_rebuild_indexes(self.CLIENT.update, id=self.identifier.identifier, body={"doc": dict_to_update})
         response = self.CLIENT.update(
             index=settings.OPENSEARCH_INDEX,
             id=self.identifier.identifier,
@@ -162,22 +216,20 @@ class OpenSearchDoc:
         else:
             return False
 
-    # the properties using lru_cache are memoized, so they're only calculated once and then cached for future calls
-    # for the same object instance (this should make calls faster if used multiple times on the same instance)
+    # the properties using cached_property are memoized, so they're only calculated once and then cached for future
+    # calls for the same object instance. The cached values are stored on the instance, so they are released with it.
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def db_identifier_id(self):
         return self.identifier.pk
 
-    # these are builder functions for the parts of the search
+    # these are builder functions for the parts of the search. Values derived from the metadata come from the
+    # SearchDocBuilder, which is shared with SearchIdentifier.computeComputedValues()
     @property
-    @functools.lru_cache
     def searchable_target(self):
-        return self.identifier.target[::-1][:MAX_SEARCHABLE_TARGET_LENGTH]
+        return self.builder.searchable_target
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def resource(self):
         return {"creators": self.resource_creators,
                 "title": self.resource_title,
@@ -188,156 +240,89 @@ class OpenSearchDoc:
                 "searchable_type": self.searchable_resource_type}
 
     @property
-    @functools.lru_cache
     def resource_creator(self):
-        return self.km.creator if self.km.creator is not None else ''
+        return self.builder.resource_creator
 
     @property
-    @functools.lru_cache
     def resource_creators(self):
-        if self.km.creator is None:
-            return []
-        creators = self.km.creator.split(';')
-        return [c.strip() for c in creators]
+        return self.builder.resource_creators
 
     @property
-    @functools.lru_cache
     def resource_title(self):
-        return self.km.title if self.km.title is not None else ''
+        return self.builder.resource_title
 
     @property
-    @functools.lru_cache
     def resource_publisher(self):
-        return self.km.publisher if self.km.publisher is not None else ''
+        return self.builder.resource_publisher
 
     @property
-    @functools.lru_cache
     def resource_publication_date(self):
-        return self.km.date if self.km.date is not None else ''
+        return self.builder.resource_publication_date
 
     @property
-    @functools.lru_cache
     def searchable_publication_year(self):
-        d = self.km.validatedDate
-        return int(d[:4]) if d is not None else None
+        return self.builder.searchable_publication_year
 
     # this one is indexed as "keyword" so I can do a "prefix" search against it since otherwise it doesn't work
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def searchable_id(self):
         return self.identifier.identifier
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def link_is_broken(self):
         if self.search_identifier is not None:
             return self.search_identifier.linkIsBroken
         return False
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def has_issues(self):
         if self.search_identifier is not None:
             return self.search_identifier.hasIssues
         return False
 
     @property
-    @functools.lru_cache
     def resource_type(self):
-        return self.km.type if self.km.type is not None else ''
+        return self.builder.resource_type
 
     @property
-    @functools.lru_cache
     def searchable_resource_type(self):
-        t = self.km.validatedType
-        return validation.resourceTypes[t.split("/")[0]] if t is not None else ''
-
-    # The resource types have changed over time and different Datacite versions.
-    # It also seems like the expectation is that we have the most inclusive match
-    # on the resource type terms in search if anything related has been entered anywhere in resource type.
-    # This gloms all the words in that are present in the "validatedType" for full text searching.
-    # First it splits out words on whitespace, underscore, dash, and slash.
-    # Then it adds additional words for anything CamelCased to get the most inclusive words possible.
+        return self.builder.searchable_resource_type
+
+    # The resource types have changed over time and different Datacite versions, so this is a bucket of all the
+    # words in the resource type, for the most inclusive matching (see SearchDocBuilder.resource_type_words).
     @property
-    @functools.lru_cache
     def resource_type_words(self):
-        t = self.km.validatedType
-        if t is None or t == "":
-            return None
-
-        # split on whitespace, underscore, dash, and slash
-        obvious_words = re.split(r'[\s_\-/]+', t)
-
-        more_words = []
-        for word in obvious_words:
-            # Insert a space before each uppercase letter
-            spaced_text = re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', word)
-            # Split the string on spaces
-            extra_words = spaced_text.split()
-            if len(extra_words) > 1:
-                more_words.extend(extra_words)
-
-        return ' '.join(obvious_words + more_words)  # a bucket of words for search
+        return self.builder.resource_type_words
 
     @property
-    @functools.lru_cache
     def word_bucket(self):
-        kw = [self.identifier.identifier,
-              self.identifier.owner.username if self.identifier.owner else None,
-              self.identifier.ownergroup.groupname if self.identifier.ownergroup else None]
-        if self.identifier.isDatacite:
-            kw.append(self.identifier.datacenter.symbol)
-        if self.identifier.target != self.identifier.defaultTarget:
-            kw.append(self.identifier.target)
-        for k, v in list(self.identifier.metadata.items()):
-            if k in ["datacite", "crossref"]:
-                try:
-                    kw.append(impl.util.extractXmlContent(v))
-                except Exception:
-                    kw.append(v)
-            else:
-                kw.append(v)
-        kw = [x for x in kw if x is not None]
-        return " ; ".join(kw)
+        return self.builder.keywords
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def resource_creator_prefix(self):
         return self.resource_creator[: INDEXED_PREFIX_LENGTH]
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def resource_title_prefix(self):
         return self.resource_title[: INDEXED_PREFIX_LENGTH]
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def resource_publisher_prefix(self):
         return self.resource_publisher[: INDEXED_PREFIX_LENGTH]
 
     @property
-    @functools.lru_cache
     def has_metadata(self):
-        return (
-            self.resource_title != ""
-            and self.resource_publication_date != ""
-            and (self.resource_creator != "" or self.resource_publisher != "")
-        )
+        return self.builder.has_metadata
 
     @property
-    @functools.lru_cache
     def public_search_visible(self):
-        return self.identifier.isPublic and self.identifier.exported and not self.identifier.isTest
+        return self.builder.public_search_visible
 
     @property
-    @functools.lru_cache
     def oai_visible(self):
-        return (
-            self.public_search_visible and self.has_metadata and self.identifier.target != self.identifier.defaultTarget
-        )
+        return self.builder.oai_visible
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def owner(self):
         o = self.identifier.owner
         if o is None:
@@ -346,24 +331,21 @@ class OpenSearchDoc:
 
     # adds a subset of the ownergroup, the id, name, and organization.  I'm cautious about adding too much data
     # to the search in case it's not needed for search
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def ownergroup(self):
         og = self.identifier.ownergroup
         if og is None:
             return {}
         return {"id": og.id, "name": og.groupname, "organization": og.organizationName}
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def profile(self):
         p = self.identifier.profile
         if p is None:
             return {}
         return {"id": p.id, "label": p.label}
 
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def datacenter(self):
         dc = self.identifier.datacenter
         if dc is None:
@@ -371,8 +353,7 @@ class OpenSearchDoc:
         return {"id": dc.id, "symbol": dc.symbol, "name": dc.name}
 
     # identifier_type is ark or doi and the db search did some kind of slow like query for it, but should be explicit
-    @property
-    @functools.lru_cache
+    @functools.cached_property
     def identifier_type(self):
         if self.identifier.identifier and self.identifier.identifier.startswith("doi:"):
             return "doi"
@@ -387,6 +368,7 @@ class OpenSearchDoc:
         os_doc['open_search_updated'] = datetime.datetime.now().isoformat()
 
         # Use the index method of the OpenSearch client to index the document
+        self._write_rebuild_indexes(self.CLIENT.index, id=self.identifier.identifier, body=os_doc)
         response = self.CLIENT.index(
             index=settings.OPENSEARCH_INDEX,
             id=self.identifier.identifier,
@@ -398,3 +380,65 @@ class OpenSearchDoc:
             return True
         else:
             return False
+
+    # Indexes and removes many documents with a single _bulk request. Returns a dict mapping the identifier of each
+    # document to None if its operation succeeded, or to an error message. Removing a document that is not in the
+    # index counts as success.
+    # index defaults to the live index, and writes to the live index are also made to any index being rebuilt, where
+    # removed documents are replaced by a tombstone.
+    # With op_type 'create', existing documents are left alone, which counts as success; this is used when loading a
+    # new index, so that the documents written to it by the indexer are not overwritten by older data.
+    # A document that cannot be built is not sent, and its error is returned.
+    @classmethod
+    def bulk_index(cls, index_docs=(), remove_identifiers=(), index=None, op_type='index'):
+        index_list = [index] if index is not None else [settings.OPENSEARCH_INDEX] + cls.rebuild_indexes()
+        body = []
+        identifiers = []
+        results = {}
+        for open_s in index_docs:
+            try:
+                os_doc = open_s.dict_for_identifier()
+            except Exception as e:
+                results[open_s.identifier.identifier] = f'Error building OpenSearch document: {e}'
+                continue
+            os_doc['open_search_updated'] = datetime.datetime.now().isoformat()
+            for i in index_list:
+                body.append({op_type: {'_index': i, '_id': open_s.identifier.identifier}})
+                body.append(os_doc)
+            identifiers.append(open_s.identifier.identifier)
+        for identifier in remove_identifiers:
+            body.append({'delete': {'_index': index_list[0], '_id': identifier}})
+            for i in index_list[1:]:
+                body.append({'index': {'_index': i, '_id': identifier}})
+                body.append(cls.REBUILD_TOMBSTONE)
+            identifiers.append(identifier)
+        if not body:
+            return results
+
+        response = cls.CLIENT.bulk(body=body)
+
+        # the items in the response are in the same order as the operations in the request, so each identifier has
+        # one item per index, the first for the live index
+        n = len(index_list)
+        for identifier, item in zip(identifiers, response['items'][::n]):
+            (op, item_result), = item.items()
+            if op == 'create' and item_result.get('status') == 409:
+                results[identifier] = None
+            elif 'error' in item_result:
+                error = item_result['error']
+                if isinstance(error, dict):
+                    error = f"{error.get('type')}: {error.get('reason')}"
+                results[identifier] = f'Error {op} in OpenSearch: {error}'
+            elif op in ['index', 'create'] and item_result.get('result') not in ['created', 'updated']:
+                results[identifier] = f"Error index in OpenSearch: unexpected result {item_result.get('result')}"
+            else:
+                results[identifier] = None
+        for identifier in identifiers[len(response['items'][::n]):]:
+            results[identifier] = 'Error in OpenSearch: missing from _bulk response'
+        rebuild_errors = [
+            item for k, item in enumerate(response['items'])
+            if k % n and 'error' in list(item.values())[0] and list(item.values())[0].get('status') != 404
+        ]
+        if rebuild_errors:
+            log.error(f'{len(rebuild_errors)} errors writing to rebuilt index {index_list[1:]}: {rebuild_errors[:3]}')
+        return results
@@ -1,3 +1,5 @@
+import datetime
+
 from django.conf import settings
 from impl.open_search_doc import OpenSearchDoc
 
@@ -188,6 +190,9 @@ OPEN_SEARCH_SCHEMA = {
             "public_search_visible": {
                 "type": "boolean"
             },
+            "rebuild_tombstone": {
+                "type": "boolean"
+            },
             "resource": {
                 "properties": {
                     "creators": {
@@ -304,17 +309,73 @@ OPEN_SEARCH_SCHEMA = {
 
 client = OpenSearchDoc.CLIENT
 
+NUMBER_OF_SHARDS = 3
+
+# settings for serving searches
+INDEX_SETTINGS = {
+    "number_of_replicas": 1,
+    "refresh_interval": "1s",
+}
 
-def create_index():
+# settings while bulk loading a new index: no refreshes and no replicas, which makes loading much faster. The
+# INDEX_SETTINGS are restored once loading is done.
+BULK_LOAD_SETTINGS = {
+    "number_of_replicas": 0,
+    "refresh_interval": "-1",
+}
+
+
+def create_index(index=None, bulk_load=False):
     body = {
         "settings": {
-            "number_of_shards": 3,
-            "number_of_replicas": 1
+            "number_of_shards": NUMBER_OF_SHARDS,
+            **(BULK_LOAD_SETTINGS if bulk_load else INDEX_SETTINGS),
         },
         "mappings": OPEN_SEARCH_SCHEMA["mappings"]
     }
-    client.indices.create(index=settings.OPENSEARCH_INDEX, body=body)
+    client.indices.create(index=index or settings.OPENSEARCH_INDEX, body=body)
 
 
 def index_exists():
-    return OpenSearchDoc.index_exists()
\ No newline at end of file
+    return OpenSearchDoc.index_exists()
+
+
+# Rebuilding the index without downtime. Searches and writes use OPENSEARCH_INDEX, which becomes an alias for a
+# versioned index, e.g., ezid-index-20240101120000. A rebuild loads a new versioned index, and then points the alias at
+# it in a single atomic action. While loading, the REBUILD_ALIAS points at the new index (see OpenSearchDoc).
+
+def new_index_name():
+    return f'{settings.OPENSEARCH_INDEX}-{datetime.datetime.utcnow():%Y%m%d%H%M%S}'
+
+
+def start_rebuild(index):
+    """Create a new index for bulk loading, and have writers write to it as well as to the live index"""
+    create_index(index=index, bulk_load=True)
+    client.indices.put_alias(index=index, name=OpenSearchDoc.REBUILD_ALIAS)
+
+
+def finish_rebuild(index):
+    """Restore the search settings of a bulk loaded index, and make it the live index
+
+    Returns the names of the indexes that were live before. They are left in place, except if OPENSEARCH_INDEX was
+    an index rather than an alias, in which case it must be deleted to make room for the alias.
+    """
+    client.indices.put_settings(index=index, body={"index": INDEX_SETTINGS})
+    client.indices.forcemerge(index=index, max_num_segments=1, request_timeout=60 * 60)
+    client.indices.refresh(index=index)
+
+    alias = settings.OPENSEARCH_INDEX
+    actions = [
+        {"add": {"index": index, "alias": alias}},
+        {"remove": {"index": index, "alias": OpenSearchDoc.REBUILD_ALIAS}},
+    ]
+    if client.indices.exists_alias(name=alias):
+        old_indexes = [i for i in client.indices.get_alias(name=alias) if i != index]
+        actions += [{"remove": {"index": i, "alias": alias}} for i in old_indexes]
+    elif client.indices.exists(index=alias):
+        old_indexes = [alias]
+        actions += [{"remove_index": {"index": alias}}]
+    else:
+        old_indexes = []
+    client.indices.update_aliases(body={"actions": actions})
+    return old_indexes
@@ -1,6 +1,11 @@
+import collections
+import json
+import logging
+import threading
+import time
 import urllib
 
-from opensearchpy import OpenSearch
+from opensearchpy import NotFoundError, OpenSearch
 from opensearch_dsl import Search, Q
 from django.conf import settings
 import impl.util
@@ -13,6 +18,8 @@ settings.OPENSEARCH_BASE
 
 client = OpenSearchDoc.CLIENT
 
+log = logging.getLogger(__name__)
+
 defaultSelectRelated = ["owner", "ownergroup"]
 defaultDefer = [
     "cm",
@@ -26,6 +33,10 @@ defaultDefer = [
 
 _fulltextFields = ["resourceCreator", "resourceTitle", "resourcePublisher", "keywords"]
 
+# Max value of from + size in a search, as set by the index.max_result_window index
+# setting. Results past this are only reachable with search_after.
+MAX_RESULT_WINDOW = 10_000
+
 # This utility is a conversion of the older search_util.py to use OpenSearch instead of the database.
 
 # I needed to create a few helper functions and inline them here for some functions which existed in other
@@ -71,6 +82,170 @@ def executeSearch(
 
     return response
 
+class TotalCache:
+    """Cache of the total number of results of searches
+
+    Paging through the results of a search runs the same query for each page, so
+    the total is counted for the first page only, and reused for the following
+    pages. Entries are keyed by the normalized constraints, which include the owner
+    scope of the search, and are dropped after SEARCH_TOTAL_CACHE_TTL seconds, which
+    bounds how stale a displayed total can be. At most SEARCH_TOTAL_CACHE_MAX_SIZE
+    entries are held, evicting the least recently used.
+    """
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(constraints):
+        return settings.OPENSEARCH_INDEX + ' ' + json.dumps(constraints, sort_keys=True, default=str)
+
+    def get(self, constraints):
+        """Return the cached total for the constraints, or None"""
+        if settings.SEARCH_TOTAL_CACHE_TTL <= 0:
+            return None
+        key = self.key(constraints)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def add(self, constraints, total):
+        if settings.SEARCH_TOTAL_CACHE_TTL <= 0:
+            return
+        key = self.key(constraints)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + settings.SEARCH_TOTAL_CACHE_TTL, total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.SEARCH_TOTAL_CACHE_MAX_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+total_cache = TotalCache()
+
+
+def executeSearchWithTotal(
+    user,
+    constraints,
+    from_,
+    to,
+    orderBy=None,
+    selectRelated=defaultSelectRelated,
+    defer=defaultDefer
+):
+    """Execute a search OpenSearch query, returning the page of results and the
+    total number of results
+
+    Same as executeSearch, but the hits and the total are returned by a single
+    request. The total is only tracked if it is not in total_cache, so later pages
+    of the same search are not counted again. Returns (response, total).
+    """
+    start = time.monotonic()
+    total = total_cache.get(constraints)
+
+    filters = formulate_query(constraints, orderBy=orderBy, selectRelated=selectRelated, defer=defer)
+    s = Search(using=client, index=settings.OPENSEARCH_INDEX)
+    s = s.query(Q('bool', filter=filters))
+    s = s.sort(*formulate_sort(orderBy))
+    s = s.extra(track_total_hits=total is None)
+    s = s[from_:to]
+
+    response = s.execute()
+
+    is_cached = total is not None
+    if not is_cached:
+        total = response.hits.total.value
+        total_cache.add(constraints, total)
+    log.debug(
+        'Search from=%s to=%s total=%s total_cached=%s took=%sms elapsed=%.3fs',
+        from_, to, total, is_cached, response.took, time.monotonic() - start,
+    )
+    return response, total
+
+
+def executeSearchAfter(
+    user,
+    constraints,
+    size,
+    orderBy=None,
+    after=None,
+    reverse=False,
+    pit=None,
+    selectRelated=defaultSelectRelated,
+    defer=defaultDefer
+):
+    """Execute a search OpenSearch query, returning the page of results that follows
+    a given result
+
+    Pages are selected with search_after instead of from / size, so the cost of a
+    page does not depend on its depth, and pages past MAX_RESULT_WINDOW can be
+    reached. 'after' is the sort values of the result to follow, as returned in
+    hit.meta.sort, or None for the first page. If 'reverse' is set, the page
+    precedes the result instead, or is the last page if 'after' is None. The results
+    are returned in orderBy order in both cases.
+
+    The searches of a session of paging are run against a point in time (PIT) of the
+    index, so results are not skipped or repeated when the index is modified between
+    pages. 'pit' is the PIT ID returned for the previous page, or None to open a new
+    PIT. A PIT that has expired is replaced by a new one.
+
+    Returns (hits, total, pit).
+    """
+    start = time.monotonic()
+    total = total_cache.get(constraints)
+
+    filters = formulate_query(constraints, orderBy=orderBy, selectRelated=selectRelated, defer=defer)
+    s = Search(using=client)
+    s = s.query(Q('bool', filter=filters))
+    s = s.sort(*formulate_sort(orderBy, reverse=reverse))
+    s = s.extra(track_total_hits=total is None, size=size)
+    if after is not None:
+        s = s.extra(search_after=after)
+
+    for is_retry in (False, True):
+        if pit is None:
+            pit = client.create_pit(
+                index=settings.OPENSEARCH_INDEX, keep_alive=settings.SEARCH_PIT_KEEP_ALIVE
+            )['pit_id']
+        try:
+            response = s.extra(pit={'id': pit, 'keep_alive': settings.SEARCH_PIT_KEEP_ALIVE}).execute()
+            break
+        except NotFoundError:
+            if is_retry:
+                raise
+            pit = None
+
+    is_cached = total is not None
+    if not is_cached:
+        total = response.hits.total.value
+        total_cache.add(constraints, total)
+    hits = list(response.hits)
+    if reverse:
+        hits.reverse()
+    log.debug(
+        'Search after=%s reverse=%s size=%s total=%s total_cached=%s took=%sms elapsed=%.3fs',
+        after, reverse, size, total, is_cached, response.took, time.monotonic() - start,
+    )
+    return hits, total, getattr(response, 'pit_id', pit)
+
+
+def closePit(pit):
+    """Close a point in time returned by executeSearchAfter(), before it expires"""
+    try:
+        client.delete_pit(body={'pit_id': [pit]})
+    except NotFoundError:
+        pass
+    except Exception as e:
+        log.warning('Unable to close PIT: %s', e)
+
+
 # noinspection PyDefaultArgument,PyDefaultArgument
 def executeSearchCountOnly(
       user, constraints, selectRelated=defaultSelectRelated, defer=defaultDefer
@@ -366,6 +541,30 @@ def formulate_order_by(order_by):
         return order_dict
 
 
+def formulate_sort(order_by, reverse=False):
+    """Return the sort for order_by, with the identifier added as a tiebreaker
+
+    The tiebreaker gives the results a total order, which is required for paging with
+    search_after. If 'reverse' is set, the order is reversed, including the placement
+    of results that are missing the sort field.
+    """
+    order_dict = formulate_order_by(order_by)
+    sort_list = [order_dict] if order_dict is not None else []
+    if 'searchable_id' not in (order_dict or {}):
+        sort_list.append({'searchable_id': {'order': 'asc'}})
+    reverse_direction = {'asc': 'desc', 'desc': 'asc'}
+    return [
+        {
+            field: {
+                'order': reverse_direction[d['order']] if reverse else d['order'],
+                'missing': '_first' if reverse else '_last',
+            }
+        }
+        for sort_dict in sort_list
+        for field, d in sort_dict.items()
+    ]
+
+
 def words_to_must_and_should(the_string):
     words = the_string.split()
     must_words = []
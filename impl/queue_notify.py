@@ -0,0 +1,106 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Wake up the async processes when tasks are added to their queues
+
+The async processes that work on a queue listen on local UNIX datagram sockets in the
+DAEMONS_QUEUE_NOTIFY_DIR directory, one socket per worker, named after the queue table.
+After a transaction that adds tasks to a queue commits, impl.enqueue sends an empty
+datagram to each socket of the queue, and the workers start processing without waiting
+for their next poll.
+
+Notifications only reach workers on the same host. The workers still poll their queues
+every DAEMONS_QUEUE_NOTIFY_IDLE_SLEEP seconds, which picks up tasks added on other hosts
+and tasks for which a notification was lost. If DAEMONS_QUEUE_NOTIFY_DIR is None,
+notifications are disabled, and the workers poll every DAEMONS_IDLE_SLEEP seconds.
+"""
+
+import glob
+import logging
+import os
+import select
+import socket
+import threading
+
+import django.conf
+
+log = logging.getLogger(__name__)
+
+
+def is_enabled():
+    return django.conf.settings.DAEMONS_QUEUE_NOTIFY_DIR is not None
+
+
+def notify(queue_model_list):
+    """Wake up the workers of each of the queues in queue_model_list
+
+    Sending never blocks. Errors are logged and otherwise ignored, as the workers fall
+    back to polling.
+    """
+    if not is_enabled():
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        for queue_model in queue_model_list:
+            for path in glob.glob(_socket_path(queue_model, '*')):
+                try:
+                    sock.sendto(b'', path)
+                except BlockingIOError:
+                    # The worker has not yet read earlier notifications, so is already
+                    # due to wake up.
+                    pass
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Left behind by a worker that died
+                    _unlink(path)
+                except OSError as e:
+                    log.warning(f'Unable to notify queue worker. path="{path}" error="{e}"')
+    finally:
+        sock.close()
+
+
+class Listener:
+    """The socket on which a worker receives the notifications for a queue
+
+    A Listener must only be used by the thread that created it.
+    """
+
+    def __init__(self, queue_model):
+        self._path = _socket_path(queue_model, f'{os.getpid()}.{threading.get_ident()}')
+        _unlink(self._path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self._path)
+        self._sock.setblocking(False)
+
+    def wait(self, timeout_sec):
+        """Wait up to timeout_sec seconds for a notification
+
+        Returns True if one or more notifications were received.
+        """
+        if not select.select([self._sock], [], [], timeout_sec)[0]:
+            return False
+        try:
+            while True:
+                self._sock.recv(1)
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        self._sock.close()
+        _unlink(self._path)
+
+
+def _socket_path(queue_model, suffix):
+    # noinspection PyProtectedMember
+    return os.path.join(
+        django.conf.settings.DAEMONS_QUEUE_NOTIFY_DIR,
+        f'{queue_model._meta.db_table}.{suffix}.sock',
+    )
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -1,8 +1,14 @@
+import bisect
+import collections
 import dataclasses
 import logging
 import re
+import threading
+import time
 import typing
 
+import django.conf
+
 import ezidapp.models.identifier
 import ezidapp.models.shoulder
 import impl.util
@@ -42,6 +48,8 @@ class IdentifierStruct:
     extra: str = ''
     '''Any characters in provided identifier that extend beyond resolved 
        identifier. Not set until find_record() is called.'''
+    lookups: int = dataclasses.field(default=0, compare=False)
+    '''Number of database lookups made by find_record().'''
 
     def __str__(self):
         if self.suffix is not None:
@@ -92,22 +100,36 @@ class IdentifierStruct:
         The catalog is searched for the longest existing identifier that
         matches this identifier structure. A DoesNotExits exception is
         raised if there are no matches.
+
+        Candidates are looked up longest first: the full identifier, then
+        the next RESOLVER_PROBE_SIZE longest candidates, then the rest. Most
+        requests are for an existing identifier, possibly followed by a short
+        passthrough suffix, and are resolved by the first or second lookup,
+        without sending every candidate to the database. Since a batch is only
+        looked up if all longer candidates are missing, the longest match is
+        found as before.
         '''
-        _matches = ezidapp.models.identifier.Identifier.objects.filter(
-            identifier__in=self.potential_matches()
-        )
-        if fields is not None:
-            _matches = _matches.only(*fields)
-        result = list(_matches)
-        if len(result) > 0:
-            matching_record = max(result, key=lambda si: len(si.identifier))
-            self.align_with_found(matching_record.identifier)
-            return matching_record
-        # try:
-        #    res = ezidapp.models.shoulder.getLongestShoulderMatch(str(self))
-        #    return res
-        # except:
-        #    pass
+        candidates = self.potential_matches()
+        candidates.reverse()
+        probe_size = django.conf.settings.RESOLVER_PROBE_SIZE
+        for batch in (
+            candidates[:1],
+            candidates[1 : 1 + probe_size],
+            candidates[1 + probe_size :],
+        ):
+            if len(batch) == 0:
+                continue
+            _matches = ezidapp.models.identifier.Identifier.objects.filter(
+                identifier__in=batch
+            )
+            if fields is not None:
+                _matches = _matches.only(*fields)
+            self.lookups += 1
+            result = list(_matches)
+            if len(result) > 0:
+                matching_record = max(result, key=lambda si: len(si.identifier))
+                self.align_with_found(matching_record.identifier)
+                return matching_record
         raise ezidapp.models.identifier.Identifier.DoesNotExist()
 
     def find_shoulder(self) -> ezidapp.models.shoulder.Shoulder:
@@ -128,6 +150,115 @@ class IdentifierStruct:
         return shoulders
 
 
+class ResolutionCache:
+    '''Cache of resolved identifier records, for redirects of frequently resolved
+    identifiers.
+
+    Entries are keyed by the normalized requested identifier, including any
+    passthrough suffix, with the DOI upper-cased as in stored identifiers (see
+    _key()), and hold the longest matching record, loaded with only
+    the fields needed for a redirect, or None if there was no match. The cached
+    records are shared between requests and must not be modified.
+
+    Writes made through impl.ezid invalidate the affected entries in the
+    writing process. Entries are dropped after RESOLVER_CACHE_TTL seconds,
+    which bounds the staleness of entries invalidated by writes in other
+    processes. At most RESOLVER_CACHE_MAX_SIZE entries are held, evicting the
+    least recently used.
+
+    The keys are also held in sorted order, so that the entries matching an
+    invalidated identifier are found by binary search.
+    '''
+
+    FIELDS = ["identifier", "updateTime", "target", "status"]
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._keys = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def find_record(self, identifier_info: IdentifierStruct) -> ezidapp.models.identifier.Identifier:
+        '''Return the longest matching Identifier record, with only the fields
+        in FIELDS loaded.
+
+        Same as identifier_info.find_record(), but consults the cache first.
+        '''
+        if django.conf.settings.RESOLVER_CACHE_TTL <= 0:
+            return identifier_info.find_record(fields=self.FIELDS)
+        key = self._key(str(identifier_info))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record = entry[1]
+            else:
+                self.misses += 1
+                entry = None
+        if entry is None:
+            try:
+                record = identifier_info.find_record(fields=self.FIELDS)
+            except ezidapp.models.identifier.Identifier.DoesNotExist:
+                record = None
+            self._add(key, record)
+        elif record is not None:
+            identifier_info.align_with_found(record.identifier)
+        if record is None:
+            raise ezidapp.models.identifier.Identifier.DoesNotExist()
+        return record
+
+    def _add(self, key, record):
+        with self._lock:
+            if key not in self._entries:
+                bisect.insort(self._keys, key)
+            self._entries[key] = (
+                time.monotonic() + django.conf.settings.RESOLVER_CACHE_TTL,
+                record,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > django.conf.settings.RESOLVER_CACHE_MAX_SIZE:
+                evicted_key, _ = self._entries.popitem(last=False)
+                del self._keys[bisect.bisect_left(self._keys, evicted_key)]
+
+    def invalidate(self, identifiers: typing.Iterable[str]):
+        '''Drop the entries that identifiers that have been created, modified or
+        deleted may resolve.
+
+        An identifier matches requests that start with it, so this drops both
+        the entries it was the match for, and those it may now be a longer
+        match for.
+        '''
+        with self._lock:
+            for prefix in map(self._key, identifiers):
+                lo = hi = bisect.bisect_left(self._keys, prefix)
+                while hi < len(self._keys) and self._keys[hi].startswith(prefix):
+                    del self._entries[self._keys[hi]]
+                    hi += 1
+                del self._keys[lo:hi]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    @staticmethod
+    def _key(identifier):
+        '''Return the key for a requested or stored identifier.
+
+        DOIs are resolved regardless of case, and stored upper-cased, so the
+        requested case of a DOI must not select a separate entry, which would
+        not be dropped by invalidate().
+        '''
+        if identifier.startswith(f"{SCHEME_DOI}:"):
+            return f"{SCHEME_DOI}:{identifier[len(SCHEME_DOI) + 1:].upper()}"
+        return identifier
+
+
+resolution_cache = ResolutionCache()
+
+
 class ArkIdentifierStruct(IdentifierStruct):
     '''Represents an ARK identifier structure.
     '''
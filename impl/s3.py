@@ -1,6 +1,11 @@
 import boto3
 from botocore.exceptions import NoCredentialsError
 import logging
+import pathlib
+import shutil
+import uuid
+
+import django.conf
 
 _log = logging.getLogger()
 
@@ -52,4 +57,125 @@ def upload_file(local_file_path, bucket_name, s3_object_key):
         _log.error(f"S3 file upload error: The file {local_file_path} was not found.")
 
     except Exception as e:
-        _log.error(f"S3 file upload error: An error occurred: {e}")
\ No newline at end of file
+        _log.error(f"S3 file upload error: An error occurred: {e}")
+
+
+# Multipart uploads
+#
+# If S3_LOCAL_DIR is set, objects are written below that directory instead of to S3,
+# at S3_LOCAL_DIR/<bucket_name>/<object_key>. This stand-in is for development and
+# testing. Unlike upload_file(), these functions raise on errors, so that the caller can
+# retry.
+
+
+def _local_path(bucket_name, object_key):
+    return pathlib.Path(django.conf.settings.S3_LOCAL_DIR, bucket_name, object_key)
+
+
+def create_multipart_upload(bucket_name, s3_object_key):
+    """
+    Start a multipart upload of an S3 object.
+
+    Returns:
+        - str: The upload ID.
+    """
+    if django.conf.settings.S3_LOCAL_DIR:
+        upload_id = uuid.uuid4().hex
+        path = _local_path(bucket_name, s3_object_key)
+        path.with_name(f"{path.name}.{upload_id}").mkdir(parents=True)
+        return upload_id
+    s3 = boto3.client('s3')
+    return s3.create_multipart_upload(Bucket=bucket_name, Key=s3_object_key)['UploadId']
+
+
+def upload_part(bucket_name, s3_object_key, upload_id, part_number, data):
+    """
+    Upload one part of a multipart upload. Parts are numbered from 1, and all parts
+    except the last must be at least 5 MiB. Uploading a part again replaces it.
+
+    Returns:
+        - str: The ETag of the part, required to complete the upload.
+    """
+    if django.conf.settings.S3_LOCAL_DIR:
+        path = _local_path(bucket_name, s3_object_key)
+        path.with_name(f"{path.name}.{upload_id}").joinpath(str(part_number)).write_bytes(data)
+        return str(part_number)
+    s3 = boto3.client('s3')
+    return s3.upload_part(
+        Bucket=bucket_name,
+        Key=s3_object_key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=data,
+    )['ETag']
+
+
+def complete_multipart_upload(bucket_name, s3_object_key, upload_id, etag_list):
+    """
+    Complete a multipart upload, creating the S3 object from the parts, in order.
+
+    Parameters:
+        - etag_list (list): The ETags of parts 1, 2, ...
+    """
+    if django.conf.settings.S3_LOCAL_DIR:
+        path = _local_path(bucket_name, s3_object_key)
+        part_dir = path.with_name(f"{path.name}.{upload_id}")
+        with path.open('wb') as f:
+            for part_number in range(1, len(etag_list) + 1):
+                with part_dir.joinpath(str(part_number)).open('rb') as part:
+                    shutil.copyfileobj(part, f)
+        shutil.rmtree(part_dir)
+        return
+    s3 = boto3.client('s3')
+    s3.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=s3_object_key,
+        UploadId=upload_id,
+        MultipartUpload={
+            'Parts': [{'ETag': etag, 'PartNumber': i + 1} for i, etag in enumerate(etag_list)]
+        },
+    )
+    _log.info(f"S3: Multipart upload completed to s3://{bucket_name}/{s3_object_key}")
+
+
+def get_object_size(bucket_name, s3_object_key):
+    """
+    Return the size in bytes of an S3 object, or None if the object does not exist.
+    """
+    if django.conf.settings.S3_LOCAL_DIR:
+        path = _local_path(bucket_name, s3_object_key)
+        return path.stat().st_size if path.is_file() else None
+    s3 = boto3.client('s3')
+    try:
+        return s3.head_object(Bucket=bucket_name, Key=s3_object_key)['ContentLength']
+    except s3.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None
+        raise
+
+
+def object_exists(bucket_name, s3_object_key):
+    """
+    Return True if the S3 object exists.
+    """
+    return get_object_size(bucket_name, s3_object_key) is not None
+
+
+def copy_object(bucket_name, source_object_key, s3_object_key):
+    """
+    Copy an S3 object within a bucket. The copy is made by S3, without transferring
+    the object's contents.
+    """
+    if django.conf.settings.S3_LOCAL_DIR:
+        path = _local_path(bucket_name, s3_object_key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(_local_path(bucket_name, source_object_key), path)
+        return
+    s3 = boto3.client('s3')
+    s3.copy(
+        {'Bucket': bucket_name, 'Key': source_object_key}, bucket_name, s3_object_key
+    )
+    _log.info(
+        f"S3: Object copied from s3://{bucket_name}/{source_object_key} "
+        f"to s3://{bucket_name}/{s3_object_key}"
+    )
@@ -0,0 +1,160 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Single-pass builder for the search representations of an identifier
+
+An identifier is searchable through two derived representations: the computed columns of
+the SearchIdentifier table, and the OpenSearch document. Both are derived from the
+identifier's citation metadata. SearchDocBuilder maps the metadata to kernel elements,
+and extracts the keywords from any DataCite / Crossref XML, once per identifier, and both
+representations are built from the results.
+
+Derived values are cached on the builder instance, and are released with it, so the
+builder should be created for each identifier write and then discarded.
+"""
+
+import functools
+import re
+
+import ezidapp.models.validation
+import impl.util
+
+MAX_SEARCHABLE_TARGET_LENGTH = 255
+INDEXED_PREFIX_LENGTH = 50
+
+
+class SearchDocBuilder:
+    def __init__(self, identifier):
+        """identifier: An identifier model instance (Identifier, RefIdentifier or
+        SearchIdentifier), with its owner, ownergroup, profile and datacenter.
+        """
+        self.identifier = identifier
+
+    @functools.cached_property
+    def km(self):
+        return self.identifier.kernelMetadata
+
+    @functools.cached_property
+    def searchable_target(self):
+        return self.identifier.target[::-1][:MAX_SEARCHABLE_TARGET_LENGTH]
+
+    @functools.cached_property
+    def resource_creator(self):
+        return self.km.creator if self.km.creator is not None else ''
+
+    @functools.cached_property
+    def resource_creators(self):
+        if self.km.creator is None:
+            return []
+        return [c.strip() for c in self.km.creator.split(';')]
+
+    @functools.cached_property
+    def resource_title(self):
+        return self.km.title if self.km.title is not None else ''
+
+    @functools.cached_property
+    def resource_publisher(self):
+        return self.km.publisher if self.km.publisher is not None else ''
+
+    @functools.cached_property
+    def resource_publication_date(self):
+        return self.km.date if self.km.date is not None else ''
+
+    @functools.cached_property
+    def searchable_publication_year(self):
+        d = self.km.validatedDate
+        return int(d[:4]) if d is not None else None
+
+    @functools.cached_property
+    def resource_type(self):
+        return self.km.type if self.km.type is not None else ''
+
+    @functools.cached_property
+    def searchable_resource_type(self):
+        t = self.km.validatedType
+        return ezidapp.models.validation.resourceTypes[t.split("/")[0]] if t is not None else ''
+
+    @functools.cached_property
+    def resource_type_words(self):
+        """All the words in the validated resource type, for inclusive full text
+        searching
+
+        Words are split on whitespace, underscore, dash and slash, and CamelCased
+        words are also split into their parts.
+        """
+        t = self.km.validatedType
+        if t is None or t == "":
+            return None
+        obvious_words = re.split(r'[\s_\-/]+', t)
+        more_words = []
+        for word in obvious_words:
+            extra_words = re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', word).split()
+            if len(extra_words) > 1:
+                more_words.extend(extra_words)
+        return ' '.join(obvious_words + more_words)
+
+    @functools.cached_property
+    def keywords(self):
+        """The identifier, owner, group, datacenter, target and metadata values,
+        with any DataCite / Crossref XML reduced to its text content
+        """
+        i = self.identifier
+        kw = [
+            i.identifier,
+            i.owner.username if i.owner else None,
+            i.ownergroup.groupname if i.ownergroup else None,
+        ]
+        if i.isDatacite:
+            kw.append(i.datacenter.symbol)
+        if i.target != i.defaultTarget:
+            kw.append(i.target)
+        for k, v in list(i.metadata.items()):
+            if k in ["datacite", "crossref"]:
+                try:
+                    kw.append(impl.util.extractXmlContent(v))
+                except Exception:
+                    kw.append(v)
+            else:
+                kw.append(v)
+        return " ; ".join([x for x in kw if x is not None])
+
+    @functools.cached_property
+    def has_metadata(self):
+        return (
+            self.resource_title != ""
+            and self.resource_publication_date != ""
+            and (self.resource_creator != "" or self.resource_publisher != "")
+        )
+
+    @functools.cached_property
+    def public_search_visible(self):
+        i = self.identifier
+        return i.isPublic and i.exported and not i.isTest
+
+    @functools.cached_property
+    def oai_visible(self):
+        return (
+            self.public_search_visible
+            and self.has_metadata
+            and self.identifier.target != self.identifier.defaultTarget
+        )
+
+    def search_identifier_values(self):
+        """Return the computed SearchIdentifier column values, keyed by field name"""
+        return {
+            'searchableTarget': self.searchable_target,
+            'resourceCreator': self.resource_creator,
+            'resourceTitle': self.resource_title,
+            'resourcePublisher': self.resource_publisher,
+            'resourcePublicationDate': self.resource_publication_date,
+            'searchablePublicationYear': self.searchable_publication_year,
+            'resourceType': self.resource_type,
+            'searchableResourceType': self.searchable_resource_type,
+            'keywords': self.keywords,
+            'resourceCreatorPrefix': self.resource_creator[:INDEXED_PREFIX_LENGTH],
+            'resourceTitlePrefix': self.resource_title[:INDEXED_PREFIX_LENGTH],
+            'resourcePublisherPrefix': self.resource_publisher[:INDEXED_PREFIX_LENGTH],
+            'hasMetadata': self.has_metadata,
+            'publicSearchVisible': self.public_search_visible,
+            'oaiVisible': self.oai_visible,
+        }
@@ -1,6 +1,9 @@
 #  Copyright©2021, Regents of the University of California
 #  http://creativecommons.org/licenses/BSD
 
+import base64
+import hashlib
+import json
 import locale
 import math
 import operator
@@ -15,6 +18,7 @@ from ezidapp.models.identifier import Identifier
 
 import django.conf
 import django.contrib.messages
+import django.core.exceptions
 from django.utils.translation import gettext as _
 
 import impl.form_objects
@@ -126,6 +130,10 @@ IS_ASCENDING = {'asc': True, 'desc': False}
 DATE_FLOOR = False
 DATE_CEILING = True
 
+# Session key of the point in time (PIT) used for paging with cursors, see
+# _setSessionPit()
+SESSION_PIT_KEY = 'search_pit'
+
 
 def queryUrlEncoded(request):
     r = {}
@@ -270,35 +278,57 @@ def search(d, request, noConstraintsReqd=False, s_type="public"):
                 Identifier.CR_WARNING,
                 Identifier.CR_FAILURE,
             ]
-        d['total_results'] = impl.open_search_util.executeSearchCountOnly(
-            impl.userauth.getUser(request, returnAnonymous=True), c
-        )
-        d['total_results_str'] = format(d['total_results'], "n")
-        if int(d['total_results']) > 10_000:
-            d['total_pages'] = int(math.ceil(float(10_000 / d['ps'])))
-        else:
-            d['total_pages'] = int(math.ceil(float(d['total_results']) / float(d['ps'])))
-
-        if d['p'] > d['total_pages']:
-            d['p'] = d['total_pages']
-        d['p'] = max(d['p'], 1)
         if d['order_by']:
             orderColumn = FIELDS_MAPPED[d['order_by']][0]
             if IS_ASCENDING[d['sort']]:
                 orderColumn = "-" + orderColumn
         else:
             orderColumn = None
-        d['results'] = []
+        user = impl.userauth.getUser(request, returnAnonymous=True)
+        queryKey = _queryKey(c, orderColumn, d['ps'])
+        cursor = _decodeCursor(request.GET.get('c', ''), queryKey, d['ps'])
+        d['p'] = max(d['p'], 1)
+        sessionPit = _sessionPit(request, queryKey)
+        pit = sessionPit
+        if cursor is not None and cursor['p'] == d['p']:
+            # Page reached by following a cursor from a neighbouring page
+            hits, d['total_results'], pit = impl.open_search_util.executeSearchAfter(
+                user,
+                c,
+                cursor['size'],
+                orderColumn,
+                cursor['after'],
+                cursor['rev'],
+                cursor['pit'] or sessionPit,
+            )
+            _setSessionPit(request, queryKey, pit)
+        else:
+            # Page selected by number. The hits and the total are returned together, so
+            # the requested page is fetched before the total is known. A page past the
+            # last page, or past the pages that can be selected by number, is clamped,
+            # and fetched again, which no longer needs to count.
+            maxPage = impl.open_search_util.MAX_RESULT_WINDOW // d['ps']
+            d['p'] = min(d['p'], maxPage)
+            while True:
+                response, d['total_results'] = impl.open_search_util.executeSearchWithTotal(
+                    user,
+                    c,
+                    (d['p'] - 1) * d['ps'],
+                    d['p'] * d['ps'],
+                    orderColumn,
+                )
+                lastPage = max(int(math.ceil(float(d['total_results']) / float(d['ps']))), 1)
+                if d['p'] <= lastPage:
+                    break
+                d['p'] = lastPage
+            hits = list(response.hits)
         rec_beg = (d['p'] - 1) * d['ps']
         rec_end = d['p'] * d['ps']
-        response = impl.open_search_util.executeSearch(
-            impl.userauth.getUser(request, returnAnonymous=True),
-            c,
-            rec_beg,
-            rec_end,
-            orderColumn,
-        )
-        for hit in response.hits:
+        d['total_pages'] = int(math.ceil(float(d['total_results']) / float(d['ps'])))
+        d['cursors'] = _pageCursors(d, hits, queryKey, pit)
+        d['total_results_str'] = format(d['total_results'], "n")
+        d['results'] = []
+        for hit in hits:
             if s_type in ('public', 'manage'):
                 result = {
                     "c_create_time": datetime.fromisoformat(hit['create_time']).timestamp(),
@@ -389,6 +419,113 @@ def search(d, request, noConstraintsReqd=False, s_type="public"):
     return d
 
 
+def _queryKey(c, orderColumn, pageSize):
+    """Return a key that identifies the results of a search, for checking that a
+    cursor belongs to the search."""
+    key = json.dumps([c, orderColumn, pageSize], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def _encodeCursor(queryKey, page, size, after, rev, pit):
+    cursor = {
+        'q': queryKey,
+        'p': page,
+        'size': size,
+        'after': after,
+        'rev': rev,
+        'pit': pit,
+    }
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+
+def _decodeCursor(s, queryKey, pageSize):
+    """Return the cursor encoded in s, or None if s is empty or is a cursor for a
+    search other than the one identified by queryKey.
+
+    Raises BadRequest if s is not a valid cursor.
+    """
+    if not s:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(s.encode('ascii')))
+        isValid = (
+            isinstance(cursor['q'], str)
+            and type(cursor['p']) is int
+            and type(cursor['size']) is int
+            and 0 < cursor['size'] <= pageSize
+            and (cursor['after'] is None or isinstance(cursor['after'], list))
+            and type(cursor['rev']) is bool
+            and (cursor['pit'] is None or isinstance(cursor['pit'], str))
+        )
+    except Exception:
+        isValid = False
+    if not isValid:
+        raise django.core.exceptions.BadRequest('Invalid search cursor')
+    if cursor['q'] != queryKey:
+        return None
+    return cursor
+
+
+def _sessionPit(request, queryKey):
+    """Return the PIT opened for the search identified by queryKey in this session,
+    or None. A PIT opened for another search is closed."""
+    saved = request.session.get(SESSION_PIT_KEY)
+    if saved is None:
+        return None
+    if saved[0] == queryKey:
+        return saved[1]
+    impl.open_search_util.closePit(saved[1])
+    del request.session[SESSION_PIT_KEY]
+    return None
+
+
+def _setSessionPit(request, queryKey, pit):
+    """Record the PIT of the search identified by queryKey, closing the PIT recorded
+    before, if it is a different one.
+
+    A session has at most one open PIT. It is reused for the cursors of later pages of
+    the same search, including pages selected by number.
+    """
+    saved = request.session.get(SESSION_PIT_KEY)
+    if saved is not None and saved[1] != pit:
+        impl.open_search_util.closePit(saved[1])
+    request.session[SESSION_PIT_KEY] = [queryKey, pit]
+
+
+def _pageCursors(d, hits, queryKey, pit):
+    """Return the cursors for the pages around the current page that can't be
+    selected by number.
+
+    Pages past MAX_RESULT_WINDOW are reached by following a cursor, which holds the
+    sort values of the result that the page follows or precedes, and the point in
+    time of the search, if one has been opened. Paging with cursors costs the same at
+    any depth.
+    """
+    cursors = {}
+    p, ps = d['p'], d['ps']
+    maxPage = impl.open_search_util.MAX_RESULT_WINDOW // ps
+    if len(hits) == 0:
+        return cursors
+    if p - 1 > maxPage:
+        cursors['prev'] = _encodeCursor(
+            queryKey, p - 1, ps, list(hits[0].meta.sort), True, pit
+        )
+    if maxPage < p + 1 <= d['total_pages']:
+        cursors['next'] = _encodeCursor(
+            queryKey, p + 1, ps, list(hits[-1].meta.sort), False, pit
+        )
+    if maxPage < d['total_pages'] and p < d['total_pages']:
+        cursors['last'] = _encodeCursor(
+            queryKey,
+            d['total_pages'],
+            d['total_results'] - (d['total_pages'] - 1) * ps,
+            None,
+            True,
+            pit,
+        )
+    return cursors
+
+
 def _pageLayout(d, REQUEST, s_type="public"):
     """Track user preferences for selected fields, field order, page, and page
     size."""
@@ -5,8 +5,13 @@
 """
 
 import base64
+import collections
 import hashlib
+import hmac
 import logging
+import os
+import threading
+import time
 
 import django.conf
 import django.contrib.auth
@@ -25,6 +30,97 @@ SESSION_KEY = "ezidAuthenticatedUser"
 logger = logging.getLogger(__name__)
 
 
+class _CredentialCache:
+    """Short-lived cache of successfully verified credentials
+
+    Verifying a password runs the full password hasher (PBKDF2), which dominates the
+    cost of API requests that authenticate with HTTP Basic auth on every call. This
+    cache remembers, for up to AUTH_CACHE_TTL seconds, that a username and password
+    were verified against the user's stored password hash. Credentials are keyed by a
+    keyed hash (HMAC with a random, per-process key), so the cache holds no password
+    material.
+
+    An entry is only a hit if the user's stored password hash is unchanged, so a
+    password change invalidates the user's entries. Users with logins disabled are
+    never looked up. At most AUTH_CACHE_MAX_SIZE entries are held, evicting the least
+    recently used.
+    """
+
+    def __init__(self):
+        self._key = os.urandom(32)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, username, password):
+        return hmac.new(
+            self._key, f"{username}\0{password}".encode("utf-8"), hashlib.sha256
+        ).digest()
+
+    def check(self, username, password, passwordHash):
+        """Return True if the credentials were verified against 'passwordHash' within
+        the TTL
+        """
+        digest = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if (
+                entry is not None
+                and entry[0] > time.monotonic()
+                and hmac.compare_digest(entry[1], passwordHash)
+            ):
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return True
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return False
+
+    def add(self, username, password, passwordHash):
+        if django.conf.settings.AUTH_CACHE_TTL <= 0:
+            return
+        digest = self._digest(username, password)
+        with self._lock:
+            self._entries[digest] = (
+                time.monotonic() + django.conf.settings.AUTH_CACHE_TTL,
+                passwordHash,
+            )
+            self._entries.move_to_end(digest)
+            while len(self._entries) > django.conf.settings.AUTH_CACHE_MAX_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_credentialCache = _CredentialCache()
+
+
+def getCredentialCacheStatus():
+    """Return a tuple (hits, misses) of verified-credential cache lookups"""
+    return _credentialCache.hits, _credentialCache.misses
+
+
+def _checkPassword(user, password):
+    """Return True if the supplied password matches the user's
+
+    Credentials verified within the last AUTH_CACHE_TTL seconds are accepted without
+    running the password hasher again.
+    """
+    if not user.loginEnabled:
+        return user.authenticate(password)
+    if _credentialCache.check(user.username, password, user.password):
+        logger.debug('Auth successful (cached). user="{}"'.format(user))
+        return True
+    if not user.authenticate(password):
+        return False
+    _credentialCache.add(user.username, password, user.password)
+    return True
+
+
 def authenticate(username, password, request=None, coAuthenticate=True):
     """Authenticate a username and password
 
@@ -81,8 +177,8 @@ def authenticate(username, password, request=None, coAuthenticate=True):
         )
         return None
 
-    if (sudo and ezidapp.models.util.getAdminUser().authenticate(password)) or (
-        not sudo and user.authenticate(password)
+    if (sudo and _checkPassword(ezidapp.models.util.getAdminUser(), password)) or (
+        not sudo and _checkPassword(user, password)
     ):
         logger.debug('Auth successful. user="{}" sudo="{}"'.format(user, sudo))
 
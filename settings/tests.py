@@ -61,6 +61,18 @@ OPENSEARCH_BASE = 'http://opensearch.example.com'
 OPENSEARCH_INDEX = 'ezid-test-index'
 OPENSEARCH_USER = 'test-user'
 OPENSEARCH_PASSWORD = 'test-password'
+# OPENSEARCH_INDEX may be an index or an alias. While the index is rebuilt with
+# 'opensearch-update --rebuild', writers check for the rebuild at most this often
+# (seconds), and write to both the live and the new index.
+OPENSEARCH_REBUILD_CHECK_INTERVAL = 10
+# Seconds for which the total number of results of a search is reused while paging
+# through the results. Set to 0 to count the results for every page.
+SEARCH_TOTAL_CACHE_TTL = 60
+# Max number of cached search totals per process.
+SEARCH_TOTAL_CACHE_MAX_SIZE = 10000
+# Time for which the point in time used for paging through search results past the
+# first 10,000 is kept, after each page is viewed.
+SEARCH_PIT_KEEP_ALIVE = '10m'
 
 # fmt:off
 SEARCH_STOPWORDS = [
@@ -152,6 +164,15 @@ DAEMONS_BATCH_SLEEP = 1
 # Sleep after all batches are done. This sleep is performed when there is no more work
 # to do, but new work is expected to be added shortly.
 DAEMONS_IDLE_SLEEP = 1
+# Directory holding the sockets on which the queue processing daemons are woken up when
+# tasks are added to their queues. Must be writable by both the web server and the
+# daemons, and is only shared by processes on the same host. Set to None to disable the
+# notifications, in which case the daemons poll their queues every DAEMONS_IDLE_SLEEP.
+DAEMONS_QUEUE_NOTIFY_DIR = None
+# Sleep after all batches are done, when queue notifications are enabled. The daemons
+# poll their queues at this interval for tasks added on other hosts, or for which the
+# notification was lost.
+DAEMONS_QUEUE_NOTIFY_IDLE_SLEEP = 60
 # Reset database connections after this many seconds.
 # When sleeping, if its been more than this many seconds since the
 # last time the connection was reset, then reset database connections
@@ -164,19 +185,91 @@ DAEMONS_LONG_SLEEP = 60 * 60 * 24
 # Limit the number of results in each queryset. This value becomes a LIMIT clause in the
 # SQL query that pulls work from the queue.
 DAEMONS_MAX_BATCH_SIZE = 100
+# Seconds after which the queue tasks claimed by a worker that died become available to
+# other workers. Must be longer than the time taken to process DAEMONS_MAX_BATCH_SIZE
+# tasks, as a worker stops processing its batch when its leases expire.
+DAEMONS_QUEUE_LEASE = 60 * 10
 
 # Daemons: Individual settings
 DAEMONS_DOWNLOAD_PROCESSING_IDLE_SLEEP = 10
 DAEMONS_DOWNLOAD_WORK_DIR = HOME_DIR / 'download'  # /apps/ezid/download
 DAEMONS_DOWNLOAD_PUBLIC_DIR = DAEMONS_DOWNLOAD_WORK_DIR / 'public'  # /apps/ezid/download/public
 DAEMONS_DOWNLOAD_FILE_LIFETIME = 60 * 60 * 24 * 7
+# Number of download requests processed concurrently by each proc-download instance.
+DAEMONS_DOWNLOAD_WORKERS = 1
+# Seconds after which a download request being processed by a worker that died becomes
+# available to other workers.
+DAEMONS_DOWNLOAD_LEASE = 60 * 10
+# Download requests are processed smallest first, except that requests that have
+# waited longer than this many seconds go first, in order of arrival.
+DAEMONS_DOWNLOAD_MAX_WAIT = 60 * 60
+# If True, gzip-compressed downloads are compressed as they are harvested, and uploaded
+# directly to S3 with a multipart upload, without intermediate files. ZIP downloads are
+# always written to local files first.
+DAEMONS_DOWNLOAD_STREAMING = True
+# Size in bytes at which compressed download data is uploaded as a part. A restarted
+# download resumes from the last uploaded part. Must be at least 5 MiB.
+DAEMONS_DOWNLOAD_PART_SIZE = 16 * 1024 * 1024
+# If True, a download request identical to an earlier one, with no identifiers in scope
+# changed since, reuses the earlier download instead of harvesting again. Changes are
+# detected by identifier count and latest update time only, so changes that do not
+# update identifiers (e.g., renamed users or groups, and link checker results), and
+# updates made in the same second as the earlier download, are not detected.
+DAEMONS_DOWNLOAD_REUSE_RESULTS = True
+
+# Number of tasks the search indexer processes together, with a single OpenSearch _bulk
+# request. 1 processes tasks one at a time.
+DAEMONS_SEARCH_INDEXER_BATCH_SIZE = 100
+# Seconds a task may wait for a chunk to fill up before a partial chunk is processed.
+DAEMONS_SEARCH_INDEXER_MAX_LATENCY = 2
+
+# Number of worker threads processing each queue, in each instance of the queue's
+# daemon. Workers claim disjoint sets of tasks, so daemons may also be run on several
+# hosts.
+DAEMONS_CROSSREF_WORKERS = 1
+DAEMONS_DATACITE_WORKERS = 1
+DAEMONS_SEARCH_INDEXER_WORKERS = 1
+# Number of DataCite tasks each DataCite worker performs concurrently. The tasks of an
+# identifier are always performed one at a time, in order.
+DAEMONS_DATACITE_CONCURRENCY = 4
 
 DAEMONS_STATISTICS_COMPUTE_CYCLE = 3600
 DAEMONS_STATISTICS_COMPUTE_SAME_TIME_OF_DAY = True
+# Seconds between incremental updates of the statistics, between full recomputes. Each
+# update recounts only the statistics of the owners and months of identifiers created,
+# updated or deleted since the last update. 0 disables incremental updates.
+DAEMONS_STATISTICS_INCREMENTAL_CYCLE = 300
+# Seconds after which an incremental update may move past a search indexer task. Tasks
+# become visible out of seq order, as enqueuing transactions commit, so tasks that are
+# enqueued more recently are treated as pending. Must be longer than the longest
+# enqueuing transaction, plus the clock difference between hosts.
+DAEMONS_STATISTICS_QUEUE_LAG = 300
 
 MAX_CONCURRENT_OPERATIONS_PER_USER = 4
 MAX_THREADS_PER_USER = 16
 
+# Identifier locks
+# 'local': Locks are enforced between the threads of a single process.
+# 'database': Locks are enforced across all processes and hosts sharing the database.
+IDENTIFIER_LOCK_BACKEND = 'local'
+# Seconds after which the locks of a worker that died are released ('database' only).
+IDENTIFIER_LOCK_LEASE = 60 * 5
+# Seconds between attempts by waiting operations ('database' only).
+IDENTIFIER_LOCK_POLL_INTERVAL = 0.2
+
+# Verified-credential cache for HTTP Basic auth
+# Seconds for which verified credentials are accepted without rerunning the password
+# hasher. Set to 0 to disable the cache.
+AUTH_CACHE_TTL = 60
+# Max number of cached credentials per process.
+AUTH_CACHE_MAX_SIZE = 10000
+
+# Batch API operations
+# Max number of records accepted in a single batch request.
+API_BATCH_MAX_COUNT = 1000
+# Number of records written per transaction, with one multi-row INSERT per table.
+API_BATCH_CHUNK_SIZE = 100
+
 DATABASES_RECONNECT_DELAY = 60
 
 # Max age of test identifiers before they are deleted
@@ -390,6 +483,9 @@ MATOMO_SITE_URL = 'https://matomo.cdlib.org/'
 
 S3_BUCKET = 'uc3-ezidui-dev'
 S3_BUCKET_DOWNLOAD_PATH = 'download'
+# If set, S3 multipart uploads are written below this local directory instead of to S3.
+# For development and testing only.
+S3_LOCAL_DIR = None
 
 GZIP_COMMAND = '/usr/bin/gzip'
 ZIP_COMMAND = '/usr/bin/zip'
@@ -397,12 +493,33 @@ ZIP_COMMAND = '/usr/bin/zip'
 # The ARK resolvers correspond to the above binders.
 RESOLVER_DOI = 'https://doi.org'
 RESOLVER_ARK = 'https://n2t-stg.n2t.net'
+# Number of candidate identifiers looked up together when resolving a request with a
+# passthrough suffix, after the full identifier is not found. Longer candidates are
+# looked up first.
+RESOLVER_PROBE_SIZE = 16
+# Resolution cache. Max seconds for which a resolved record, or the absence of a match,
+# is reused. Writes through this process drop affected entries immediately, so this is
+# the max staleness after writes by other processes. Set to 0 to disable the cache.
+RESOLVER_CACHE_TTL = 30
+# Max number of cached resolutions per process.
+RESOLVER_CACHE_MAX_SIZE = 10000
 
 # Shoulders
 SHOULDERS_ARK_TEST = 'ark:/99999/fk4'
 SHOULDERS_DOI_TEST = 'doi:10.5072/FK2'
 SHOULDERS_CROSSREF_TEST = 'doi:10.15697/'
 SHOULDERS_AGENT = 'ark:/99166/p9'
+# Seconds after which the in-memory shoulder cache used for longest-prefix matching is
+# reloaded, picking up shoulder changes made by other processes.
+SHOULDER_CACHE_TTL = 60
+
+# Minters
+# Number of spings reserved per minter in each process when minting. Values larger than
+# 1 advance the minter state by this many steps in one locked transaction, and hand out
+# the spings from a per-process pool, in the order in which they were minted. Spings
+# still in the pool when a process exits are not reissued, leaving gaps in the
+# sequence. 1 disables the reservation, and each minted ID updates the minter state.
+MINTER_RESERVATION_SIZE = 1
 
 TEST_SHOULDER_DICT = [
     {"namespace": 'ARK Test', "prefix": 'ark:/99999/fk4'},
@@ -426,6 +543,9 @@ DATACITE_METADATA_URL = 'https://mds.datacite.org/metadata'
 DATACITE_NUM_ATTEMPTS = 3
 DATACITE_REATTEMPT_DELAY = 5
 DATACITE_TIMEOUT = 60
+# Maximum number of connections to the DataCite MDS kept alive for reuse by each process.
+# Should be at least the number of DataCite requests the process performs concurrently.
+DATACITE_HTTP_POOL_SIZE = 10
 DATACITE_PING_DOI = '10.5060/D2_EZID_STATUS_CHECK'
 DATACITE_PING_DATACENTER = 'CDL.CDL'
 DATACITE_PING_TARGET = 'http://ezid.cdlib.org/'
@@ -6,6 +6,7 @@ import bz2
 import collections
 import csv
 import datetime
+import importlib
 import io
 import json
 import logging
@@ -39,6 +40,7 @@ import ezidapp.models.util
 import impl.nog_sql.filesystem
 import impl.nog_sql.ezid_minter
 import impl.nog_sql.shoulder
+import impl.resolver
 import tests.util.metadata_generator
 import tests.util.sample
 import tests.util.util
@@ -276,6 +278,22 @@ def django_db_setup(django_db_keepdb):
     }
 
 
+@pytest.fixture(autouse=True)
+def clear_shoulder_cache():
+    """Discard shoulders cached by previous tests
+
+    Rolling back a test's transaction does not send the signals that normally clear the
+    cache.
+    """
+    ezidapp.models.shoulder.clearShoulderCache()
+
+
+@pytest.fixture(autouse=True)
+def clear_resolution_cache():
+    """Discard resolutions cached by previous tests"""
+    impl.resolver.resolution_cache.clear()
+
+
 @pytest.fixture(autouse=True)
 def disable_log_setup(mocker):
     """Prevent management commands from reconfiguring the logging that has been
@@ -551,6 +569,27 @@ def block_outgoing(mocker):
     mocker.patch('ezidapp.management.commands.proc_base.AsyncProcessingCommand.callWrapper')
 
 
+@pytest.fixture()
+def proc_command():
+    """Return a function that creates the Command of a management command, such as
+    'proc-stats', without running its __init__(), so that its methods can be tested
+    directly. Keyword arguments are set as attributes on the command.
+    """
+
+    def create(command_name, **attr_dict):
+        command_class = importlib.import_module(
+            f'ezidapp.management.commands.{command_name}'
+        ).Command
+        command = command_class.__new__(command_class)
+        command.log = logging.getLogger(command_name)
+        command._terminated = False
+        for k, v in attr_dict.items():
+            setattr(command, k, v)
+        return command
+
+    return create
+
+
 @pytest.fixture()
 def registration_queue(request):
     """BinderQueue populated with tasks marked as not yet processed"""
@@ -42,3 +42,17 @@ def test_existing(val,expected):
     res = call_resolve(val)
     assert res['status'] == expected[0]
     assert res['location'] == expected[1]
+
+
+def test_not_modified():
+    client = django.test.client.Client()
+    response = client.get("/ark:/99166/p3wp9v205")
+    assert response.status_code == 302
+    last_modified = response.headers["Last-Modified"]
+    response = client.get("/ark:/99166/p3wp9v205", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    assert response.headers["Last-Modified"] == last_modified
+    response = client.get(
+        "/ark:/99166/p3wp9v205", headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"}
+    )
+    assert response.status_code == 302
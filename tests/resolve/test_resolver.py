@@ -2,6 +2,7 @@ import logging
 import pytest
 import impl.resolver
 import ezidapp.models.identifier
+import ezidapp.models.shoulder
 
 _L = logging.getLogger("test_resolver")
 
@@ -232,3 +233,81 @@ def test_findshoulders(val, expected):
         return
     except Exception as e:
         assert isinstance(e, expected.__class__)
+
+
+@pytest.mark.parametrize(
+    "val,expected",
+    [
+        ("ark:/88122/zqfw0190", ("ark:/88122/zqfw0190", 1)),
+        ("ark:/88122/zqfw0190_extra", ("ark:/88122/zqfw0190", 2)),
+        ("ark:/88122/zqfw0190/a/long/passthrough/suffix", ("ark:/88122/zqfw0190", 3)),
+    ],
+)
+def test_resolve_lookups(val, expected):
+    pid_info = impl.resolver.IdentifierParser.parse(val)
+    res = pid_info.find_record()
+    assert res.identifier == expected[0]
+    assert pid_info.lookups == expected[1]
+
+
+def test_resolution_cache():
+    cache = impl.resolver.ResolutionCache()
+    pid_info = impl.resolver.IdentifierParser.parse("ark:/88122/zqfw0190_extra")
+    assert cache.find_record(pid_info).identifier == "ark:/88122/zqfw0190"
+    assert pid_info.lookups == 2
+    pid_info = impl.resolver.IdentifierParser.parse("ark:/88122/zqfw0190_extra")
+    assert cache.find_record(pid_info).identifier == "ark:/88122/zqfw0190"
+    assert pid_info.lookups == 0
+    assert pid_info.extra == "_extra"
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.invalidate(["ark:/88122/zqfw0190_"])
+    pid_info = impl.resolver.IdentifierParser.parse("ark:/88122/zqfw0190_extra")
+    cache.find_record(pid_info)
+    assert pid_info.lookups == 2
+    pid_info = impl.resolver.IdentifierParser.parse("ark:/88122/none")
+    with pytest.raises(ezidapp.models.identifier.Identifier.DoesNotExist):
+        cache.find_record(pid_info)
+    with pytest.raises(ezidapp.models.identifier.Identifier.DoesNotExist):
+        cache.find_record(pid_info)
+    assert pid_info.lookups == 2
+
+
+def test_resolution_cache_invalidate(settings):
+    """Invalidating drops the entries whose keys start with an identifier, and no
+    others"""
+    settings.RESOLVER_CACHE_MAX_SIZE = 4
+    cache = impl.resolver.ResolutionCache()
+    keys = ["ark:/99999/fk4a", "ark:/99999/fk4ab", "ark:/99999/fk4b", "ark:/99999/fk4"]
+    for key in keys + ["ark:/99999/fk4c"]:
+        cache._add(key, None)
+    # the least recently used entry was evicted
+    assert cache._keys == [
+        "ark:/99999/fk4", "ark:/99999/fk4ab", "ark:/99999/fk4b", "ark:/99999/fk4c"
+    ]
+    cache.invalidate(["ark:/99999/fk4a", "ark:/99999/fk4b/", "ark:/99999/fk4c"])
+    assert cache._keys == ["ark:/99999/fk4", "ark:/99999/fk4b"]
+    assert list(cache._entries) == ["ark:/99999/fk4b", "ark:/99999/fk4"]
+
+
+def test_find_shoulder_lowercase_doi():
+    """A DOI given with a lowercase suffix finds its shoulder"""
+    s = ezidapp.models.shoulder.Shoulder.objects.filter(
+        prefix__startswith='doi:', prefix__regex='[A-Z]'
+    ).first()
+    pid_info = impl.resolver.IdentifierParser.parse(s.prefix.lower() + 'x1')
+    assert pid_info.find_shoulder() == s
+
+
+def test_resolution_cache_doi_case():
+    """An entry for a DOI requested in lowercase is dropped when the DOI, which is
+    stored upper-cased, is updated"""
+    cache = impl.resolver.ResolutionCache()
+    pid_info = impl.resolver.IdentifierParser.parse("doi:10.18739/a2fr62")
+    try:
+        cache.find_record(pid_info)
+    except ezidapp.models.identifier.Identifier.DoesNotExist:
+        pass
+    assert cache._keys == ["doi:10.18739/A2FR62"]
+    cache.invalidate(["doi:10.18739/A2FR62"])
+    assert cache._keys == []
+    assert not cache._entries
@@ -5,6 +5,8 @@ import logging
 
 import freezegun
 
+import ezidapp.models.async_queue
+import ezidapp.models.identifier
 import impl.datacite
 import impl.util
 import tests.util.anvl
@@ -289,3 +291,111 @@ class TestAPI:
         # Described initially in test_1030 but not yet implemented - 2025-06-10, jjiang
 
         pass
+
+    def test_1040(
+        self,
+        apitest_client,
+        apitest_minter,
+    ):
+        """
+        Mint a batch of identifiers:
+          POST /shoulder/{shoulder}?count={N}   [authentication required]
+          request body: optional sequence of N metadata records
+          response body: status line, followed by one status line per identifier
+        """
+        data_str = ''.join(
+            f':: {i}\nerc.who: Proust, Marcel\nerc.what: Title {i}\n\n' for i in range(3)
+        )
+        r = apitest_client.post(
+            "/shoulder/{}?count=3".format(tests.util.util.encode(apitest_minter)),
+            data=data_str.encode('utf-8'),
+            content_type="text/plain; charset=utf-8",
+        )
+        assert r.status_code == 200
+        line_list = b''.join(r.streaming_content).decode('utf-8').splitlines()
+        assert line_list[0] == 'success: minting 3 identifiers'
+        assert len(line_list) == 4
+        minted_id_list = []
+        for line in line_list[1:]:
+            assert line.startswith(f'success: {apitest_minter}'), line
+            minted_id_list.append(line.split(':', 1)[1].strip())
+        assert len(set(minted_id_list)) == 3
+
+        for i, minted_id in enumerate(minted_id_list):
+            si = ezidapp.models.identifier.Identifier.objects.get(identifier=minted_id)
+            assert si.metadata['erc.what'] == f'Title {i}'
+            assert ezidapp.models.async_queue.SearchIndexerQueue.objects.filter(
+                refIdentifier__identifier=minted_id
+            ).exists()
+
+        # The number of records must match 'count'
+        r = apitest_client.post(
+            "/shoulder/{}?count=2".format(tests.util.util.encode(apitest_minter)),
+            data=data_str.encode('utf-8'),
+            content_type="text/plain; charset=utf-8",
+        )
+        assert r.status_code == 400
+
+        # Errors that affect the whole batch are reported before any status lines
+        r = apitest_client.post(
+            "/shoulder/{}?count=3".format(tests.util.util.encode('ark:/99999/nosuch')),
+            data=data_str.encode('utf-8'),
+            content_type="text/plain; charset=utf-8",
+        )
+        assert r.status_code == 400
+        assert r.content.decode('utf-8') == 'error: bad request - no such shoulder'
+
+    def test_1050(
+        self,
+        apitest_client,
+        apitest_minter,
+    ):
+        """
+        Create and update a batch of identifiers:
+          PUT /id/   [authentication required]
+          POST /id/   [authentication required]
+          request body: sequence of metadata records, each starting with a
+            ":: {identifier}" header line
+          response body: status line, followed by one status line per record
+        """
+        id_list = [f'{apitest_minter}batch{i}' for i in range(3)]
+        data_str = ''.join(f':: {id_str}\nerc.what: Title {id_str}\n\n' for id_str in id_list)
+        # The first identifier is repeated, so must fail as already existing
+        data_str += f':: {id_list[0]}\nerc.what: Repeated\n'
+        r = apitest_client.put(
+            "/id/",
+            data=data_str.encode('utf-8'),
+            content_type="text/plain; charset=utf-8",
+        )
+        assert r.status_code == 200
+        line_list = b''.join(r.streaming_content).decode('utf-8').splitlines()
+        assert line_list == [
+            'success: creating 4 identifiers',
+            *[f'success: {id_str}' for id_str in id_list],
+            'error: bad request - identifier already exists, cannot create',
+        ]
+        for id_str in id_list:
+            si = ezidapp.models.identifier.Identifier.objects.get(identifier=id_str)
+            assert si.metadata['erc.what'] == f'Title {id_str}'
+
+        data_str = ''.join(f':: {id_str}\nerc.who: Updated\n\n' for id_str in id_list)
+        data_str += f':: {apitest_minter}batch-missing\nerc.who: Updated\n'
+        r = apitest_client.post(
+            "/id/",
+            data=data_str.encode('utf-8'),
+            content_type="text/plain; charset=utf-8",
+        )
+        assert r.status_code == 200
+        line_list = b''.join(r.streaming_content).decode('utf-8').splitlines()
+        assert line_list == [
+            'success: updating 4 identifiers',
+            *[f'success: {id_str}' for id_str in id_list],
+            'error: bad request - no such identifier',
+        ]
+        for id_str in id_list:
+            si = ezidapp.models.identifier.Identifier.objects.get(identifier=id_str)
+            assert si.metadata['erc.who'] == 'Updated'
+            assert si.metadata['erc.what'] == f'Title {id_str}'
+            assert ezidapp.models.async_queue.SearchIndexerQueue.objects.filter(
+                refIdentifier__identifier=id_str, operation='U'
+            ).exists()
@@ -30,4 +30,34 @@ def test_content_type_1(factory, val, expected):
     request = factory.post('/shoulder/ark:/99999/fk4', content_type=val)
     ret = api.is_text_plain_utf8(request)
     assert ret == expected
-        
\ No newline at end of file
+        
+
+def test_read_records_1(factory):
+    body = (
+        ":: rec1\n"
+        "erc.who: Proust, Marcel\n"
+        "erc.what: %41 title\n"
+        "\n"
+        ":: rec2\n"
+        "::\n"
+        "_target: https://example.org\n"
+    )
+    request = factory.post(
+        '/shoulder/ark:/99999/fk4?count=3', data=body, content_type='text/plain; charset=utf-8'
+    )
+    ret = api._readRecords(request)
+    assert ret == [
+        ('rec1', {'erc.who': 'Proust, Marcel', 'erc.what': 'A title'}),
+        ('rec2', {}),
+        ('', {'_target': 'https://example.org'}),
+    ]
+
+
+def test_read_records_2(factory):
+    request = factory.post(
+        '/shoulder/ark:/99999/fk4?count=1',
+        data='erc.who: Proust, Marcel\n',
+        content_type='text/plain; charset=utf-8',
+    )
+    ret = api._readRecords(request)
+    assert ret == 'error: bad request - ANVL parse error (no record header)'
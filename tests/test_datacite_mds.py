@@ -0,0 +1,54 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test the DataCite MDS client in impl.datacite against a stub MDS server
+"""
+
+import pytest
+
+import impl.datacite
+import tests.util.mds_stub
+
+DOI = '10.5072/FK2TEST'
+DATACENTER = 'CDL.CDL'
+METADATA = {
+    'datacite.title': 'Test title',
+    'datacite.creator': 'Test creator',
+    'datacite.publisher': 'Test publisher',
+    'datacite.publicationyear': '2021',
+}
+
+
+@pytest.fixture
+def mds(settings, monkeypatch):
+    server = tests.util.mds_stub.MdsStubServer().start()
+    settings.DATACITE_ENABLED = True
+    settings.DATACITE_DOI_URL = f'{server.base_url}/doi'
+    settings.DATACITE_METADATA_URL = f'{server.base_url}/metadata'
+    settings.DATACITE_NUM_ATTEMPTS = 1
+    monkeypatch.setattr(impl.datacite, '_session', None)
+    yield server
+    server.stop()
+
+
+def test_requests(mds):
+    """Requests share a single keep-alive connection"""
+    assert impl.datacite.uploadMetadata(DOI, {}, METADATA, datacenter=DATACENTER) is None
+    assert impl.datacite.setTargetUrl(DOI, 'https://example.org/', DATACENTER) is None
+    assert impl.datacite.getTargetUrl(DOI, DATACENTER) == b'https://example.org/'
+    assert impl.datacite.deactivateIdentifier(DOI, DATACENTER) is None
+    assert DOI in mds.inactive_set
+    assert (mds.connection_count, mds.request_count) == (1, 4)
+
+
+def test_errors(mds):
+    """Rejected target URLs are returned as messages, and unknown DOIs as None"""
+    assert impl.datacite.setTargetUrl(DOI, 'ftp://example.org/', DATACENTER).startswith('[url]')
+    assert impl.datacite.getTargetUrl(DOI, DATACENTER) is None
+
+
+def test_deactivate_without_metadata(mds):
+    """Placeholder metadata is uploaded for DOIs without metadata before deactivating"""
+    assert impl.datacite.deactivateIdentifier(DOI, DATACENTER) is None
+    assert '<title>inactive</title>' in mds.metadata_dict[DOI]
+    assert DOI in mds.inactive_set
@@ -8,6 +8,7 @@ import impl.nog_sql.filesystem
 import impl.nog_sql.id_ns
 import impl.nog_sql.ezid_minter
 import ezidapp.models.minter
+import ezidapp.models.shoulder
 
 MINT_COUNT = 1000
 
@@ -110,3 +111,62 @@ class TestEzidMinter:
                 ), "Mismatch after minting {} identifiers. python={} != perl={}".format(
                     i, python_sping, perl_sping
                 )
+
+    def test_1020(self, test_docs, settings, django_capture_on_commit_callbacks):
+        """Minting from reserved blocks yields the same identifiers, in the same
+        order, as minting one identifier per transaction.
+        """
+        minter_file = str(test_docs.joinpath('77913_r7.json'))
+        minter_dict = self._minter_to_dict(minter_file)
+        ezidapp.models.minter.Minter.objects.create(prefix=ID_STR, minterState=minter_dict)
+        shoulder_model = ezidapp.models.shoulder.Shoulder(prefix=ID_STR)
+
+        settings.MINTER_RESERVATION_SIZE = 7
+        impl.nog_sql.ezid_minter.discard_reservations()
+        try:
+            with lzma.open(PERL_MINTED_PATH, 'rt') as f:
+                for i in range(100):
+                    with django_capture_on_commit_callbacks(execute=True):
+                        python_sping = impl.nog_sql.ezid_minter.mint_id(shoulder_model)
+                    perl_sping = f.readline().strip()
+                    assert (
+                        perl_sping == python_sping
+                    ), "Mismatch after minting {} identifiers. python={} != perl={}".format(
+                        i, python_sping, perl_sping
+                    )
+            # 100 IDs minted from blocks of 7 leaves 5 reserved IDs in the pool
+            assert impl.nog_sql.ezid_minter.get_reservation_status() == {ID_STR: 5}
+            minter_model = ezidapp.models.minter.Minter.objects.get(prefix=ID_STR)
+            assert int(minter_model.minterState['oacounter']) == (
+                int(minter_dict['oacounter']) + 105
+            )
+        finally:
+            impl.nog_sql.ezid_minter.discard_reservations()
+
+    def test_1030(self, test_docs, settings, django_capture_on_commit_callbacks):
+        """Reserved blocks are handed out in the order in which they were minted, even
+        if the transactions that reserved them commit in the opposite order.
+        """
+        minter_file = str(test_docs.joinpath('77913_r7.json'))
+        minter_dict = self._minter_to_dict(minter_file)
+        ezidapp.models.minter.Minter.objects.create(prefix=ID_STR, minterState=minter_dict)
+        shoulder_model = ezidapp.models.shoulder.Shoulder(prefix=ID_STR)
+
+        settings.MINTER_RESERVATION_SIZE = 3
+        impl.nog_sql.ezid_minter.discard_reservations()
+        try:
+            with lzma.open(PERL_MINTED_PATH, 'rt') as f:
+                perl_sping_list = [f.readline().strip() for _ in range(6)]
+            with django_capture_on_commit_callbacks() as callbacks_1:
+                python_sping_list = [impl.nog_sql.ezid_minter.mint_id(shoulder_model)]
+            with django_capture_on_commit_callbacks() as callbacks_2:
+                python_sping_list.append(impl.nog_sql.ezid_minter.mint_id(shoulder_model))
+            for callback in callbacks_2 + callbacks_1:
+                callback()
+            assert impl.nog_sql.ezid_minter.get_reservation_status() == {ID_STR: 4}
+            for _ in range(4):
+                python_sping_list.append(impl.nog_sql.ezid_minter.mint_id(shoulder_model))
+            assert python_sping_list == [perl_sping_list[i] for i in (0, 3, 1, 2, 4, 5)]
+            assert impl.nog_sql.ezid_minter.get_reservation_status() == {}
+        finally:
+            impl.nog_sql.ezid_minter.discard_reservations()
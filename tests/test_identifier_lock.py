@@ -0,0 +1,112 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test impl.identifier_lock
+"""
+
+import time
+
+import pytest
+
+import ezidapp.models.identifier_lock
+import impl.identifier_lock
+
+
+@pytest.fixture(params=['local', 'database'])
+def lock_manager(request, db, settings):
+    settings.MAX_CONCURRENT_OPERATIONS_PER_USER = 1
+    settings.MAX_THREADS_PER_USER = 1
+    if request.param == 'local':
+        return impl.identifier_lock.LocalLockManager()
+    return impl.identifier_lock.DatabaseLockManager()
+
+
+class TestIdentifierLock:
+    def test_1000(self, lock_manager):
+        """Locks are counted per user, and the throttle rejects operations over the
+        limit without waiting.
+        """
+        assert lock_manager.acquire({'ark:/99999/a1', 'ark:/99999/a2'}, 'user1')
+        assert lock_manager.acquire({'ark:/99999/b1'}, 'user2')
+        assert lock_manager.getStatus() == ({'user1': 1, 'user2': 1}, {}, False)
+        assert not lock_manager.acquire({'ark:/99999/a3'}, 'user1')
+        lock_manager.release({'ark:/99999/a1', 'ark:/99999/a2'}, 'user1')
+        assert lock_manager.getStatus() == ({'user2': 1}, {}, False)
+        assert lock_manager.acquire({'ark:/99999/a1'}, 'user1')
+        lock_manager.release({'ark:/99999/a1'}, 'user1')
+        lock_manager.release({'ark:/99999/b1'}, 'user2')
+        assert lock_manager.getStatus() == ({}, {}, False)
+
+    def test_1010(self, lock_manager):
+        """pause() returns the previous value of the paused flag"""
+        assert lock_manager.pause(True) is False
+        assert lock_manager.getStatus() == ({}, {}, True)
+        assert lock_manager.pause(False) is True
+        assert lock_manager.getStatus() == ({}, {}, False)
+
+    def test_1020(self, db, settings):
+        """Locks with expired leases, left by workers that died, are released"""
+        settings.MAX_CONCURRENT_OPERATIONS_PER_USER = 1
+        ezidapp.models.identifier_lock.IdentifierLock.objects.create(
+            identifier='ark:/99999/a1',
+            username='user1',
+            operationId='0' * 32,
+            worker='otherhost:1',
+            leaseExpires=int(time.time()) - 1,
+        )
+        lock_manager = impl.identifier_lock.DatabaseLockManager()
+        assert lock_manager.getStatus() == ({}, {}, False)
+        assert lock_manager.acquire({'ark:/99999/a1'}, 'user1')
+        assert lock_manager.getStatus() == ({'user1': 1}, {}, False)
+        lock_manager.release({'ark:/99999/a1'}, 'user1')
+        assert not ezidapp.models.identifier_lock.IdentifierLock.objects.exists()
+
+    def test_1030(self, lock_manager):
+        """An operation on no identifiers counts against the throttle"""
+        assert lock_manager.acquire(set(), 'user1')
+        assert lock_manager.getStatus() == ({'user1': 1}, {}, False)
+        assert not lock_manager.acquire(set(), 'user1')
+        lock_manager.release(set(), 'user1')
+        assert lock_manager.getStatus() == ({}, {}, False)
+        assert lock_manager.acquire(set(), 'user1')
+        lock_manager.release(set(), 'user1')
+
+    def test_1040(self, db, settings):
+        """The leases of held locks are renewed, and an operation that finds its
+        identifiers locked after inserting its locks removes them"""
+        lock_manager = impl.identifier_lock.DatabaseLockManager()
+        qs = ezidapp.models.identifier_lock.IdentifierLock.objects
+        assert lock_manager.acquire({'ark:/99999/a1'}, 'user1')
+        qs.update(leaseExpires=int(time.time()) + 1)
+        lock_manager._renewLeases()
+        assert qs.get().leaseExpires >= int(time.time()) + settings.IDENTIFIER_LOCK_LEASE - 1
+
+        # Another operation locks the identifier between the checks of user2
+        isLockedList = [False, True, False, False]
+        lock_manager._isLocked = lambda *args: isLockedList.pop(0)
+        lock_manager.release({'ark:/99999/a1'}, 'user1')
+        assert lock_manager.acquire({'ark:/99999/a1'}, 'user2')
+        assert not isLockedList
+        assert qs.filter(username='user2').count() == 1
+        lock_manager.release({'ark:/99999/a1'}, 'user2')
+        assert not qs.exists()
+
+    def test_1050(self, db, settings):
+        """Rows with expired leases are purged at most once per lease period, and are
+        ignored until then"""
+        settings.MAX_CONCURRENT_OPERATIONS_PER_USER = 1
+        lock_manager = impl.identifier_lock.DatabaseLockManager()
+        assert lock_manager.acquire({'ark:/99999/a1'}, 'user1')
+        lock_manager.release({'ark:/99999/a1'}, 'user1')
+        ezidapp.models.identifier_lock.IdentifierLock.objects.create(
+            identifier='ark:/99999/a1',
+            username='user1',
+            operationId='0' * 32,
+            worker='otherhost:1',
+            leaseExpires=int(time.time()) - 1,
+        )
+        assert lock_manager.acquire({'ark:/99999/a1'}, 'user1')
+        assert ezidapp.models.identifier_lock.IdentifierLock.objects.filter(
+            operationId='0' * 32
+        ).exists()
+        lock_manager.release({'ark:/99999/a1'}, 'user1')
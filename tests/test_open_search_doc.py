@@ -4,6 +4,7 @@ from unittest.mock import MagicMock
 from ezidapp.models.identifier import Identifier
 from ezidapp.models.identifier import SearchIdentifier
 from impl.open_search_doc import OpenSearchDoc
+from opensearchpy.exceptions import NotFoundError
 from unittest.mock import patch
 
 
@@ -288,3 +289,125 @@ def test_update_link_issues(mock_client, open_search_doc):
     )
     assert result is True
 
+
+
+@patch('impl.open_search_doc.OpenSearchDoc.CLIENT')
+def test_bulk_index(mock_client, open_search_doc):
+    mock_client.bulk.return_value = {'errors': True, 'items': [
+        {'index': {'_id': 'doi:10.25338/B8JG7X', 'status': 201, 'result': 'created'}},
+        {'delete': {'_id': 'ark:/99999/fk4gone', 'status': 404, 'result': 'not_found'}},
+        {'delete': {'_id': 'ark:/99999/fk4bad', 'status': 429,
+                    'error': {'type': 'es_rejected_execution_exception', 'reason': 'queue full'}}},
+    ]}
+
+    result = OpenSearchDoc.bulk_index(
+        index_docs=[open_search_doc],
+        remove_identifiers=['ark:/99999/fk4gone', 'ark:/99999/fk4bad'],
+    )
+
+    body = mock_client.bulk.call_args.kwargs['body']
+    assert body[0] == {'index': {'_index': 'ezid-test-index', '_id': 'doi:10.25338/B8JG7X'}}
+    assert body[1]['id'] == 'doi:10.25338/B8JG7X'
+    assert body[2] == {'delete': {'_index': 'ezid-test-index', '_id': 'ark:/99999/fk4gone'}}
+    assert result == {
+        'doi:10.25338/B8JG7X': None,
+        'ark:/99999/fk4gone': None,
+        'ark:/99999/fk4bad':
+            'Error delete in OpenSearch: es_rejected_execution_exception: queue full',
+    }
+
+
+def test_search_identifier_passed_in():
+    identifier = MagicMock(spec=Identifier)
+    search_identifier = MagicMock(spec=SearchIdentifier)
+    with patch('ezidapp.models.identifier.SearchIdentifier.objects.get') as mock_get:
+        doc = OpenSearchDoc(identifier=identifier, search_identifier=search_identifier)
+        assert doc.search_identifier is search_identifier
+        doc = OpenSearchDoc(identifier=identifier, search_identifier=None)
+        assert doc.search_identifier is None
+    mock_get.assert_not_called()
+
+
+@patch('impl.open_search_doc.OpenSearchDoc.CLIENT')
+def test_bulk_index_rebuild(mock_client, open_search_doc, monkeypatch):
+    """While the index is rebuilt, writes go to both indexes, and only the live index
+    determines the result"""
+    monkeypatch.setattr(OpenSearchDoc, '_rebuild_indexes', (['ezid-test-index-new'], float('inf')))
+    mock_client.bulk.return_value = {'errors': True, 'items': [
+        {'index': {'_id': 'doi:10.25338/B8JG7X', 'status': 200, 'result': 'updated'}},
+        {'index': {'_id': 'doi:10.25338/B8JG7X', 'status': 429, 'error': 'rejected'}},
+    ]}
+
+    result = OpenSearchDoc.bulk_index(index_docs=[open_search_doc])
+
+    body = mock_client.bulk.call_args.kwargs['body']
+    indexes = [list(action.values())[0]['_index'] for action in body[::2]]
+    assert indexes == ['ezid-test-index', 'ezid-test-index-new']
+    assert result == {'doi:10.25338/B8JG7X': None}
+
+
+@patch('impl.open_search_doc.OpenSearchDoc.CLIENT')
+def test_bulk_index_create(mock_client, open_search_doc):
+    """When loading a new index, documents that already exist are left alone"""
+    mock_client.bulk.return_value = {'errors': True, 'items': [
+        {'create': {'_id': 'doi:10.25338/B8JG7X', 'status': 409, 'error': {
+            'type': 'version_conflict_engine_exception', 'reason': 'document already exists'
+        }}},
+    ]}
+
+    result = OpenSearchDoc.bulk_index(
+        index_docs=[open_search_doc], index='ezid-test-index-new', op_type='create'
+    )
+
+    body = mock_client.bulk.call_args.kwargs['body']
+    assert body[0] == {'create': {'_index': 'ezid-test-index-new', '_id': 'doi:10.25338/B8JG7X'}}
+    assert len(body) == 2
+    assert result == {'doi:10.25338/B8JG7X': None}
+
+
+@patch('impl.open_search_doc.OpenSearchDoc.CLIENT')
+def test_bulk_index_build_error(mock_client, open_search_doc):
+    """A document that cannot be built fails alone, and is not sent"""
+    mock_client.bulk.return_value = {'errors': False, 'items': [
+        {'delete': {'_id': 'ark:/99999/fk4gone', 'status': 200, 'result': 'deleted'}},
+    ]}
+
+    with patch.object(
+        open_search_doc, 'dict_for_identifier', side_effect=ValueError('bad metadata')
+    ):
+        result = OpenSearchDoc.bulk_index(
+            index_docs=[open_search_doc], remove_identifiers=['ark:/99999/fk4gone']
+        )
+
+    assert len(mock_client.bulk.call_args.kwargs['body']) == 1
+    assert result == {
+        'doi:10.25338/B8JG7X': 'Error building OpenSearch document: bad metadata',
+        'ark:/99999/fk4gone': None,
+    }
+
+
+@patch('impl.open_search_doc.OpenSearchDoc.CLIENT')
+def test_rebuild_tombstones(mock_client, open_search_doc, monkeypatch):
+    """While the index is rebuilt, deletes, and updates of documents not yet loaded,
+    leave tombstones in the new index, so that the load does not bring back stale
+    documents"""
+    monkeypatch.setattr(OpenSearchDoc, '_rebuild_indexes', (['ezid-test-index-new'], float('inf')))
+    mock_client.bulk.return_value = {'errors': False, 'items': [
+        {'delete': {'_id': 'ark:/99999/fk4gone', 'status': 200, 'result': 'deleted'}},
+        {'index': {'_id': 'ark:/99999/fk4gone', 'status': 201, 'result': 'created'}},
+    ]}
+    result = OpenSearchDoc.bulk_index(remove_identifiers=['ark:/99999/fk4gone'])
+    assert result == {'ark:/99999/fk4gone': None}
+    assert mock_client.bulk.call_args.kwargs['body'] == [
+        {'delete': {'_index': 'ezid-test-index', '_id': 'ark:/99999/fk4gone'}},
+        {'index': {'_index': 'ezid-test-index-new', '_id': 'ark:/99999/fk4gone'}},
+        OpenSearchDoc.REBUILD_TOMBSTONE,
+    ]
+
+    mock_client.update.side_effect = [
+        NotFoundError(404, 'document_missing_exception'), {'result': 'updated'}
+    ]
+    assert open_search_doc.update_link_issues(link_is_broken=True) is True
+    mock_client.index.assert_called_once_with(
+        index='ezid-test-index-new', id='doi:10.25338/B8JG7X', body=OpenSearchDoc.REBUILD_TOMBSTONE
+    )
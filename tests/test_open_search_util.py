@@ -0,0 +1,160 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test impl.open_search_util
+"""
+
+import base64
+import json
+from unittest.mock import patch
+
+import django.core.exceptions
+import django.test
+import pytest
+
+import impl.open_search_util
+import impl.ui_search
+
+
+@pytest.fixture
+def total_cache(settings):
+    settings.SEARCH_TOTAL_CACHE_TTL = 60
+    impl.open_search_util.total_cache.clear()
+    yield impl.open_search_util.total_cache
+    impl.open_search_util.total_cache.clear()
+
+
+def _search_result(total=None):
+    hit = {
+        '_index': 'ezid-test-index',
+        '_id': 'ark:/99999/fk4a',
+        '_source': {'id': 'ark:/99999/fk4a'},
+    }
+    hits = {'hits': [hit]}
+    if total is not None:
+        hits['total'] = {'value': total, 'relation': 'eq'}
+    return {'took': 3, 'timed_out': False, 'hits': hits}
+
+
+@patch('impl.open_search_util.client')
+def test_search_with_total(mock_client, total_cache):
+    """The total is counted with the first page, and reused for the following pages"""
+    constraints = {'owner': 'apitest', 'keywords': 'california'}
+    mock_client.search.return_value = _search_result(total=1234)
+
+    response, total = impl.open_search_util.executeSearchWithTotal(None, constraints, 0, 10)
+
+    assert total == 1234
+    assert len(response.hits) == 1
+    body = mock_client.search.call_args.kwargs['body']
+    assert body['track_total_hits'] is True
+    assert (body['from'], body['size']) == (0, 10)
+
+    mock_client.search.return_value = _search_result()
+    response, total = impl.open_search_util.executeSearchWithTotal(
+        None, {'keywords': 'california', 'owner': 'apitest'}, 10, 20
+    )
+
+    assert total == 1234
+    assert mock_client.search.call_count == 2
+    body = mock_client.search.call_args.kwargs['body']
+    assert body['track_total_hits'] is False
+    assert (body['from'], body['size']) == (10, 10)
+
+    # Another owner scope is counted separately
+    assert total_cache.get({'owner': 'other', 'keywords': 'california'}) is None
+
+
+def test_formulate_sort():
+    """The identifier is added as a tiebreaker, and reversing reverses the whole order"""
+    assert impl.open_search_util.formulate_sort('-updateTime') == [
+        {'update_time': {'order': 'desc', 'missing': '_last'}},
+        {'searchable_id': {'order': 'asc', 'missing': '_last'}},
+    ]
+    assert impl.open_search_util.formulate_sort('-updateTime', reverse=True) == [
+        {'update_time': {'order': 'asc', 'missing': '_first'}},
+        {'searchable_id': {'order': 'desc', 'missing': '_first'}},
+    ]
+    assert impl.open_search_util.formulate_sort('identifier') == [
+        {'searchable_id': {'order': 'asc', 'missing': '_last'}},
+    ]
+
+
+@patch('impl.open_search_util.client')
+def test_search_after(mock_client, total_cache):
+    """Pages are selected by search_after in a point in time, and reversed pages are
+    returned in order"""
+    mock_client.create_pit.return_value = {'pit_id': 'pit-1'}
+    result = _search_result(total=20_000)
+    result['pit_id'] = 'pit-2'
+    result['hits']['hits'] = [
+        {
+            '_index': 'ezid-test-index',
+            '_id': f'ark:/99999/fk4{c}',
+            '_source': {'id': f'ark:/99999/fk4{c}'},
+            'sort': [f'ark:/99999/fk4{c}'],
+        }
+        for c in 'cba'
+    ]
+    mock_client.search.return_value = result
+
+    hits, total, pit = impl.open_search_util.executeSearchAfter(
+        None, {'owner': 'apitest'}, 3, 'identifier', ['ark:/99999/fk4d'], reverse=True
+    )
+
+    assert [hit['id'] for hit in hits] == ['ark:/99999/fk4a', 'ark:/99999/fk4b', 'ark:/99999/fk4c']
+    assert (total, pit) == (20_000, 'pit-2')
+    kwargs = mock_client.search.call_args.kwargs
+    assert kwargs.get('index') is None
+    assert kwargs['body']['pit'] == {'id': 'pit-1', 'keep_alive': '10m'}
+    assert kwargs['body']['search_after'] == ['ark:/99999/fk4d']
+    assert kwargs['body']['size'] == 3
+    assert kwargs['body']['sort'] == [{'searchable_id': {'order': 'desc', 'missing': '_first'}}]
+
+
+@pytest.mark.parametrize(
+    'cursor',
+    (
+        {'size': 10_001},
+        {'size': 0},
+        {'size': True},
+        {'rev': 'yes'},
+        {'pit': ['pit-1']},
+        {'after': 'ark:/99999/fk4a'},
+    ),
+)
+def test_decode_cursor_invalid(cursor):
+    """Cursors that do not fit the search are rejected"""
+    cursor = {'q': 'key', 'p': 1001, 'size': 10, 'after': None, 'rev': True, 'pit': None, **cursor}
+    with pytest.raises(django.core.exceptions.BadRequest):
+        impl.ui_search._decodeCursor(_encode(cursor), 'key', 10)
+    with pytest.raises(django.core.exceptions.BadRequest):
+        impl.ui_search._decodeCursor('not a cursor', 'key', 10)
+
+
+def test_decode_cursor():
+    s = impl.ui_search._encodeCursor('key', 1001, 10, ['ark:/99999/fk4a'], False, 'pit-1')
+    assert impl.ui_search._decodeCursor(s, 'key', 10)['pit'] == 'pit-1'
+    # a cursor of another search is ignored
+    assert impl.ui_search._decodeCursor(s, 'other', 10) is None
+
+
+@patch('impl.open_search_util.client')
+def test_session_pit(mock_client):
+    """A session has one open PIT, which is closed when it is replaced"""
+    request = django.test.RequestFactory().get('/search')
+    request.session = {}
+    impl.ui_search._setSessionPit(request, 'key', 'pit-1')
+    assert impl.ui_search._sessionPit(request, 'key') == 'pit-1'
+    impl.ui_search._setSessionPit(request, 'key', 'pit-1')
+    mock_client.delete_pit.assert_not_called()
+    impl.ui_search._setSessionPit(request, 'key', 'pit-2')
+    mock_client.delete_pit.assert_called_once_with(body={'pit_id': ['pit-1']})
+    # a new search closes the PIT of the previous one
+    assert impl.ui_search._sessionPit(request, 'other') is None
+    mock_client.delete_pit.assert_called_with(body={'pit_id': ['pit-2']})
+    assert request.session == {}
+
+
+def _encode(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
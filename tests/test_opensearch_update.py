@@ -0,0 +1,72 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test the opensearch-update management command
+"""
+
+import importlib
+import unittest.mock
+
+import ezidapp.models.identifier
+from impl.open_search_doc import OpenSearchDoc
+
+opensearch_update = importlib.import_module('ezidapp.management.commands.opensearch-update')
+
+
+def test_partitions():
+    """The partitions cover the primary key range without gaps or overlaps"""
+    id_list = list(
+        ezidapp.models.identifier.SearchIdentifier.objects.values_list('id', flat=True)
+    )
+    partitions = opensearch_update._partitions(7, 0)
+    assert partitions[0]['lo'] < min(id_list)
+    assert partitions[-1]['hi'] == max(id_list)
+    for p1, p2 in zip(partitions, partitions[1:]):
+        assert p1['hi'] == p2['lo']
+    assert all(p['last_id'] == p['lo'] for p in partitions)
+    assert sum(
+        1 for i in id_list for p in partitions if p['lo'] < i <= p['hi']
+    ) == len(id_list)
+
+
+def test_progress():
+    partitions = [
+        {'lo': 0, 'hi': 100, 'last_id': 100},
+        {'lo': 100, 'hi': 200, 'last_id': 100},
+    ]
+    progress = opensearch_update._Progress(partitions)
+    assert progress.fraction() == 0.5
+    partitions[1]['last_id'] = 150
+    progress.update(40, 1)
+    assert progress.fraction() == 0.75
+    assert '75.0% done, 40 docs (1 errors)' in progress.report()
+
+
+def test_resolve_tombstones():
+    """Tombstones are replaced with the current state of the database, unless they have
+    been overwritten"""
+    si = ezidapp.models.identifier.SearchIdentifier.objects.order_by('id').first()
+    hits = [
+        {'_id': si.identifier, '_seq_no': 5, '_primary_term': 1},
+        {'_id': 'ark:/99999/fk4gone', '_seq_no': 6, '_primary_term': 1},
+    ]
+    with unittest.mock.patch.object(OpenSearchDoc, 'CLIENT') as mock_client, unittest.mock.patch(
+        'opensearchpy.helpers.scan', return_value=iter(hits)
+    ):
+        mock_client.bulk.return_value = {'errors': True, 'items': [
+            {'index': {
+                '_id': si.identifier, 'status': 409, 'error': 'version_conflict_engine_exception'
+            }},
+            {'delete': {'_id': 'ark:/99999/fk4gone', 'status': 200, 'result': 'deleted'}},
+        ]}
+        opensearch_update.Command._resolve_tombstones('ezid-test-index-new', 1000)
+    body = mock_client.bulk.call_args.kwargs['body']
+    assert body[0] == {'index': {
+        '_index': 'ezid-test-index-new', '_id': si.identifier, 'if_seq_no': 5, 'if_primary_term': 1
+    }}
+    assert body[1]['id'] == si.identifier
+    assert body[2] == {'delete': {
+        '_index': 'ezid-test-index-new', '_id': 'ark:/99999/fk4gone', 'if_seq_no': 6,
+        'if_primary_term': 1,
+    }}
+    assert len(body) == 3
@@ -0,0 +1,166 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test the task claiming in the base class of the async processing commands
+"""
+
+import threading
+import time
+
+import ezidapp.models.async_queue
+import ezidapp.models.identifier
+import impl.enqueue
+
+queue = ezidapp.models.async_queue.DataciteQueue
+
+
+def _tasks(si_list):
+    """Create an unsubmitted task for each SearchIdentifier in si_list"""
+    seq_list = []
+    for si in si_list:
+        task = queue.objects.create(
+            refIdentifier=impl.enqueue.create_ref_id_model(si),
+            enqueueTime=int(time.time()),
+            operation=queue.UPDATE,
+            status=queue.UNSUBMITTED,
+        )
+        seq_list.append(task.seq)
+    return seq_list
+
+
+def _qs(seq_list):
+    return (
+        queue.objects.filter(seq__in=seq_list, status=queue.UNSUBMITTED)
+        .select_related('refIdentifier')
+        .order_by('-seq')
+    )
+
+
+def test_claim_tasks(proc_command):
+    """Workers claim disjoint sets of tasks, and expired leases are reclaimed"""
+    si_list = ezidapp.models.identifier.SearchIdentifier.objects.order_by('identifier')[:4]
+    seq_list = _tasks(si_list)
+    worker1 = proc_command('proc-datacite', lease_owner=lambda: 'host:1:1')
+    worker2 = proc_command('proc-datacite', lease_owner=lambda: 'host:2:1')
+
+    claimed1 = worker1.claim_tasks(_qs(seq_list), 3)
+    claimed2 = worker2.claim_tasks(_qs(seq_list), 3)
+    assert [t.seq for t in claimed1] == sorted(seq_list, reverse=True)[:3]
+    assert [t.seq for t in claimed2] == sorted(seq_list)[:1]
+    assert all(worker1.has_lease(t) for t in claimed1)
+    assert not worker2.claim_tasks(_qs(seq_list), 3)
+
+    queue.objects.filter(seq=claimed1[0].seq).update(leaseExpires=int(time.time()) - 1)
+    assert [t.seq for t in worker2.claim_tasks(_qs(seq_list), 3)] == [claimed1[0].seq]
+
+
+def test_claim_tasks_identifier(proc_command):
+    """Tasks for an identifier on which another worker holds a lease are not claimed"""
+    si = ezidapp.models.identifier.SearchIdentifier.objects.order_by('identifier').first()
+    worker1 = proc_command('proc-datacite', lease_owner=lambda: 'host:1:1')
+    worker2 = proc_command('proc-datacite', lease_owner=lambda: 'host:2:1')
+
+    first_seq, = _tasks([si])
+    assert [t.seq for t in worker1.claim_tasks(_qs([first_seq]), 1)] == [first_seq]
+    second_seq, = _tasks([si])
+    assert not worker2.claim_tasks(_qs([second_seq]), 1)
+    task = queue.objects.get(seq=second_seq)
+    assert (task.status, task.leaseOwner) == (queue.UNSUBMITTED, '')
+
+
+def test_save_task(proc_command):
+    """Saving a task releases its lease, unless the task was claimed by another worker"""
+    si_list = ezidapp.models.identifier.SearchIdentifier.objects.order_by('identifier')[:2]
+    first_seq, second_seq = _tasks(si_list)
+    worker1 = proc_command('proc-datacite', lease_owner=lambda: 'host:1:1')
+    worker2 = proc_command('proc-datacite', lease_owner=lambda: 'host:2:1')
+
+    task = worker1.claim_tasks(_qs([first_seq]), 1)[0]
+    task.status = queue.SUCCESS
+    worker1.save_task(task)
+    task = queue.objects.get(seq=first_seq)
+    assert (task.status, task.leaseOwner, task.leaseExpires) == (queue.SUCCESS, '', 0)
+
+    task = worker1.claim_tasks(_qs([second_seq]), 1)[0]
+    queue.objects.filter(seq=second_seq).update(leaseExpires=int(time.time()) - 1)
+    worker2.claim_tasks(_qs([second_seq]), 1)
+    task.status = queue.SUCCESS
+    worker1.save_task(task)
+    task = queue.objects.get(seq=second_seq)
+    assert (task.status, task.leaseOwner) == (queue.UNSUBMITTED, 'host:2:1')
+
+
+def test_save_task_list(django_assert_num_queries, proc_command):
+    """Tasks are saved with a single query, except those whose status needs an immediate
+    write, and tasks claimed by another worker are not saved"""
+    si_list = ezidapp.models.identifier.SearchIdentifier.objects.order_by('identifier')[:3]
+    seq_list = _tasks(si_list)
+    worker1 = proc_command('proc-datacite', lease_owner=lambda: 'host:1:1')
+    worker1.immediate_status_set = frozenset({queue.UNCHECKED})
+    worker2 = proc_command('proc-datacite', lease_owner=lambda: 'host:2:1')
+
+    task_list = worker1.claim_tasks(_qs(seq_list), 3)
+    queue.objects.filter(seq=task_list[2].seq).update(leaseExpires=int(time.time()) - 1)
+    worker2.claim_tasks(_qs(seq_list), 3)
+    done_list = []
+    for task, status in zip(task_list, [queue.UNCHECKED, queue.SUCCESS, queue.FAILURE]):
+        task.status = status
+        task.error = status
+        worker1.finish_task(task, done_list)
+    assert queue.objects.get(seq=task_list[0].seq).status == queue.UNCHECKED
+    assert done_list == task_list[1:]
+
+    with django_assert_num_queries(1):
+        worker1.save_task_list(done_list)
+    assert list(
+        queue.objects.filter(seq__in=seq_list)
+        .order_by('-seq')
+        .values_list('status', 'error', 'leaseOwner')
+    ) == [
+        (queue.UNCHECKED, queue.UNCHECKED, ''),
+        (queue.SUCCESS, queue.SUCCESS, ''),
+        (queue.UNSUBMITTED, '', 'host:2:1'),
+    ]
+
+
+def test_supersede_tasks(proc_command):
+    """Only the latest pending task for each identifier is performed, and the earlier
+    tasks, in or out of the batch, are superseded"""
+    si_list = list(ezidapp.models.identifier.SearchIdentifier.objects.order_by('identifier')[:2])
+    seq_list = _tasks([si_list[0], si_list[1], si_list[0], si_list[0]])
+    queue.objects.filter(seq=seq_list[3]).update(operation=queue.DELETE)
+    worker = proc_command('proc-datacite', lease_owner=lambda: 'host:1:1')
+
+    task_list = worker.claim_tasks(_qs(seq_list[:3]).order_by('seq'), 3)
+    assert [t.seq for t in task_list] == [seq_list[1]]
+    assert list(
+        queue.objects.filter(seq__in=seq_list).order_by('seq').values_list('status', flat=True)
+    ) == [queue.SUPERSEDED, queue.UNSUBMITTED, queue.SUPERSEDED, queue.UNSUBMITTED]
+    task_list = worker.claim_tasks(_qs(seq_list), 3)
+    assert [(t.seq, t.operation) for t in task_list] == [(seq_list[3], queue.DELETE)]
+
+
+def test_run_worker_concurrency(settings, proc_command):
+    """With concurrency, the tasks of a batch are performed by several threads, and are
+    saved together"""
+    settings.DAEMONS_DATACITE_CONCURRENCY = 3
+    si_list = ezidapp.models.identifier.SearchIdentifier.objects.order_by('identifier')[:3]
+    seq_list = _tasks(si_list)
+    worker = proc_command('proc-datacite', lease_owner=lambda: 'host:1:1')
+    thread_set = set()
+
+    def do_task(task_model):
+        thread_set.add(threading.get_ident())
+        time.sleep(0.2)
+
+    def sleep(*args, **kwargs):
+        worker._terminated = True
+
+    worker.do_task = do_task
+    worker.sleep = sleep
+    worker.wait_for_tasks = sleep
+    worker.run_worker()
+    assert len(thread_set) > 1
+    assert set(
+        queue.objects.filter(seq__in=seq_list).values_list('status', 'leaseOwner')
+    ) == {(queue.SUCCESS, '')}
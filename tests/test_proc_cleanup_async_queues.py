@@ -0,0 +1,47 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test the proc-cleanup-async-queues_v2 management command
+"""
+
+import time
+
+import ezidapp.models.async_queue
+import ezidapp.models.identifier
+import impl.enqueue
+
+
+def _ref_id(status_dict):
+    """Create a RefIdentifier with a task in each queue of status_dict"""
+    si = ezidapp.models.identifier.SearchIdentifier.objects.order_by('identifier').first()
+    ref_id = impl.enqueue._copy_to_ref_id_model(si)
+    ref_id.pk = None
+    ref_id.save()
+    for queue, status in status_dict.items():
+        queue.objects.create(
+            refIdentifier=ref_id,
+            enqueueTime=int(time.time()),
+            operation=queue.UPDATE,
+            status=status,
+        )
+    return ref_id.pk
+
+
+def test_delete_completed(proc_command):
+    """Completed tasks are deleted, and RefIdentifiers are deleted only when no queue
+    references them"""
+    command = proc_command('proc-cleanup-async-queues_v2')
+    search = ezidapp.models.async_queue.SearchIndexerQueue
+    datacite = ezidapp.models.async_queue.DataciteQueue
+    done_id = _ref_id({search: search.SUCCESS, datacite: datacite.IGNORED})
+    pending_id = _ref_id({search: search.SUCCESS, datacite: datacite.UNSUBMITTED})
+    unqueued_id = _ref_id({})
+
+    assert command.deleteCompleted([done_id, pending_id, unqueued_id]) == (3, 2)
+
+    ref_id_model = ezidapp.models.identifier.RefIdentifier
+    remaining = ref_id_model.objects.filter(pk__in=[done_id, pending_id, unqueued_id])
+    assert list(remaining.values_list('pk', flat=True)) == [pending_id]
+    pending_rows = datacite.objects.filter(refIdentifier_id=pending_id)
+    assert list(pending_rows.values_list('status', flat=True)) == [datacite.UNSUBMITTED]
+    assert not search.objects.filter(refIdentifier_id=pending_id).exists()
@@ -0,0 +1,171 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test the proc-download management command
+"""
+
+import gzip
+import importlib
+import os
+import time
+
+import pytest
+
+import ezidapp.models.async_queue
+import ezidapp.models.download_result
+import ezidapp.models.identifier
+
+proc_download = importlib.import_module('ezidapp.management.commands.proc-download')
+
+
+@pytest.mark.parametrize(
+    'constraints,predicate',
+    (
+        ({'type': ['doi']}, lambda si: si.isDoi),
+        ({'type': ['ark', 'uuid']}, lambda si: not si.isDoi),
+        ({'status': ['public']}, lambda si: si.isPublic),
+        ({'status': ['reserved', 'unavailable']}, lambda si: not si.isPublic),
+        ({'crossref': True}, lambda si: si.isCrossref),
+        ({'datacite': False}, lambda si: not si.isDatacite),
+        ({'permanence': 'real'}, lambda si: not si.isTest),
+        ({'createdAfter': 1500000000}, lambda si: si.createTime >= 1500000000),
+        (
+            {'updatedAfter': 1400000000, 'updatedBefore': 1600000000},
+            lambda si: 1400000000 <= si.updateTime < 1600000000,
+        ),
+    ),
+)
+def test_constraint_filter(constraints, predicate, proc_command):
+    """Constraints select the same identifiers in SQL as when checked in Python"""
+    command = proc_command('proc-download')
+    qs = ezidapp.models.identifier.SearchIdentifier.objects
+    expected = sorted(si.identifier for si in qs.all() if predicate(si))
+    filtered = qs.filter(command._constraintFilter(constraints))
+    assert sorted(filtered.values_list('identifier', flat=True)) == expected
+
+
+def _download_request(estimatedCount, enqueueTime, toHarvest='ark:/99166/p9test'):
+    return ezidapp.models.async_queue.DownloadQueue.objects.create(
+        enqueueTime=enqueueTime,
+        rawRequest='format=anvl',
+        requestor='ark:/99166/p9test',
+        format=ezidapp.models.async_queue.DownloadQueue.ANVL,
+        compression=ezidapp.models.async_queue.DownloadQueue.GZIP,
+        columns='L',
+        constraints='D',
+        options='DSconvertTimestamps=BFalse',
+        notify='L',
+        toHarvest=toHarvest,
+        estimatedCount=estimatedCount,
+    )
+
+
+def test_claim(settings, proc_command):
+    """Requests are claimed smallest first, except for requests that have waited too
+    long, and each request is claimed by only one worker
+    """
+    settings.DAEMONS_DOWNLOAD_MAX_WAIT = 60 * 60
+    now = int(time.time())
+    large = _download_request(1000000, now)
+    small = _download_request(10, now)
+    old = _download_request(2000000, now - 2 * 60 * 60)
+    command = proc_command('proc-download')
+    claimed = [command._claim() for _ in range(4)]
+    assert [r and r.seq for r in claimed] == [old.seq, small.seq, large.seq, None]
+    assert all(r.leaseOwner != '' and r.leaseExpires > now for r in claimed[:3])
+
+
+def test_gzip_upload_stream(settings, tmp_path):
+    """Streamed downloads are uploaded as parts that together form a valid gzip file,
+    and the stream can be reopened after the last uploaded part
+    """
+    settings.S3_LOCAL_DIR = tmp_path
+    settings.DAEMONS_DOWNLOAD_PART_SIZE = 1000
+    upload_id = proc_download.impl.s3.create_multipart_upload('bucket', 'download/x.txt.gz')
+    f = proc_download._GzipUploadStream('bucket', 'download/x.txt.gz', upload_id, [], 0)
+    # random data, so that each half compresses to more than a part
+    lines = [f'{i}: {os.urandom(8).hex()}\n' for i in range(10000)]
+    for line in lines[:5000]:
+        f.write(line)
+    assert f.uploadPart()
+    assert not f.uploadPart()
+    position = f.tell()
+    f = proc_download._GzipUploadStream(
+        'bucket', 'download/x.txt.gz', upload_id, f.etag_list, position
+    )
+    for line in lines[5000:]:
+        f.write(line)
+    assert f.uploadPart(final=True)
+    assert f.tell() == len(''.join(lines))
+    proc_download.impl.s3.complete_multipart_upload(
+        'bucket', 'download/x.txt.gz', upload_id, f.etag_list
+    )
+    assert len(f.etag_list) == 2
+    with gzip.open(tmp_path / 'bucket' / 'download' / 'x.txt.gz', 'rt') as g:
+        assert g.read() == ''.join(lines)
+
+
+def test_reuse_result(settings, tmp_path):
+    """An identical request reuses an earlier download until an identifier in scope
+    changes
+    """
+    settings.S3_LOCAL_DIR = tmp_path
+    si = ezidapp.models.identifier.SearchIdentifier.objects.first()
+    command = proc_download.Command()
+
+    def request(filename):
+        r = _download_request(None, int(time.time()), si.owner.pid)
+        r.filename = filename
+        return r
+
+    r1 = request('result1')
+    assert not command._reuseResult(r1)
+    path = tmp_path / settings.S3_BUCKET / settings.S3_BUCKET_DOWNLOAD_PATH
+    path.mkdir(parents=True)
+    (path / 'result1.txt.gz').write_bytes(b'result')
+    command._saveResult(r1)
+    r2 = request('result2')
+    assert command._reuseResult(r2)
+    assert r2.stage == ezidapp.models.async_queue.DownloadQueue.NOTIFY
+    assert (path / 'result2.txt.gz').read_bytes() == b'result'
+    ezidapp.models.identifier.SearchIdentifier.objects.filter(pk=si.pk).update(
+        updateTime=int(time.time()) + 1
+    )
+    assert not command._reuseResult(request('result3'))
+    assert (command._resultHits, command._resultMisses) == (1, 2)
+
+
+def test_save_lost_lease(proc_command):
+    """A worker that has lost its lease on a request does not overwrite the request or
+    the new owner's lease"""
+    _download_request(10, int(time.time()))
+    command = proc_command('proc-download')
+    r = command._claim()
+    r.lastId = 'ark:/99999/fk4first'
+    command._save(r)
+    ezidapp.models.async_queue.DownloadQueue.objects.filter(seq=r.seq).update(
+        leaseOwner='otherhost:1:1'
+    )
+    r.lastId = 'ark:/99999/fk4second'
+    with pytest.raises(proc_download._LeaseLost):
+        command._save(r)
+    r = ezidapp.models.async_queue.DownloadQueue.objects.get(seq=r.seq)
+    assert (r.lastId, r.leaseOwner) == ('ark:/99999/fk4first', 'otherhost:1:1')
+
+
+def test_remove_expired_results(settings, tmp_path):
+    """Download results are deleted once their files have expired"""
+    settings.DAEMONS_DOWNLOAD_WORK_DIR = tmp_path
+    settings.DAEMONS_DOWNLOAD_PUBLIC_DIR = tmp_path
+    now = int(time.time())
+    for fingerprint, createTime in (
+        ('expired', now - settings.DAEMONS_DOWNLOAD_FILE_LIFETIME - 1),
+        ('current', now - 1),
+    ):
+        ezidapp.models.download_result.DownloadResult.objects.create(
+            fingerprint=fingerprint, filename=f'{fingerprint}.csv.gz', size=1, createTime=createTime
+        )
+    proc_download.Command()._remove_expired_files()
+    assert list(
+        ezidapp.models.download_result.DownloadResult.objects.values_list('fingerprint', flat=True)
+    ) == ['current']
@@ -0,0 +1,84 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test the proc-stats management command
+"""
+
+import time
+
+import pytest
+
+import ezidapp.models.async_queue
+import ezidapp.models.group
+import ezidapp.models.identifier
+import ezidapp.models.realm
+import ezidapp.models.statistics
+import impl.enqueue
+
+
+def _statistics():
+    return sorted(
+        ezidapp.models.statistics.Statistics.objects.values_list(
+            'month', 'owner', 'ownergroup', 'realm', 'type', 'hasMetadata', 'count'
+        )
+    )
+
+
+@pytest.fixture
+def agent_names():
+    """Fill in the group PIDs and realm names that are blank in the test database, as
+    they are required in statistics"""
+    for realm in ezidapp.models.realm.Realm.objects.filter(name=''):
+        realm.name = f'realm{realm.pk}'
+        realm.save()
+    ezidapp.models.group.Group.objects.filter(pid='').update(pid='ark:/99166/p9test')
+
+
+def test_month_range(proc_command):
+    command = proc_command('proc-stats')
+    begin_ts, end_ts = command._monthRange('2023-12')
+    assert command._timestampToMonth(begin_ts) == '2023-12'
+    assert command._timestampToMonth(begin_ts - 1) == '2023-11'
+    assert command._timestampToMonth(end_ts) == '2024-01'
+    assert command._timestampToMonth(end_ts - 1) == '2023-12'
+
+
+def test_update_statistics(agent_names, settings, proc_command):
+    """An incremental update gives the same statistics as a full recompute"""
+    queue_model = ezidapp.models.async_queue.SearchIndexerQueue
+    queue_model.objects.update(status=queue_model.SUCCESS)
+    command = proc_command('proc-stats')
+    command.recomputeStatistics()
+    assert ezidapp.models.statistics.StatisticsState.objects.get().queueSeq is not None
+
+    si = (
+        ezidapp.models.identifier.SearchIdentifier.objects.filter(isTest=False)
+        .exclude(owner=None)
+        .order_by('identifier')
+        .first()
+    )
+    si.hasMetadata = not si.hasMetadata
+    ezidapp.models.identifier.SearchIdentifier.objects.filter(pk=si.pk).update(
+        hasMetadata=si.hasMetadata
+    )
+    task_model = queue_model.objects.create(
+        refIdentifier=impl.enqueue.create_ref_id_model(si),
+        enqueueTime=int(time.time()),
+        operation=queue_model.UPDATE,
+        status=queue_model.SUCCESS,
+    )
+    queue_seq = ezidapp.models.statistics.StatisticsState.objects.get().queueSeq
+
+    # A recently enqueued task is not moved past, as a task with a lower seq may not
+    # have been committed yet
+    command.updateStatistics()
+    assert ezidapp.models.statistics.StatisticsState.objects.get().queueSeq == queue_seq
+
+    queue_model.objects.filter(pk=task_model.pk).update(
+        enqueueTime=int(time.time()) - settings.DAEMONS_STATISTICS_QUEUE_LAG - 1
+    )
+    command.updateStatistics()
+    assert ezidapp.models.statistics.StatisticsState.objects.get().queueSeq == task_model.seq
+    updated = _statistics()
+    command.recomputeStatistics()
+    assert updated == _statistics()
@@ -0,0 +1,66 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test impl.queue_notify
+"""
+
+import os
+import socket
+
+import pytest
+
+import ezidapp.models.async_queue
+import ezidapp.models.identifier
+import impl.enqueue
+import impl.queue_notify
+
+search_queue = ezidapp.models.async_queue.SearchIndexerQueue
+datacite_queue = ezidapp.models.async_queue.DataciteQueue
+
+
+@pytest.fixture
+def notify_dir(tmp_path, settings):
+    settings.DAEMONS_QUEUE_NOTIFY_DIR = str(tmp_path)
+    return tmp_path
+
+
+def test_notify(notify_dir):
+    """Only the listeners of the notified queues are woken up"""
+    search_listener = impl.queue_notify.Listener(search_queue)
+    datacite_listener = impl.queue_notify.Listener(datacite_queue)
+    try:
+        assert not search_listener.wait(0)
+        impl.queue_notify.notify([search_queue])
+        impl.queue_notify.notify([search_queue])
+        assert search_listener.wait(0)
+        assert not search_listener.wait(0)
+        assert not datacite_listener.wait(0)
+    finally:
+        search_listener.close()
+        datacite_listener.close()
+    assert not os.listdir(notify_dir)
+
+
+def test_notify_stale(notify_dir):
+    """Sockets left behind by workers that died are removed"""
+    path = os.path.join(notify_dir, f'{search_queue._meta.db_table}.1.1.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.close()
+    impl.queue_notify.notify([search_queue])
+    assert not os.path.exists(path)
+
+
+def test_enqueue(notify_dir, db, django_capture_on_commit_callbacks):
+    """enqueue() wakes up the workers when the transaction commits"""
+    si = ezidapp.models.identifier.Identifier.objects.filter(isTest=False).first()
+    listener = impl.queue_notify.Listener(search_queue)
+    try:
+        with django_capture_on_commit_callbacks() as callbacks:
+            impl.enqueue.enqueue(si, 'update', updateExternalServices=False)
+            assert not listener.wait(0)
+        assert len(callbacks) == 1
+        callbacks[0]()
+        assert listener.wait(0)
+    finally:
+        listener.close()
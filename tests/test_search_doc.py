@@ -0,0 +1,67 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test impl.search_doc
+"""
+
+from unittest.mock import MagicMock, Mock, PropertyMock
+
+import ezidapp.models.identifier
+import impl.search_doc
+from impl.open_search_doc import OpenSearchDoc
+
+
+def _identifier():
+    identifier = MagicMock(spec=ezidapp.models.identifier.Identifier)
+    identifier.identifier = 'ark:/99999/fk4test'
+    identifier.target = 'https://example.org/target'
+    identifier.defaultTarget = 'https://ezid.cdlib.org/id/ark:/99999/fk4test'
+    identifier.isDatacite = False
+    identifier.isPublic = True
+    identifier.exported = True
+    identifier.isTest = False
+    identifier.owner.username = 'testuser'
+    identifier.ownergroup.groupname = 'testgroup'
+    identifier.metadata = {'erc.who': 'Test Creator', 'erc.what': 'Test Title'}
+    km = Mock()
+    km.creator = 'Test Creator'
+    km.title = 'Test Title'
+    km.publisher = None
+    km.date = '2022-01-01'
+    km.type = 'Dataset/dataset'
+    km.validatedDate = '2022'
+    km.validatedType = 'Dataset/dataset'
+    kernel_metadata = PropertyMock(return_value=km)
+    type(identifier).kernelMetadata = kernel_metadata
+    return identifier, kernel_metadata
+
+
+def test_search_values():
+    identifier, _ = _identifier()
+    values = impl.search_doc.SearchDocBuilder(identifier).search_identifier_values()
+    assert values['searchableTarget'] == 'tegrat/gro.elpmaxe//:sptth'
+    assert values['resourceCreator'] == 'Test Creator'
+    assert values['resourcePublisher'] == ''
+    assert values['searchablePublicationYear'] == 2022
+    assert values['searchableResourceType'] == 'D'
+    assert values['keywords'] == (
+        'ark:/99999/fk4test ; testuser ; testgroup ; https://example.org/target'
+        ' ; Test Creator ; Test Title'
+    )
+    assert values['hasMetadata'] is True
+    assert values['publicSearchVisible'] is True
+    assert values['oaiVisible'] is True
+
+
+def test_metadata_mapped_once():
+    """A builder shared by the SearchIdentifier columns and the OpenSearch document maps
+    the metadata once
+    """
+    identifier, kernel_metadata = _identifier()
+    builder = impl.search_doc.SearchDocBuilder(identifier)
+    values = builder.search_identifier_values()
+    open_s = OpenSearchDoc(identifier=identifier, search_identifier=None, builder=builder)
+    assert open_s.word_bucket == values['keywords']
+    assert open_s.oai_visible == values['oaiVisible']
+    assert open_s.resource['creators'] == ['Test Creator']
+    assert kernel_metadata.call_count == 1
@@ -0,0 +1,49 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test longest-prefix matching of identifiers to shoulders
+"""
+
+import ezidapp.models.shoulder
+
+
+def _longestMatch(identifier):
+    lm = None
+    for s in ezidapp.models.shoulder.Shoulder.objects.all():
+        if not identifier.lower().startswith(s.prefix.lower()):
+            continue
+        if lm is None or len(s.prefix) > len(lm.prefix):
+            lm = s
+    return lm
+
+
+class TestShoulderMatch:
+    def test_1000(self):
+        """getLongestShoulderMatch() returns the same shoulders as a full scan"""
+        for s in ezidapp.models.shoulder.Shoulder.objects.all():
+            for identifier in (s.prefix, s.prefix + 'x1', s.prefix[:-1], s.prefix.lower()):
+                expected = _longestMatch(identifier)
+                match = ezidapp.models.shoulder.getLongestShoulderMatch(identifier)
+                assert (match and match.prefix) == (expected and expected.prefix)
+        assert ezidapp.models.shoulder.getLongestShoulderMatch('ark:/') is None
+
+    def test_1005(self):
+        """Matching ignores case, as DOIs may be given with a lowercase suffix"""
+        s = ezidapp.models.shoulder.Shoulder.objects.filter(
+            prefix__startswith='doi:', prefix__regex='[A-Z]'
+        ).first()
+        assert ezidapp.models.shoulder.getLongestShoulderMatch(s.prefix.lower() + 'x1') == s
+
+    def test_1010(self):
+        """Saving a shoulder updates the cached shoulders"""
+        s = ezidapp.models.shoulder.Shoulder.objects.filter(type='ARK').first()
+        assert ezidapp.models.shoulder.getLongestShoulderMatch(s.prefix + 'zz9x1') == s
+        nested = ezidapp.models.shoulder.Shoulder.objects.create(
+            prefix=s.prefix + 'zz9',
+            type='ARK',
+            name='Nested test shoulder',
+            isTest=False,
+        )
+        assert ezidapp.models.shoulder.getLongestShoulderMatch(s.prefix + 'zz9x1') == nested
+        nested.delete()
+        assert ezidapp.models.shoulder.getLongestShoulderMatch(s.prefix + 'zz9x1') == s
@@ -0,0 +1,56 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Test impl.userauth
+"""
+
+import django.contrib.auth.hashers
+import pytest
+
+import ezidapp.models.user
+import impl.userauth
+
+
+@pytest.fixture
+def credential_cache(monkeypatch):
+    cache = impl.userauth._CredentialCache()
+    monkeypatch.setattr(impl.userauth, '_credentialCache', cache)
+    return cache
+
+
+def _user(password):
+    return ezidapp.models.user.User(
+        username='authtest',
+        loginEnabled=True,
+        password=django.contrib.auth.hashers.make_password(password),
+    )
+
+
+class TestUserAuth:
+    def test_1000(self, db, credential_cache):
+        """Verified credentials are cached until the password changes"""
+        user = _user('pw1')
+        assert impl.userauth._checkPassword(user, 'pw1')
+        assert impl.userauth._checkPassword(user, 'pw1')
+        assert impl.userauth.getCredentialCacheStatus() == (1, 1)
+        assert not impl.userauth._checkPassword(user, 'pw2')
+        user.password = django.contrib.auth.hashers.make_password('pw2')
+        assert not impl.userauth._checkPassword(user, 'pw1')
+        assert impl.userauth._checkPassword(user, 'pw2')
+        assert impl.userauth.getCredentialCacheStatus() == (1, 4)
+
+    def test_1010(self, db, credential_cache):
+        """Cached credentials are not accepted for users with logins disabled"""
+        user = _user('pw1')
+        assert impl.userauth._checkPassword(user, 'pw1')
+        user.loginEnabled = False
+        assert not impl.userauth._checkPassword(user, 'pw1')
+
+    def test_1020(self, credential_cache, settings):
+        """The cache evicts the least recently used credentials"""
+        settings.AUTH_CACHE_MAX_SIZE = 2
+        for password in ('pw1', 'pw2', 'pw3'):
+            credential_cache.add('authtest', password, 'hash')
+        assert not credential_cache.check('authtest', 'pw1', 'hash')
+        assert credential_cache.check('authtest', 'pw2', 'hash')
+        assert credential_cache.check('authtest', 'pw3', 'hash')
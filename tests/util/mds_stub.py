@@ -0,0 +1,158 @@
+#  Copyright©2021, Regents of the University of California
+#  http://creativecommons.org/licenses/BSD
+
+"""Stub of the DataCite MDS API, for tests and benchmarks
+
+Implements the subset of the MDS API used by impl.datacite: registering and reading the
+target URLs of DOIs, and uploading and deactivating metadata. State is held in memory.
+The server supports HTTP/1.1 keep-alive, and counts the connections and requests it
+receives, so that connection reuse can be checked.
+
+To run standalone, e.g., for benchmarking proc-datacite against a remote service with
+50 ms latency:
+
+    python tests/util/mds_stub.py --port 8000 --delay 0.05
+
+and set DATACITE_DOI_URL to http://localhost:8000/doi and DATACITE_METADATA_URL to
+http://localhost:8000/metadata.
+"""
+
+import argparse
+import http.server
+import re
+import threading
+import time
+import urllib.parse
+
+IDENTIFIER_RE = re.compile(r'<identifier[^>]*>([^<]*)</identifier>')
+
+
+class MdsStubServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), delay_sec=0.0):
+        super().__init__(address, _Handler)
+        self.delay_sec = delay_sec
+        # DOI -> target URL
+        self.target_dict = {}
+        # DOI -> metadata XML
+        self.metadata_dict = {}
+        # DOIs with deactivated metadata
+        self.inactive_set = set()
+        self.connection_count = 0
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve requests in a background thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        doi = self._doi('/doi/')
+        if doi is None:
+            return self._respond(404, 'Not found')
+        with self.server.lock:
+            target = self.server.target_dict.get(doi)
+        if target is None:
+            return self._respond(404, 'DOI not found')
+        self._respond(200, target)
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path == '/doi':
+            field_dict = dict(
+                line.split('=', 1) for line in body.splitlines() if '=' in line
+            )
+            doi, url = field_dict.get('doi'), field_dict.get('url')
+            if not doi or not url:
+                return self._respond(400, 'param doi and url required')
+            if not re.match('https?://', url):
+                return self._respond(400, '[url] must be an http or https URL')
+            with self.server.lock:
+                self.server.target_dict[doi] = url
+            return self._respond(201, 'OK')
+        if self.path == '/metadata':
+            m = IDENTIFIER_RE.search(body)
+            if m is None:
+                return self._respond(400, 'DOI not found in the metadata')
+            doi = m.group(1)
+            with self.server.lock:
+                self.server.metadata_dict[doi] = body
+                self.server.inactive_set.discard(doi)
+            return self._respond(201, f'OK ({doi})')
+        self._respond(404, 'Not found')
+
+    def do_DELETE(self):
+        doi = self._doi('/metadata/')
+        if doi is None:
+            return self._respond(404, 'Not found')
+        with self.server.lock:
+            is_found = doi in self.server.metadata_dict
+            if is_found:
+                self.server.inactive_set.add(doi)
+        if not is_found:
+            return self._respond(404, 'DOI not found')
+        self._respond(200, 'OK')
+
+    def _doi(self, prefix):
+        if not self.path.startswith(prefix):
+            return None
+        return urllib.parse.unquote(self.path[len(prefix):])
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length).decode('utf-8')
+
+    def _respond(self, status, body_str):
+        with self.server.lock:
+            self.server.request_count += 1
+        if self.server.delay_sec:
+            time.sleep(self.server.delay_sec)
+        body = body_str.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument(
+        '--delay', type=float, default=0.0, help='Seconds to delay each response'
+    )
+    args = parser.parse_args()
+    server = MdsStubServer((args.host, args.port), args.delay)
+    print(f'Serving DataCite MDS stub at {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
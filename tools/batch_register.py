@@ -22,6 +22,9 @@ Usage: batch-register [options] operation mappings input.csv
   input.csv: input metadata in CSV form
 
   options:
+    -b BATCHSIZE    Register up to this many identifiers per request,
+                    using EZID's batch operations. Defaults to 1,
+                    which registers one identifier per request.
     -c CREDENTIALS  Either username:password, or just username
                     (password will be prompted for), or
                     sessionid=... (as obtained by using the EZID
@@ -467,6 +470,72 @@ def process1(args, record):
             c.close()
 
 
+def processBatch(args, records):
+    # records: [metadata dictionary, ...]
+    # returns: [(identifier or None, "error: ..." or None), ...]
+    # N.B.: _id is removed from each record
+    def escape(s):
+        return re.sub("[%\r\n]", lambda c: "%%%02X" % ord(c.group(0)), s)
+
+    id_list = []
+    body = ""
+    for record in records:
+        if args.operation == "mint":
+            id_str = None
+            if args.removeIdMapping and "_id" in record:
+                del record["_id"]
+        else:
+            id_str = str(record["_id"])
+            del record["_id"]
+        id_list.append(id_str)
+        body += ":: %s\n%s\n" % (escape(id_str or ""), toAnvl(record))
+    if args.operation == "mint":
+        r = urllib.request.Request(
+            "https://ezid.cdlib.org/shoulder/"
+            + urllib.parse.quote(args.shoulder, ":/")
+            + "?count=%d" % len(records)
+        )
+    else:
+        r = urllib.request.Request("https://ezid.cdlib.org/id/")
+        r.get_method = lambda: "PUT" if args.operation == "create" else "POST"
+    s = body.encode("UTF-8")
+    r.data = s
+    r.add_header("Content-Type", "text/plain; charset=UTF-8")
+    r.add_header("Content-Length", str(len(s)))
+    if args.cookie is not None:
+        r.add_header("Cookie", args.cookie)
+    else:
+        r.add_header("Authorization", util.basic_auth(args.username, args.password))
+    c = None
+    try:
+        c = urllib.request.urlopen(r)
+        lines = c.read().decode("UTF-8").splitlines()
+        assert len(lines) > 0 and lines[0].startswith("success:"), "\n".join(lines)
+        # One status line per record follows the overall status line.
+        results = []
+        for id_str, s in zip(id_list, lines[1:]):
+            if s.startswith("success:"):
+                results.append((s[8:].split()[0], None))
+            else:
+                results.append((id_str, s))
+        for id_str in id_list[len(results) :]:
+            results.append((id_str, "error: no status returned"))
+        return results
+    except urllib.error.HTTPError as e:
+        if e.fp is not None:
+            s = e.fp.read().decode("UTF-8")
+            if not s.startswith("error:"):
+                s = "error: " + s
+        else:
+            s = "error: %d %s" % (e.code, str(e))
+        return [(id_str, s) for id_str in id_list]
+    except Exception as e:
+        return [(id_str, "error: " + str(e)) for id_str in id_list]
+    finally:
+        if c is not None:
+            c.close()
+
+
 def formOutputRow(args, row, record, recordNum, id_str, error):
     # row: [value1, value2, ...]
     # record: metadata dictionary
@@ -497,6 +566,21 @@ def process(args, mappings):
         lineterminator = "\r\n"
 
     w = csv.writer(sys.stdout)
+
+    def writeRow(row, record, recordNum, id_str, error):
+        w.writerow(
+            [c.encode("UTF-8") for c in formOutputRow(args, row, record, recordNum, id_str, error)]
+        )
+        sys.stdout.flush()
+
+    def flushBatch():
+        # batch: [(recordNum, row, record), ...]
+        results = processBatch(args, [record for _, _, record in batch])
+        for (recordNum, row, record), (id_str, error) in zip(batch, results):
+            writeRow(row, record, recordNum, id_str, error)
+        del batch[:]
+
+    batch = []
     n = 0
     for row in csv.reader(
         open(args.inputFile), dialect=(StrictTabDialect if args.tabMode else csv.excel)
@@ -516,17 +600,17 @@ def process(args, mappings):
             if args.previewMode:
                 sys.stdout.buffer.write(b"\n")
                 sys.stdout.buffer.write(toAnvl(record).encode('utf-8'))
+            elif args.batchSize > 1:
+                batch.append((n, row, record))
+                if len(batch) == args.batchSize:
+                    flushBatch()
             else:
                 id_str, error = process1(args, record)
-                w.writerow(
-                    [
-                        c.encode("UTF-8")
-                        for c in formOutputRow(args, row, record, n, id_str, error)
-                    ]
-                )
-                sys.stdout.flush()
+                writeRow(row, record, n, id_str, error)
         except Exception as e:
             assert False, "record %d: %s" % (n, str(e))
+    if batch:
+        flushBatch()
 
 
 def main():
@@ -541,6 +625,15 @@ def main():
     )
     p.add_argument("mappingsFile", metavar="mappings", help="configuration file")
     p.add_argument("inputFile", metavar="input.csv", help="input metadata in CSV form")
+    p.add_argument(
+        "-b",
+        metavar="BATCHSIZE",
+        dest="batchSize",
+        type=int,
+        default=1,
+        help="register up to this many identifiers per request, using EZID's "
+        + "batch operations, defaults to 1",
+    )
     p.add_argument(
         "-c",
         metavar="CREDENTIALS",
@@ -238,17 +238,26 @@ def datetime_disp(x):
 
 
 @register.simple_tag
-def pager_display(request, current_page, total_pages, page_size, select_position):
+def pager_display(request, current_page, total_pages, page_size, select_position, cursors=None):
+    """Pages past the first 10,000 results can't be selected by number, and are
+    only shown if 'cursors' holds the cursors for reaching the previous, next and last
+    pages by search_after (see impl.ui_search).
+    """
     if total_pages < 2:
         return ''
     p_out = ''
-    # only show 10,000 results since that is all opensearch will give in a reasonable configuration
+    # only 10,000 results can be selected by page number, since that is all opensearch
+    # will give with from / size in a reasonable configuration
     if total_pages * page_size > 10_000:
-        mod_total_pages = int(10_000 / page_size)
-        s_total = str(mod_total_pages)
+        max_select_page = int(10_000 / page_size)
+    else:
+        max_select_page = total_pages
+    if not cursors:
+        mod_total_pages = max_select_page
+        cursors = {}
     else:
         mod_total_pages = total_pages
-        s_total = str(total_pages)
+    s_total = str(mod_total_pages)
     empty = ''
     if current_page > 1:
         p_out += (
@@ -270,6 +279,7 @@ def pager_display(request, current_page, total_pages, page_size, select_position
                 page_size,
                 'pagination__prev',
                 _("Previous page of results"),
+                cursors.get('prev'),
             )
             + ' '
         )
@@ -292,17 +302,19 @@ def pager_display(request, current_page, total_pages, page_size, select_position
                 page_size,
                 'pagination__next',
                 _("Next page of results"),
+                cursors.get('next'),
             )
             + ' '
         )
         p_out += (
             page_link(
                 request,
-                total_pages,
+                mod_total_pages,
                 "",
                 page_size,
                 'pagination__last',
                 _("Last page of results"),
+                cursors.get('last'),
             )
             + ' '
         )
@@ -317,7 +329,7 @@ def pager_display(request, current_page, total_pages, page_size, select_position
         + select_position
         + "' type='number' class='pagination__input' min='1' "
         + "max='"
-        + s_total
+        + str(max_select_page)
         + "' name='p' value='"
         + str(current_page)
         + "'/> "
@@ -326,12 +338,15 @@ def pager_display(request, current_page, total_pages, page_size, select_position
     return p_out
 
 
-def page_link(_request, this_page, link_text, _page_size, cname, title=None):
+def page_link(_request, this_page, link_text, _page_size, cname, title=None, cursor=None):
     attr_aria = " aria-label='" + title + "'" if title else ""
+    attr_cursor = " data-cursor='" + django.utils.html.escape(cursor) + "'" if cursor else ""
     return (
         "<button data-page='"
         + str(this_page)
-        + "' class='"
+        + "'"
+        + attr_cursor
+        + " class='"
         + cname
         + "'"
         + attr_aria